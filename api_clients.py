@@ -0,0 +1,144 @@
+# api_clients.py - Process-wide, pooled API clients for Groq and ElevenLabs
+
+import os
+import logging
+import threading
+import httpx
+
+GROQ_DEFAULT_BASE_URL = "https://api.groq.com"
+ELEVENLABS_DEFAULT_BASE_URL = "https://api.elevenlabs.io"
+
+# One keep-alive pool per provider, shared by every session and thread
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def get_groq_api_key():
+    return os.environ.get("GROQ_API_KEY")
+
+
+def get_elevenlabs_api_key():
+    return os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
+
+
+def groq_base_url():
+    """Groq endpoint; GROQ_BASE_URL points the app at a local stand-in"""
+    return os.environ.get("GROQ_BASE_URL") or GROQ_DEFAULT_BASE_URL
+
+
+def elevenlabs_base_url():
+    """ElevenLabs endpoint; ELEVENLABS_BASE_URL points the app at a local stand-in"""
+    return os.environ.get("ELEVENLABS_BASE_URL") or ELEVENLABS_DEFAULT_BASE_URL
+
+
+def gtts_base_url():
+    """Google Translate endpoint override for gTTS; GTTS_BASE_URL points it at a local stand-in (None = Google)"""
+    return os.environ.get("GTTS_BASE_URL") or None
+
+
+def _new_http_client():
+    return httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+def _build_groq(api_key, base_url, http_client):
+    from groq import Groq
+    # Retries are done by resilience.call_with_retry, which also feeds the circuit breaker
+    return Groq(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+
+def _build_elevenlabs(api_key, base_url, http_client):
+    from elevenlabs.client import ElevenLabs
+    return ElevenLabs(api_key=api_key, base_url=base_url, httpx_client=http_client)
+
+
+def _get_client(provider, api_key, base_url, build):
+    """
+    Return the cached client for provider, building it on first use or when
+    the API key or base URL has changed (e.g. a new key entered in Settings).
+    """
+    config = (api_key, base_url)
+    with _lock:
+        entry = _clients.get(provider)
+        if entry is None or entry["config"] != config:
+            if entry is not None:
+                logging.info(f"Rebuilding {provider} client after configuration change")
+                # Requests still in flight on the old pool keep their reference;
+                # the old pool is closed when it is garbage collected.
+            http_client = _new_http_client()
+            entry = {
+                "config": config,
+                "client": build(api_key, base_url, http_client),
+                "http_client": http_client,
+            }
+            _clients[provider] = entry
+        return entry["client"]
+
+
+def get_groq_client(api_key=None):
+    """Shared Groq client (chat + audio) for the current GROQ_API_KEY"""
+    return _get_client("groq", api_key or get_groq_api_key(), groq_base_url(), _build_groq)
+
+
+def get_elevenlabs_client(api_key=None):
+    """Shared ElevenLabs client for the current ELEVENLABS_API_KEY"""
+    api_key = api_key or get_elevenlabs_api_key()
+    if not api_key:
+        raise Exception("ElevenLabs API key not found. Set ELEVENLABS_API_KEY or ELEVEN_API_KEY environment variable.")
+    return _get_client("elevenlabs", api_key, elevenlabs_base_url(), _build_elevenlabs)
+
+
+def _http_client(provider):
+    with _lock:
+        entry = _clients.get(provider)
+        return entry["http_client"] if entry else None
+
+
+def warm_up(background=True):
+    """
+    Open the provider connections ahead of the first real request so it does
+    not pay DNS + TCP + TLS setup. Any HTTP status counts as warmed; only
+    connection errors are logged.
+
+    Args:
+        background (bool): Run in a daemon thread and return immediately
+
+    Returns:
+        threading.Thread or dict: the warm-up thread, or {provider: seconds or error}
+    """
+    def run():
+        results = {}
+        targets = []
+        if get_groq_api_key():
+            get_groq_client()
+            targets.append(("groq", groq_base_url()))
+        if get_elevenlabs_api_key():
+            get_elevenlabs_client()
+            targets.append(("elevenlabs", elevenlabs_base_url()))
+
+        for provider, base_url in targets:
+            http_client = _http_client(provider)
+            try:
+                response = http_client.head(base_url)
+                results[provider] = round(response.elapsed.total_seconds(), 4)
+            except Exception as e:
+                logging.warning(f"Warm-up for {provider} failed: {e}")
+                results[provider] = f"error: {e}"
+        return results
+
+    if not background:
+        return run()
+    thread = threading.Thread(target=run, name="api-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def reset_clients():
+    """Drop every cached client (used by tests and benchmarks)"""
+    with _lock:
+        entries = list(_clients.values())
+        _clients.clear()
+    for entry in entries:
+        entry["http_client"].close()
@@ -0,0 +1,222 @@
+# batch_process.py - Headless batch runner for image/audio cases
+#
+# Usage:
+#   python batch_process.py cases/ --output results.jsonl --workers 4
+#   python batch_process.py manifest.jsonl --output results.jsonl --audio-dir voices/
+#
+# A case directory is matched by file stem (rash.jpg + rash.wav) or holds one
+# sub-directory per case with an image and/or an audio file inside. A
+# manifest is JSONL ({"id": ..., "image": ..., "audio": ...}) or CSV with
+# the same columns; relative paths are resolved against the manifest.
+
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from diagnosis_pipeline import run_pipeline, is_speakable
+from request_scheduler import request_context, scheduler, PRIORITY_BATCH
+from metrics import metrics, percentile
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".ogg", ".m4a", ".flac", ".webm"}
+
+
+def _case_from_files(case_id, paths):
+    case = {"id": case_id, "image": None, "audio": None}
+    for path in sorted(paths):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in IMAGE_EXTENSIONS and case["image"] is None:
+            case["image"] = path
+        elif extension in AUDIO_EXTENSIONS and case["audio"] is None:
+            case["audio"] = path
+    return case if case["image"] or case["audio"] else None
+
+
+def discover_cases(source):
+    """
+    List cases from a directory or a manifest file.
+
+    Returns:
+        list: dicts with id, image (path or None) and audio (path or None)
+    """
+    if os.path.isdir(source):
+        cases, loose_files = [], {}
+        for entry in sorted(os.listdir(source)):
+            path = os.path.join(source, entry)
+            if os.path.isdir(path):
+                case = _case_from_files(entry, [os.path.join(path, name) for name in os.listdir(path)])
+                if case:
+                    cases.append(case)
+            else:
+                loose_files.setdefault(os.path.splitext(entry)[0], []).append(path)
+        for stem, paths in sorted(loose_files.items()):
+            case = _case_from_files(stem, paths)
+            if case:
+                cases.append(case)
+        return cases
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as manifest:
+        if source.endswith(".csv"):
+            rows = list(csv.DictReader(manifest))
+        else:
+            rows = [json.loads(line) for line in manifest if line.strip()]
+
+    cases = []
+    for index, row in enumerate(rows):
+        case = {"id": str(row.get("id") or index), "image": None, "audio": None}
+        for field in ("image", "audio"):
+            if row.get(field):
+                case[field] = os.path.join(base_dir, row[field])
+        cases.append(case)
+    return cases
+
+
+def load_checkpoint(checkpoint_path):
+    """IDs of cases that already completed in an earlier run"""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as checkpoint:
+        return {line.strip() for line in checkpoint if line.strip()}
+
+
+def case_failed(result, speak=True):
+    """
+    True when any stage of a case failed: the pipeline raised, the transcript
+    or the analysis is an error string, or an answer was to be spoken but no
+    audio was written (all TTS providers failed). Such cases stay out of the checkpoint.
+    """
+    if result["error"]:
+        return True
+    if str(result.get("transcript") or "").startswith("Error") or str(result.get("response") or "").startswith("Error"):
+        return True
+    return speak and is_speakable(result.get("response")) and result.get("audio_path") is None
+
+
+def run_batch(cases, output_path, checkpoint_path=None, audio_dir=None, workers=4, use_cache=True,
+              speak=True, preferred_tts=None, detail_level=None, vision_model=None):
+    """
+    Run every case that is not in the checkpoint through the pipeline on a
+    worker pool, appending one JSON line per case to output_path. A case is
+    written to the checkpoint only after its result line is on disk and only
+    if it succeeded, so restarting with the same arguments finishes an
+    interrupted run and retries the cases that failed.
+
+    Returns:
+        dict: summary with counts, throughput and per-stage latency percentiles
+    """
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    done = load_checkpoint(checkpoint_path)
+    pending = [case for case in cases if case["id"] not in done]
+    if audio_dir:
+        os.makedirs(audio_dir, exist_ok=True)
+
+    write_lock = threading.Lock()
+    stage_latencies, errors = {}, 0
+
+    def process(case):
+        audio_path = os.path.join(audio_dir or ".", f"{case['id']}.mp3")
+        started = time.perf_counter()
+        try:
+            # Batch work queues behind interactive Streamlit sessions in the shared scheduler
+            with request_context(session_id=f"batch-{case['id']}", priority=PRIORITY_BATCH):
+                result = run_pipeline(case["audio"], case["image"], use_cache=use_cache, preferred_tts=preferred_tts,
+                                      output_filepath=audio_path, speak=speak, detail_level=detail_level,
+                                      vision_model=vision_model)
+            result["error"] = None
+            result.pop("audio", None)  # written to audio_path; keep the JSONL line small
+        except Exception as e:
+            result = {"error": str(e), "timings": {"stages": {}}}
+        result["id"] = case["id"]
+        result["image"] = case["image"]
+        result["audio"] = case["audio"]
+        result["elapsed"] = round(time.perf_counter() - started, 4)
+        return result
+
+    with open(output_path, "a") as output, open(checkpoint_path, "a") as checkpoint:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(process, case) for case in pending]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                failed = case_failed(result, speak)
+                with write_lock:
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    if not failed:
+                        # Failed cases stay out of the checkpoint so a re-run retries them
+                        checkpoint.write(result["id"] + "\n")
+                        checkpoint.flush()
+                    errors += int(failed)
+                    for stage, timing in result["timings"]["stages"].items():
+                        stage_latencies.setdefault(stage, []).append(timing["duration"])
+                    stage_latencies.setdefault("total", []).append(result["elapsed"])
+                print(f"[{completed}/{len(pending)}] {result['id']}: {'error' if failed else 'ok'} ({result['elapsed']:.2f}s)")
+        elapsed = time.perf_counter() - started
+
+    return {
+        "cases": len(cases),
+        "skipped": len(cases) - len(pending),
+        "processed": len(pending),
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "items_per_second": round(len(pending) / elapsed, 3) if pending and elapsed else 0.0,
+        "scheduler": scheduler.stats(),
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "p99": round(percentile(values, 0.99), 4),
+            }
+            for stage, values in stage_latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the AI Doctor pipeline over a directory or manifest of cases")
+    parser.add_argument("source", help="Case directory or manifest (.jsonl / .csv)")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--audio-dir", default="batch_audio", help="Directory for the per-case voice responses")
+    parser.add_argument("--workers", type=int, default=4, help="Cases processed at the same time")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response caches")
+    parser.add_argument("--no-tts", action="store_true", help="Skip text-to-speech")
+    parser.add_argument("--metrics-file", help="Write process metrics in Prometheus text format to this file")
+    parser.add_argument("--tts", choices=["elevenlabs", "gtts", "hedged"],
+                        help="Preferred TTS provider ('hedged' races Google TTS against a slow ElevenLabs)")
+    parser.add_argument("--detail", choices=["concise", "standard", "detailed"],
+                        help="Analysis detail level: answer length, token cap and latency target (default: concise)")
+    parser.add_argument("--vision-model", help="Preferred vision model (default: the fastest one within the SLO)")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    cases = discover_cases(args.source)
+    summary = run_batch(
+        cases, args.output, checkpoint_path=args.checkpoint, audio_dir=args.audio_dir, workers=args.workers,
+        use_cache=not args.no_cache, speak=not args.no_tts, preferred_tts=args.tts, detail_level=args.detail,
+        vision_model=args.vision_model,
+    )
+
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+
+    print("-" * 50)
+    print(f"Processed {summary['processed']} cases ({summary['skipped']} already done, {summary['errors']} errors) "
+          f"in {summary['elapsed']:.2f}s - {summary['items_per_second']:.2f} items/s")
+    for stage, stats in summary["stages"].items():
+        print(f"  {stage:<14} p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s  p99 {stats['p99']:.3f}s  (n={stats['count']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1027 @@
+# benchmarks.py - Offline benchmarks for the diagnosis pipeline
+#
+# Usage:
+#   python benchmarks.py uploads [--sizes 4 12 24] [--output results.json]
+#   python benchmarks.py pipeline [--image-sizes 1 4 12] [--audio-seconds 10 60 300] [--latency 0.2]
+#                                 [--jitter 0.1] [--failure-rate 0.02] [--output results.json]
+#   python benchmarks.py startup [--budget 3.0] [--repeats 3] [--output results.json]
+#   python benchmarks.py images [--images 3 5] [--image-size 2] [--repeats 3] [--output results.json]
+#   python benchmarks.py near-duplicates [--entries 1000 10000 100000] [--max-distance 4] [--output results.json]
+#   python benchmarks.py detail-levels [--requests 5] [--latency 0.3] [--seconds-per-token 0.01] [--output results.json]
+#   python benchmarks.py routing [--scenarios healthy slow-primary failing-primary] [--requests 30] [--slo 1.5]
+#                                [--concurrency 1 8]
+#   python benchmarks.py service [--endpoint diagnose] [--concurrency 1 4 16] [--requests 32] [--output results.json]
+#   python benchmarks.py compare baseline.json candidate.json
+#
+# Every benchmark runs against provider_standins, so no API keys or network are needed.
+
+import io
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+import uuid
+import random
+import platform
+import threading
+import subprocess
+import http.client
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_test_image(megapixels, seed=0):
+    """Noisy RGB PNG of roughly the given size; noise defeats compression like a real photo"""
+    import numpy as np
+    from PIL import Image
+
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_test_photo(width=1600, height=1200, seed=0):
+    """Smooth RGB image with mild noise, closer to a photo than make_test_image for perceptual hashing"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(coarse).astype(np.int16) + rng.integers(-12, 13, size=(height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_test_wav(seconds, sample_rate=16000, seed=0):
+    """Mono 16-bit WAV of low-level noise"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(int(seconds * sample_rate)) * 500).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def _peak_rss_kb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KB elsewhere
+
+
+def _upload_case(mode, image_bytes, audio_bytes, queue):
+    """Child process: run one upload path against the local stand-in and report latency + peak RSS"""
+    from provider_standins import StandInServer
+
+    with StandInServer() as standin:
+        os.environ["GROQ_API_KEY"] = "standin-key"
+        os.environ["GROQ_BASE_URL"] = standin.url
+        from brain_of_the_doctor import prepare_image, analyze_image_with_query
+        from voice_of_the_patient import transcribe_with_groq
+
+        baseline_kb = _peak_rss_kb()
+        image_upload, audio_upload = io.BytesIO(image_bytes), io.BytesIO(audio_bytes)
+        del image_bytes, audio_bytes
+        start = time.perf_counter()
+
+        if mode == "tempfile":
+            # The old process_inputs flow: spill each upload to disk and re-open it by path
+            paths = []
+            for upload, suffix in ((audio_upload, ".wav"), (image_upload, ".jpg")):
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                    tmp.write(upload.read())
+                    paths.append(tmp.name)
+            try:
+                transcript = transcribe_with_groq("whisper-large-v3", paths[0], "standin-key", use_cache=False)
+                prepared = prepare_image(paths[1])
+            finally:
+                for path in paths:
+                    os.unlink(path)
+        else:
+            transcript = transcribe_with_groq("whisper-large-v3", audio_upload, "standin-key", use_cache=False)
+            prepared = prepare_image(image_upload)
+
+        analyze_image_with_query(transcript, "standin", prepared["encoded"], use_cache=False,
+                                 mime_type=prepared["mime_type"])
+        latency = time.perf_counter() - start
+        queue.put({
+            "latency_s": round(latency, 4),
+            "peak_rss_mb": round(_peak_rss_kb() / 1024, 1),
+            "peak_rss_growth_mb": round((_peak_rss_kb() - baseline_kb) / 1024, 1),
+            "bytes_uploaded": standin.stats["bytes_received"],
+        })
+
+
+def benchmark_uploads(sizes=(4, 12, 24), audio_seconds=60, repeats=3):
+    """
+    Compare the temp-file upload path with the in-memory one for large
+    images (sizes in megapixels). Every run gets a fresh process so peak RSS
+    is measured per case.
+    """
+    context = multiprocessing.get_context("spawn")
+    audio_bytes = make_test_wav(audio_seconds)
+    results = []
+    for megapixels in sizes:
+        image_bytes = make_test_image(megapixels)
+        for mode in ("tempfile", "in_memory"):
+            runs = []
+            for _ in range(repeats):
+                queue = context.Queue()
+                process = context.Process(target=_upload_case, args=(mode, image_bytes, audio_bytes, queue))
+                process.start()
+                runs.append(queue.get())
+                process.join()
+            results.append({
+                "mode": mode,
+                "image_megapixels": megapixels,
+                "image_bytes": len(image_bytes),
+                "audio_bytes": len(audio_bytes),
+                "latency_s": min(run["latency_s"] for run in runs),
+                "peak_rss_mb": min(run["peak_rss_mb"] for run in runs),
+                "peak_rss_growth_mb": min(run["peak_rss_growth_mb"] for run in runs),
+            })
+            print(f"{mode:>10} {megapixels:>4} MP: {results[-1]['latency_s']:.3f}s, "
+                  f"peak RSS {results[-1]['peak_rss_mb']} MB (+{results[-1]['peak_rss_growth_mb']} MB)")
+    return results
+
+
+# Rough shape of the real providers: the vision call dominates, Whisper scales with upload size
+DEFAULT_STANDIN_PROFILES = {
+    "chat": {"latency": 0.8},
+    "transcription": {"latency": 0.3, "seconds_per_mb": 0.2},
+    "elevenlabs": {"latency": 0.4},
+    "gtts": {"latency": 0.3},
+}
+
+
+def _standin_environment(standin, concurrency):
+    """Point every provider at the stand-in, with a private cache and rate limits out of the way"""
+    return {
+        "GROQ_API_KEY": "standin-key",
+        "GROQ_BASE_URL": standin.url,
+        "ELEVENLABS_API_KEY": "standin-key",
+        "ELEVENLABS_BASE_URL": standin.url,
+        "GTTS_BASE_URL": standin.url,
+        "AI_DOCTOR_CACHE_DIR": tempfile.mkdtemp(prefix="ai-doctor-bench-"),
+        # Measure the pipeline, not the free-tier rate limits
+        "GROQ_RATE_PER_MIN": "1000000", "GROQ_BURST": "1000", "GROQ_MAX_CONCURRENT": str(concurrency * 4),
+        "ELEVENLABS_RATE_PER_MIN": "1000000", "ELEVENLABS_BURST": "1000",
+        "ELEVENLABS_MAX_CONCURRENT": str(concurrency * 4),
+        "GTTS_RATE_PER_MIN": "1000000", "GTTS_BURST": "1000", "GTTS_MAX_CONCURRENT": str(concurrency * 4),
+    }
+
+
+def _tts_fell_back(preferred_tts, message):
+    """True when the answer was spoken by another provider than the one requested, e.g. a silent gTTS fallback"""
+    expected = {"elevenlabs": "ElevenLabs", "gtts": "Google"}.get(preferred_tts)
+    return expected is not None and str(message or "").split(" TTS")[0] != expected
+
+
+def _pipeline_case(image_bytes, audio_bytes, standin_options, requests, concurrency, preferred_tts, queue):
+    """Child process: run the full pipeline against the stand-ins and report latency, throughput and peak RSS"""
+    from provider_standins import StandInServer
+
+    with StandInServer(**standin_options) as standin:
+        os.environ.update(_standin_environment(standin, concurrency))
+        from diagnosis_pipeline import run_pipeline
+        from metrics import percentile
+
+        baseline_kb = _peak_rss_kb()
+        def run_one(index):
+            started = time.perf_counter()
+            result = run_pipeline(io.BytesIO(audio_bytes), io.BytesIO(image_bytes), use_cache=False,
+                                  preferred_tts=preferred_tts)
+            result["elapsed"] = time.perf_counter() - started
+            return result
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = list(executor.map(run_one, range(requests)))
+        wall_clock = time.perf_counter() - started
+
+        def summarize(values):
+            return {
+                "p50": round(percentile(values, 0.50), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "max": round(max(values), 4),
+            } if values else None
+
+        stage_names = sorted({stage for run in runs for stage in run["timings"]["stages"]})
+        queue.put({
+            "requests": requests,
+            "errors": sum(1 for run in runs if str(run["response"]).startswith("Error") or not run["audio"]
+                          or _tts_fell_back(preferred_tts, run["tts_message"])),
+            "tts_fallbacks": sum(1 for run in runs if _tts_fell_back(preferred_tts, run["tts_message"])),
+            "end_to_end": summarize([run["elapsed"] for run in runs]),
+            "stages": {
+                stage: summarize([run["timings"]["stages"][stage]["duration"]
+                                  for run in runs if stage in run["timings"]["stages"]])
+                for stage in stage_names
+            },
+            "throughput_rps": round(requests / wall_clock, 3),
+            "peak_rss_mb": round(_peak_rss_kb() / 1024, 1),
+            "peak_rss_growth_mb": round((_peak_rss_kb() - baseline_kb) / 1024, 1),
+            "tts_messages": sorted({run["tts_message"] for run in runs if run["tts_message"]}),
+            "standin_stats": standin.stats,
+        })
+
+
+def benchmark_pipeline(image_sizes=(1, 4, 12), audio_seconds=(10, 60, 300), requests=5, concurrency=1,
+                       latency=None, jitter=0.0, failure_rate=0.0, preferred_tts="elevenlabs", seed=0):
+    """
+    Run run_pipeline end to end (transcribe + encode -> analyze -> speak)
+    against the stand-ins for every image size (megapixels) x audio length
+    (seconds) pair, each in a fresh process so peak RSS is per case.
+
+    Args:
+        latency (float): Base latency for every endpoint (default: DEFAULT_STANDIN_PROFILES)
+        jitter (float): Random extra latency of up to this many seconds per request
+        failure_rate (float): Fraction of provider requests answered with a 503
+        requests (int): Pipeline runs per case; concurrency of them run at a time
+    """
+    context = multiprocessing.get_context("spawn")
+    profiles = {} if latency is not None else DEFAULT_STANDIN_PROFILES
+    standin_options = {"latency": latency or 0.0, "jitter": jitter, "failure_rate": failure_rate,
+                       "profiles": profiles, "seed": seed}
+    results = []
+    for seconds in audio_seconds:
+        audio_bytes = make_test_wav(seconds, seed=seed)
+        for megapixels in image_sizes:
+            image_bytes = make_test_image(megapixels, seed=seed)
+            queue = context.Queue()
+            process = context.Process(target=_pipeline_case, args=(
+                image_bytes, audio_bytes, standin_options, requests, concurrency, preferred_tts, queue))
+            process.start()
+            run = queue.get()
+            process.join()
+            results.append({
+                "case": f"{megapixels}MP-{seconds}s",
+                "image_megapixels": megapixels,
+                "image_bytes": len(image_bytes),
+                "audio_seconds": seconds,
+                "audio_bytes": len(audio_bytes),
+                "concurrency": concurrency,
+                **run,
+            })
+            stages = "  ".join(f"{stage} {stats['p50']:.3f}s" for stage, stats in run["stages"].items())
+            print(f"{results[-1]['case']:>12}: p50 {run['end_to_end']['p50']:.3f}s  p95 {run['end_to_end']['p95']:.3f}s  "
+                  f"{run['throughput_rps']:.2f} req/s  peak RSS {run['peak_rss_mb']} MB  "
+                  f"errors {run['errors']}/{run['requests']} ({run['tts_fallbacks']} TTS fallbacks)  |  {stages}")
+    return results
+
+
+def _images_case(image_count, megapixels, standin_options, repeats, seed, queue):
+    """Child process: one batched vision request vs one request per image, sequential and concurrent"""
+    from provider_standins import StandInServer
+
+    with StandInServer(**standin_options) as standin:
+        os.environ.update(_standin_environment(standin, image_count))
+        from diagnosis_pipeline import encode_stage, build_vision_query, VISION_MODEL
+        from brain_of_the_doctor import analyze_image_with_query
+        from metrics import metrics, percentile
+
+        images = [make_test_image(megapixels, seed=seed + index) for index in range(image_count)]
+        # Batched images share the per-request upload budget; separate calls each get the full budget
+        batched_images = encode_stage(images)
+        single_images = [encode_stage(image) for image in images]
+
+        def analyze(prepared, count):
+            return analyze_image_with_query(build_vision_query("", count), VISION_MODEL, prepared, use_cache=False)
+
+        modes = {
+            "batched": lambda: analyze(batched_images, image_count),
+            "per_image_sequential": lambda: [analyze(prepared, 1) for prepared in single_images],
+            "per_image_concurrent": lambda: list(ThreadPoolExecutor(max_workers=image_count).map(
+                lambda prepared: analyze(prepared, 1), single_images)),
+        }
+
+        def counters():
+            values = metrics.summary()["counters"]
+            return {kind: values.get(f'provider_tokens_total{{kind="{kind}",provider="groq"}}', 0)
+                    for kind in ("prompt", "completion")}
+
+        results = []
+        for mode, run in modes.items():
+            latencies = []
+            tokens_before, requests_before = counters(), standin.stats["endpoints"]["chat"]
+            bytes_before = standin.stats["bytes_received"]
+            for _ in range(repeats):
+                started = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - started)
+            tokens_after = counters()
+            results.append({
+                "mode": mode,
+                "requests": (standin.stats["endpoints"]["chat"] - requests_before) // repeats,
+                "latency_s": round(percentile(latencies, 0.50), 4),
+                "latency_max_s": round(max(latencies), 4),
+                "prompt_tokens": (tokens_after["prompt"] - tokens_before["prompt"]) // repeats,
+                "completion_tokens": (tokens_after["completion"] - tokens_before["completion"]) // repeats,
+                "bytes_uploaded": (standin.stats["bytes_received"] - bytes_before) // repeats,
+            })
+        queue.put(results)
+
+
+def benchmark_images(image_counts=(3, 5), megapixels=2, repeats=3, latency=None, seconds_per_image=0.15,
+                     jitter=0.0, seed=0):
+    """
+    Compare analyzing N photos in one multimodal request with one request
+    per photo (one after another, and all at once) on latency, requests,
+    tokens and bytes uploaded. The stand-in adds `seconds_per_image` of
+    prefill time per image and reports token usage as the provider would.
+    """
+    context = multiprocessing.get_context("spawn")
+    chat_profile = {**DEFAULT_STANDIN_PROFILES["chat"], "seconds_per_image": seconds_per_image}
+    if latency is not None:
+        chat_profile["latency"] = latency
+    standin_options = {"jitter": jitter, "profiles": {"chat": chat_profile}, "seed": seed}
+    results = []
+    for image_count in image_counts:
+        queue = context.Queue()
+        process = context.Process(target=_images_case,
+                                  args=(image_count, megapixels, standin_options, repeats, seed, queue))
+        process.start()
+        runs = queue.get()
+        process.join()
+        for run in runs:
+            results.append({"case": f"{image_count}x{megapixels:g}MP", "images": image_count,
+                            "image_megapixels": megapixels, **run})
+            print(f"{results[-1]['case']:>8} {run['mode']:<22} {run['latency_s']:.3f}s  {run['requests']} requests  "
+                  f"{run['prompt_tokens']} prompt + {run['completion_tokens']} completion tokens  "
+                  f"{run['bytes_uploaded'] / 1024:.0f} KB uploaded")
+    return results
+
+
+# Canned answer longer than the largest detail level's token cap, so every level is cut at its cap
+LONG_ANSWER = " ".join(
+    f"With what I see, I think you have a patch of contact dermatitis on the {part} that has been irritated "
+    f"for a few days, so keep it clean and dry and avoid whatever touched it."
+    for part in ("cheek", "chin", "forehead", "neck", "jaw", "temple", "nose", "ear", "scalp", "lip",
+                 "eyelid", "brow", "hand", "wrist", "arm", "shoulder", "chest", "back", "knee", "ankle")
+)
+
+
+def _detail_levels_case(image_bytes, standin_options, requests, preferred_tts, queue):
+    """Child process: run the streaming pipeline at every detail level and report answer latency and length"""
+    from provider_standins import StandInServer
+
+    with StandInServer(chat_response=LONG_ANSWER, **standin_options) as standin:
+        os.environ.update(_standin_environment(standin, 1))
+        from diagnosis_pipeline import run_pipeline, DETAIL_LEVELS
+        from metrics import percentile
+
+        results = []
+        for detail_level in DETAIL_LEVELS:
+            runs = []
+            tts_before = sum(standin.stats["endpoints"][endpoint] for endpoint in ("elevenlabs", "gtts"))
+            for _ in range(requests):
+                started = time.perf_counter()
+                run = run_pipeline(None, io.BytesIO(image_bytes), use_cache=False, preferred_tts=preferred_tts,
+                                   stream=True, detail_level=detail_level)
+                run["elapsed"] = time.perf_counter() - started
+                runs.append(run)
+            answers = [run["answer_metrics"] for run in runs if run["answer_metrics"]]
+            answer_seconds = [answer["seconds"] for answer in answers]
+            first_audio = [run["timings"]["first_audio_ready"] for run in runs if "first_audio_ready" in run["timings"]]
+            results.append({
+                "case": detail_level,
+                "max_tokens": DETAIL_LEVELS[detail_level]["max_tokens"],
+                "latency_target_s": DETAIL_LEVELS[detail_level]["latency_target"],
+                "requests": requests,
+                "errors": requests - len(answers),
+                "answer_p50_s": round(percentile(answer_seconds, 0.50), 4) if answers else None,
+                "answer_p95_s": round(percentile(answer_seconds, 0.95), 4) if answers else None,
+                "within_target": sum(answer["within_target"] for answer in answers),
+                "first_audio_p50_s": round(percentile(first_audio, 0.50), 4) if first_audio else None,
+                "end_to_end_p50_s": round(percentile([run["elapsed"] for run in runs], 0.50), 4),
+                "tts_characters": sum(answer["characters"] for answer in answers) // max(1, len(answers)),
+                "tts_requests": (sum(standin.stats["endpoints"][endpoint] for endpoint in ("elevenlabs", "gtts"))
+                                 - tts_before) // requests,
+            })
+        queue.put(results)
+
+
+def benchmark_detail_levels(requests=5, megapixels=1, latency=0.3, seconds_per_token=0.01, preferred_tts="gtts",
+                            seed=0):
+    """
+    Run the streaming pipeline at every Analysis Detail Level and compare
+    time to the full answer (against the level's latency target), time to
+    the first voice segment and TTS input length. The
+    stand-in always has a long answer ready and generates it at
+    `seconds_per_token` until the level's max_tokens cut it off, so each
+    level is measured at its longest answer; a real model usually stops
+    sooner because the prompt asks for less.
+    """
+    context = multiprocessing.get_context("spawn")
+    profiles = {**DEFAULT_STANDIN_PROFILES,
+                "chat": {"latency": latency, "seconds_per_token": seconds_per_token}}
+    image_bytes = make_test_image(megapixels, seed=seed)
+    queue = context.Queue()
+    process = context.Process(target=_detail_levels_case,
+                              args=(image_bytes, {"profiles": profiles, "seed": seed}, requests, preferred_tts, queue))
+    process.start()
+    results = queue.get()
+    process.join()
+    for run in results:
+        print(f"{run['case']:>9}: answer p50 {run['answer_p50_s']:.3f}s (target {run['latency_target_s']:.0f}s, "
+              f"{run['within_target']}/{run['requests']} within)  first audio {run['first_audio_p50_s']:.3f}s  "
+              f"end to end {run['end_to_end_p50_s']:.3f}s  "
+              f"{run['tts_characters']} TTS characters in {run['tts_requests']} requests")
+    return results
+
+
+PRIMARY_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+FALLBACK_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+# Vision latency/failures of the two models per scenario (stand-in "chat:<model>" profiles)
+ROUTING_SCENARIOS = {
+    "healthy": {PRIMARY_MODEL: {"latency": 0.4}, FALLBACK_MODEL: {"latency": 0.7}},
+    "slow-primary": {PRIMARY_MODEL: {"latency": 2.5}, FALLBACK_MODEL: {"latency": 0.7}},
+    "failing-primary": {PRIMARY_MODEL: {"latency": 0.4, "failure_rate": 1.0}, FALLBACK_MODEL: {"latency": 0.7}},
+}
+
+
+def _routing_case(models, profiles, requests, slo, seed, concurrency, queue):
+    """Child process: vision calls from `concurrency` threads routed between `models`; latency, errors, model shares"""
+    from provider_standins import StandInServer
+
+    with StandInServer(profiles=profiles, seed=seed) as standin:
+        os.environ.update(_standin_environment(standin, concurrency))
+        os.environ.update({"AI_DOCTOR_VISION_MODELS": ",".join(models), "AI_DOCTOR_VISION_SLO": str(slo)})
+        from diagnosis_pipeline import encode_stage, build_vision_query, VISION_MODEL
+        from brain_of_the_doctor import analyze_image_with_query
+        from metrics import percentile
+
+        prepared = encode_stage(make_test_image(0.5, seed=seed))
+        random.seed(seed)  # retry backoff jitter, so runs are comparable
+
+        def run_one(_):
+            vision_metrics = {}
+            started = time.perf_counter()
+            try:
+                analyze_image_with_query(build_vision_query(""), VISION_MODEL, prepared, use_cache=False,
+                                         metrics=vision_metrics)
+                error = False
+            except Exception:
+                error = True
+            return time.perf_counter() - started, error, vision_metrics
+
+        latencies, served, errors, failovers = [], {}, 0, 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, error, vision_metrics in executor.map(run_one, range(requests)):
+                latencies.append(latency)
+                errors += int(error)
+                if "model" in vision_metrics:
+                    served[vision_metrics["model"]] = served.get(vision_metrics["model"], 0) + 1
+                    failovers += vision_metrics["failovers"]
+        queue.put({
+            "requests": requests,
+            "errors": errors,
+            "latency_p50_s": round(percentile(latencies, 0.50), 4),
+            "latency_p95_s": round(percentile(latencies, 0.95), 4),
+            "within_slo": sum(1 for latency in latencies if latency <= slo),
+            "failovers": failovers,
+            "served_by": served,
+            "provider_calls": standin.stats["models"],
+        })
+
+
+def benchmark_routing(scenarios=tuple(ROUTING_SCENARIOS), requests=30, slo=1.5, seed=0, concurrency=(1, 8)):
+    """
+    Compare pinning the primary vision model with routing between it and a
+    fallback (model_router) when the primary is healthy, slow or failing,
+    with sequential and concurrent callers (concurrent failures are what
+    trip circuit breakers). Reports latency, errors, calls within the SLO,
+    failovers and how many answers each model served.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for scenario, clients in ((scenario, clients) for scenario in scenarios for clients in concurrency):
+        profiles = {f"chat:{model}": profile for model, profile in ROUTING_SCENARIOS[scenario].items()}
+        case = scenario if clients == 1 else f"{scenario}-c{clients}"
+        for mode, models in (("pinned", [PRIMARY_MODEL]), ("routed", [PRIMARY_MODEL, FALLBACK_MODEL])):
+            queue = context.Queue()
+            process = context.Process(target=_routing_case,
+                                      args=(models, profiles, requests, slo, seed, clients, queue))
+            process.start()
+            run = queue.get()
+            process.join()
+            results.append({"case": case, "mode": mode, "slo_s": slo, "concurrency": clients, **run})
+            shares = ", ".join(f"{model.split('/')[-1]} {count}" for model, count in run["served_by"].items())
+            print(f"{case:>18} {mode:<7} p50 {run['latency_p50_s']:.3f}s  p95 {run['latency_p95_s']:.3f}s  "
+                  f"{run['within_slo']}/{requests} within {slo:g}s  errors {run['errors']}  "
+                  f"failovers {run['failovers']}  served by: {shares or '-'}")
+    return results
+
+
+def _service_process(standin_options, max_concurrent, max_queued, queue, stop):
+    """Child process: the stand-ins plus pipeline_service until `stop` is set; reports its URL, then its stats"""
+    import asyncio
+    from provider_standins import StandInServer
+
+    with StandInServer(**standin_options) as standin:
+        os.environ.update(_standin_environment(standin, max_concurrent))
+        from pipeline_service import PipelineService
+
+        service = PipelineService(port=0, max_concurrent=max_concurrent, max_queued=max_queued)
+
+        async def serve():
+            await service.start()
+            queue.put(service.url)
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+            await service.stop()
+
+        asyncio.run(serve())
+        queue.put({"peak_rss_mb": round(_peak_rss_kb() / 1024, 1), "standin_stats": standin.stats})
+
+
+def _multipart_body(fields, files):
+    """multipart/form-data body for http.client; files maps field -> (filename, bytes)"""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for name, (filename, data) in files.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+def _service_request(endpoint, image_bytes, audio_bytes, preferred_tts):
+    """(path, body, headers) of one benchmark request; caching is off so every request reaches the providers"""
+    fields = {"use_cache": "0", "tts": preferred_tts}
+    if endpoint == "speak":
+        text = "The rash looks like mild contact dermatitis. Keep the area clean and dry."
+        body = json.dumps({"text": text, "tts": preferred_tts, "use_cache": False}).encode()
+        return "/v1/speak", body, {"Content-Type": "application/json"}
+    files = {
+        "diagnose": {"image": ("case.png", image_bytes), "audio": ("case.wav", audio_bytes)},
+        "transcribe": {"audio": ("case.wav", audio_bytes)},
+        "analyze": {"image": ("case.png", image_bytes)},
+    }[endpoint]
+    body, content_type = _multipart_body(fields, files)
+    return f"/v1/{endpoint}", body, {"Content-Type": content_type}
+
+
+def benchmark_service(endpoint="diagnose", concurrency_levels=(1, 4, 16), requests=32, max_concurrent=8,
+                      max_queued=32, image_megapixels=1, audio_seconds=10, latency=None, jitter=0.0,
+                      failure_rate=0.0, preferred_tts="elevenlabs", seed=0):
+    """
+    Load pipeline_service over HTTP. For every client concurrency level a
+    fresh service process (with its own stand-ins) is started, and
+    `concurrency` keep-alive connections send `requests` requests in total.
+    Requests the service sheds (503) are counted, not retried.
+    """
+    context = multiprocessing.get_context("spawn")
+    profiles = {} if latency is not None else DEFAULT_STANDIN_PROFILES
+    standin_options = {"latency": latency or 0.0, "jitter": jitter, "failure_rate": failure_rate,
+                       "profiles": profiles, "seed": seed}
+    path, body, headers = _service_request(endpoint, make_test_image(image_megapixels, seed=seed),
+                                           make_test_wav(audio_seconds, seed=seed), preferred_tts)
+    from metrics import percentile
+
+    results = []
+    for concurrency in concurrency_levels:
+        queue, stop = context.Queue(), context.Event()
+        process = context.Process(target=_service_process,
+                                  args=(standin_options, max_concurrent, max_queued, queue, stop))
+        process.start()
+        host, port = queue.get().split("//")[1].split(":")
+
+        remaining = iter(range(requests))
+        remaining_lock = threading.Lock()
+        samples = []
+
+        def client():
+            connection = http.client.HTTPConnection(host, int(port), timeout=300)
+            while True:
+                with remaining_lock:
+                    if next(remaining, None) is None:
+                        break
+                started = time.perf_counter()
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                samples.append((response.status, time.perf_counter() - started))
+                if response.getheader("Connection") == "close":
+                    connection.close()
+            connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(client) for _ in range(concurrency)]:
+                future.result()
+        wall_clock = time.perf_counter() - started
+        stop.set()
+        service_stats = queue.get()
+        process.join()
+
+        statuses = {}
+        for status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        latencies = [seconds for status, seconds in samples if status == 200]
+        results.append({
+            "case": f"{endpoint}-c{concurrency}",
+            "endpoint": endpoint,
+            "concurrency": concurrency,
+            "max_concurrent": max_concurrent,
+            "requests": requests,
+            "request_bytes": len(body),
+            "statuses": statuses,
+            "end_to_end": {
+                "p50": round(percentile(latencies, 0.50), 4),
+                "p95": round(percentile(latencies, 0.95), 4),
+                "max": round(max(latencies), 4),
+            } if latencies else None,
+            "throughput_rps": round(len(latencies) / wall_clock, 3),
+            **service_stats,
+        })
+        run = results[-1]
+        latency_text = (f"p50 {run['end_to_end']['p50']:.3f}s  p95 {run['end_to_end']['p95']:.3f}s  "
+                        if latencies else "")
+        print(f"{run['case']:>16}: {latency_text}{run['throughput_rps']:.2f} req/s  statuses {statuses}  "
+              f"service peak RSS {run['peak_rss_mb']} MB")
+    return results
+
+
+# Near-duplicate lookups must stay below this at the largest index size
+NEAR_DUPLICATE_LOOKUP_BUDGET_US = 1000
+
+# How a phone or a chat app typically alters a photo before it is uploaded again
+PHOTO_VARIANTS = {
+    "resaved_jpeg": lambda photo: _jpeg(photo, 85),
+    "recompressed_q50": lambda photo: _jpeg(photo, 50),
+    "resized_half": lambda photo: _jpeg(photo.resize((photo.width // 2, photo.height // 2)), 90),
+    "png": lambda photo: _encoded(photo, "PNG"),
+}
+
+
+def _encoded(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def _jpeg(image, quality):
+    return _encoded(image, "JPEG", quality=quality)
+
+
+def benchmark_near_duplicates(entry_counts=(1000, 10000, 100000), queries=2000, max_distance=4, photos=30, seed=0):
+    """
+    Check the perceptual-hash index used by the vision cache:
+    - robustness: Hamming distance between a photo and its re-saved,
+      re-compressed, resized and PNG variants, and between different photos
+    - speed: lookup latency (p50/p99) as the index grows, for near and
+      unrelated queries, against NEAR_DUPLICATE_LOOKUP_BUDGET_US
+    """
+    import random
+    from image_index import dhash, hamming, MultiIndexHash
+    from metrics import percentile
+
+    distances = {variant: [] for variant in PHOTO_VARIANTS}
+    distances["different_photo"] = []
+    hash_seconds = []
+    for index in range(photos):
+        photo = make_test_photo(seed=seed + index)
+        original = _jpeg(photo, 92)
+        started = time.perf_counter()
+        original_hash = dhash(original)
+        hash_seconds.append(time.perf_counter() - started)
+        for variant, alter in PHOTO_VARIANTS.items():
+            distances[variant].append(hamming(original_hash, dhash(alter(photo))))
+        distances["different_photo"].append(hamming(original_hash, dhash(_jpeg(make_test_photo(seed=seed + photos + index), 92))))
+    variants = {
+        variant: {
+            "max_distance": max(values),
+            "p50_distance": percentile(values, 0.50),
+            "matched": round(sum(1 for value in values if value <= max_distance) / len(values), 3),
+        }
+        for variant, values in distances.items()
+    }
+    print(f"dHash of a 1600x1200 JPEG: {percentile(hash_seconds, 0.50) * 1000:.1f} ms")
+    for variant, stats in variants.items():
+        print(f"  {variant:<18} distance p50 {stats['p50_distance']:.0f}, max {stats['max_distance']}  "
+              f"matched at <= {max_distance}: {stats['matched']:.0%}")
+
+    generator = random.Random(seed)
+    lookups = []
+    for entry_count in entry_counts:
+        index = MultiIndexHash(max_distance, max_entries=entry_count)
+        hashes = [generator.getrandbits(64) for _ in range(entry_count)]
+        started = time.perf_counter()
+        for position, image_hash in enumerate(hashes):
+            index.add(image_hash, "benchmark", str(position))
+        build_seconds = time.perf_counter() - started
+
+        def flip(image_hash, bits):
+            for bit in generator.sample(range(64), bits):
+                image_hash ^= 1 << bit
+            return image_hash
+
+        near = [flip(image_hash, generator.randint(0, max_distance))
+                for image_hash in generator.choices(hashes, k=queries // 2)]
+        unrelated = [generator.getrandbits(64) for _ in range(queries - len(near))]
+        latencies = []
+        for query in near + unrelated:
+            started = time.perf_counter()
+            index.search(query, "benchmark")
+            latencies.append(time.perf_counter() - started)
+        lookups.append({
+            "entries": entry_count,
+            "build_s": round(build_seconds, 3),
+            "lookup_p50_us": round(percentile(latencies, 0.50) * 1e6, 1),
+            "lookup_p99_us": round(percentile(latencies, 0.99) * 1e6, 1),
+            "near_queries_found": round(sum(1 for query in near if index.search(query, "benchmark")) / len(near), 3),
+        })
+        print(f"{entry_count:>8} entries: lookup p50 {lookups[-1]['lookup_p50_us']:.0f} us  "
+              f"p99 {lookups[-1]['lookup_p99_us']:.0f} us  (build {build_seconds:.2f}s, "
+              f"near queries found {lookups[-1]['near_queries_found']:.0%})")
+
+    passed = lookups[-1]["lookup_p99_us"] < NEAR_DUPLICATE_LOOKUP_BUDGET_US
+    print(f"p99 lookup at {lookups[-1]['entries']} entries: {lookups[-1]['lookup_p99_us']:.0f} us "
+          f"(budget {NEAR_DUPLICATE_LOOKUP_BUDGET_US} us) - {'OK' if passed else 'FAILED'}")
+    return {
+        "max_distance": max_distance,
+        "dhash_ms": round(percentile(hash_seconds, 0.50) * 1000, 2),
+        "variants": variants,
+        "lookups": lookups,
+        "budget_us": NEAR_DUPLICATE_LOOKUP_BUDGET_US,
+        "passed": passed,
+    }
+
+
+# Cold start of a fresh process to the first rendered home page, interpreter start-up included
+COLD_START_BUDGET_SECONDS = 3.0
+# Modules the home page must not import (they are loaded lazily on the upload page)
+PROVIDER_MODULES = ("brain_of_the_doctor", "voice_of_the_patient", "voice_of_the_doctor", "diagnosis_pipeline",
+                    "gtts", "elevenlabs", "pydub", "speech_recognition", "PIL", "groq", "st_audiorec")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_RENDER_HOME = """
+import sys, json, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("streamlit_app.py", default_timeout=60)
+app.run()
+print(json.dumps({
+    "exceptions": [str(exception.value) for exception in app.exception],
+    "provider_modules": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def _startup_env():
+    # No network warm-up and no real keys: measure the app, not the providers
+    return dict(os.environ, AI_DOCTOR_WARM_UP="0", GROQ_API_KEY="", ELEVENLABS_API_KEY="")
+
+
+def profile_imports(module="streamlit_app", top=15):
+    """
+    Import `module` in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: total_ms, direct (the module's own imports) and slowest (by self time), each a list of
+            {module, self_ms, cumulative_ms}
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=APP_DIR, env=_startup_env(), capture_output=True, text=True)
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append({"module": name.strip(), "depth": depth,
+                        "self_ms": round(int(self_us) / 1000, 2), "cumulative_ms": round(int(cumulative_us) / 1000, 2)})
+    root_index = next((index for index, entry in enumerate(entries) if entry["module"] == module), None)
+    if root_index is None:
+        raise RuntimeError(f"Could not import {module}: {completed.stderr[-500:]}")
+    root = entries[root_index]
+    # importtime prints a module's imports just before the module itself
+    direct = []
+    for entry in reversed(entries[:root_index]):
+        if entry["depth"] <= root["depth"]:
+            break
+        if entry["depth"] == root["depth"] + 1:
+            direct.append(entry)
+    strip = lambda entry: {key: entry[key] for key in ("module", "self_ms", "cumulative_ms")}
+    return {
+        "total_ms": root["cumulative_ms"],
+        "direct": sorted((strip(entry) for entry in direct), key=lambda entry: -entry["cumulative_ms"]),
+        "slowest": [strip(entry) for entry in sorted(entries, key=lambda entry: -entry["self_ms"])[:top]],
+    }
+
+
+def benchmark_startup(budget=COLD_START_BUDGET_SECONDS, repeats=3):
+    """
+    Profile streamlit_app's imports, then time cold starts (fresh process ->
+    first rendered home page) and check them against the budget. The home
+    page must also render without importing any provider module.
+    """
+    imports = profile_imports()
+    print(f"import streamlit_app: {imports['total_ms']:.0f} ms")
+    for entry in imports["direct"][:10]:
+        print(f"  {entry['module']:<28} {entry['cumulative_ms']:>8.1f} ms")
+
+    runs = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", _RENDER_HOME % (PROVIDER_MODULES,)],
+                                   cwd=APP_DIR, env=_startup_env(), capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        runs.append({"seconds": round(elapsed, 3), **report})
+
+    cold_start = min(run["seconds"] for run in runs)
+    provider_modules = sorted({name for run in runs for name in run["provider_modules"]})
+    exceptions = sorted({text for run in runs for text in run["exceptions"]})
+    passed = cold_start <= budget and not provider_modules and not exceptions
+    print(f"Cold start to home page: {cold_start:.2f}s (budget {budget:.2f}s) - {'OK' if passed else 'FAILED'}")
+    if provider_modules:
+        print(f"  Provider modules imported at start-up: {', '.join(provider_modules)}")
+    if exceptions:
+        print(f"  Home page raised: {exceptions}")
+    return {
+        "imports": imports,
+        "cold_start_s": cold_start,
+        "runs": runs,
+        "budget_s": budget,
+        "provider_modules_imported": provider_modules,
+        "passed": passed,
+    }
+
+
+def compare_results(baseline_path, candidate_path):
+    """Print the p50/p95 end-to-end latency change for every case present in both result files"""
+    with open(baseline_path) as baseline_file, open(candidate_path) as candidate_file:
+        baseline, candidate = json.load(baseline_file), json.load(candidate_file)
+    key = ("case" if baseline["benchmark"] in ("pipeline", "service", "images", "detail-levels", "routing")
+           else "image_megapixels")
+    baseline_cases = {(result[key], result.get("mode")): result for result in baseline["results"]}
+    rows = []
+    for result in candidate["results"]:
+        before = baseline_cases.get((result[key], result.get("mode")))
+        if before is None:
+            continue
+        if baseline["benchmark"] == "routing":
+            pairs = [("latency_p95_s", before["latency_p95_s"], result["latency_p95_s"]),
+                     ("errors", before["errors"], result["errors"])]
+        elif baseline["benchmark"] == "detail-levels":
+            pairs = [("answer_p50_s", before["answer_p50_s"], result["answer_p50_s"]),
+                     ("tts_characters", before["tts_characters"], result["tts_characters"])]
+        elif baseline["benchmark"] == "images":
+            pairs = [("latency_s", before["latency_s"], result["latency_s"]),
+                     ("prompt_tokens", before["prompt_tokens"], result["prompt_tokens"])]
+        elif baseline["benchmark"] in ("pipeline", "service"):
+            pairs = [("p50", before["end_to_end"]["p50"], result["end_to_end"]["p50"]),
+                     ("p95", before["end_to_end"]["p95"], result["end_to_end"]["p95"]),
+                     ("peak_rss_mb", before["peak_rss_mb"], result["peak_rss_mb"])]
+        else:
+            pairs = [("latency_s", before["latency_s"], result["latency_s"]),
+                     ("peak_rss_mb", before["peak_rss_mb"], result["peak_rss_mb"])]
+        row = {"case": result[key], "mode": result.get("mode")}
+        for name, old, new in pairs:
+            row[name] = {"baseline": old, "candidate": new, "change": round((new - old) / old, 3) if old else None}
+        rows.append(row)
+        changes = "  ".join(f"{name} {old} -> {new} ({row[name]['change']:+.1%})" if row[name]["change"] is not None
+                            else f"{name} {old} -> {new}" for name, old, new in pairs)
+        print(f"{str(result[key]):>12} {result.get('mode') or ''}: {changes}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the AI Doctor pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    uploads = subparsers.add_parser("uploads", help="Temp-file vs in-memory upload path")
+    uploads.add_argument("--sizes", type=float, nargs="+", default=[4, 12, 24], help="Image sizes in megapixels")
+    uploads.add_argument("--audio-seconds", type=float, default=60)
+    uploads.add_argument("--repeats", type=int, default=3)
+    uploads.add_argument("--output", help="Write results as JSON to this file")
+
+    pipeline = subparsers.add_parser("pipeline", help="End-to-end and per-stage latency, throughput and memory")
+    pipeline.add_argument("--image-sizes", type=float, nargs="+", default=[1, 4, 12], help="Image sizes in megapixels")
+    pipeline.add_argument("--audio-seconds", type=float, nargs="+", default=[10, 60, 300], help="Recording lengths")
+    pipeline.add_argument("--requests", type=int, default=5, help="Pipeline runs per case")
+    pipeline.add_argument("--concurrency", type=int, default=1, help="Runs in flight at the same time")
+    pipeline.add_argument("--latency", type=float, help="Base latency for every stand-in endpoint (seconds)")
+    pipeline.add_argument("--jitter", type=float, default=0.0, help="Random extra latency per request (seconds)")
+    pipeline.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests that get a 503")
+    pipeline.add_argument("--tts", choices=["elevenlabs", "gtts", "hedged"], default="elevenlabs")
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--output", help="Write results as JSON to this file")
+
+    startup = subparsers.add_parser("startup", help="Import profile and cold-start time of the Streamlit app")
+    startup.add_argument("--budget", type=float, default=COLD_START_BUDGET_SECONDS,
+                         help="Fail (exit 1) when the cold start takes longer than this many seconds")
+    startup.add_argument("--repeats", type=int, default=3)
+    startup.add_argument("--output", help="Write results as JSON to this file")
+
+    images = subparsers.add_parser("images", help="One multimodal request for several photos vs one per photo")
+    images.add_argument("--images", type=int, nargs="+", default=[3, 5], help="Photos per case")
+    images.add_argument("--image-size", type=float, default=2, help="Photo size in megapixels")
+    images.add_argument("--repeats", type=int, default=3)
+    images.add_argument("--latency", type=float, help="Base latency of the vision endpoint (seconds)")
+    images.add_argument("--seconds-per-image", type=float, default=0.15, help="Extra vision latency per image")
+    images.add_argument("--jitter", type=float, default=0.0, help="Random extra latency per request (seconds)")
+    images.add_argument("--seed", type=int, default=0)
+    images.add_argument("--output", help="Write results as JSON to this file")
+
+    near_duplicates = subparsers.add_parser("near-duplicates",
+                                            help="Perceptual-hash robustness and index lookup latency")
+    near_duplicates.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000],
+                                 help="Index sizes to time lookups at")
+    near_duplicates.add_argument("--queries", type=int, default=2000, help="Lookups per index size")
+    near_duplicates.add_argument("--max-distance", type=int, default=4, help="Hamming distance that counts as a match")
+    near_duplicates.add_argument("--photos", type=int, default=30, help="Synthetic photos for the robustness check")
+    near_duplicates.add_argument("--seed", type=int, default=0)
+    near_duplicates.add_argument("--output", help="Write results as JSON to this file")
+
+    detail_levels = subparsers.add_parser("detail-levels",
+                                          help="Answer latency and length at each Analysis Detail Level")
+    detail_levels.add_argument("--requests", type=int, default=5, help="Pipeline runs per level")
+    detail_levels.add_argument("--image-size", type=float, default=1, help="Image size in megapixels")
+    detail_levels.add_argument("--latency", type=float, default=0.3, help="Vision latency before the first token")
+    detail_levels.add_argument("--seconds-per-token", type=float, default=0.01, help="Vision generation time per token")
+    detail_levels.add_argument("--tts", choices=["elevenlabs", "gtts", "hedged"], default="gtts")
+    detail_levels.add_argument("--seed", type=int, default=0)
+    detail_levels.add_argument("--output", help="Write results as JSON to this file")
+
+    routing = subparsers.add_parser("routing", help="Pinned vision model vs routing with failover")
+    routing.add_argument("--scenarios", nargs="+", choices=list(ROUTING_SCENARIOS), default=list(ROUTING_SCENARIOS))
+    routing.add_argument("--requests", type=int, default=30, help="Vision calls per scenario and mode")
+    routing.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Concurrent callers per scenario")
+    routing.add_argument("--slo", type=float, default=1.5, help="Latency SLO of the router (seconds)")
+    routing.add_argument("--seed", type=int, default=0)
+    routing.add_argument("--output", help="Write results as JSON to this file")
+
+    service = subparsers.add_parser("service", help="Latency, throughput and load shedding of pipeline_service")
+    service.add_argument("--endpoint", choices=["diagnose", "transcribe", "analyze", "speak"], default="diagnose")
+    service.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Client connections")
+    service.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    service.add_argument("--max-concurrent", type=int, default=8, help="Service worker slots")
+    service.add_argument("--max-queued", type=int, default=32, help="Requests the service queues before 503")
+    service.add_argument("--image-size", type=float, default=1, help="Image size in megapixels")
+    service.add_argument("--audio-seconds", type=float, default=10)
+    service.add_argument("--latency", type=float, help="Base latency for every stand-in endpoint (seconds)")
+    service.add_argument("--jitter", type=float, default=0.0, help="Random extra latency per request (seconds)")
+    service.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests that get a 503")
+    service.add_argument("--tts", choices=["elevenlabs", "gtts", "hedged"], default="elevenlabs")
+    service.add_argument("--seed", type=int, default=0)
+    service.add_argument("--output", help="Write results as JSON to this file")
+
+    compare = subparsers.add_parser("compare", help="Compare two JSON result files of the same benchmark")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.benchmark == "uploads":
+        results = benchmark_uploads(args.sizes, args.audio_seconds, args.repeats)
+    elif args.benchmark == "pipeline":
+        results = benchmark_pipeline(args.image_sizes, args.audio_seconds, args.requests, args.concurrency,
+                                     args.latency, args.jitter, args.failure_rate, args.tts, args.seed)
+    elif args.benchmark == "startup":
+        results = benchmark_startup(args.budget, args.repeats)
+    elif args.benchmark == "images":
+        results = benchmark_images(args.images, args.image_size, args.repeats, args.latency, args.seconds_per_image,
+                                   args.jitter, args.seed)
+    elif args.benchmark == "near-duplicates":
+        results = benchmark_near_duplicates(args.entries, args.queries, args.max_distance, args.photos, args.seed)
+    elif args.benchmark == "detail-levels":
+        results = benchmark_detail_levels(args.requests, args.image_size, args.latency, args.seconds_per_token,
+                                          args.tts, args.seed)
+    elif args.benchmark == "routing":
+        results = benchmark_routing(args.scenarios, args.requests, args.slo, args.seed, args.concurrency)
+    elif args.benchmark == "service":
+        results = benchmark_service(args.endpoint, args.concurrency, args.requests, args.max_concurrent,
+                                    args.max_queued, args.image_size, args.audio_seconds, args.latency,
+                                    args.jitter, args.failure_rate, args.tts, args.seed)
+    else:
+        compare_results(args.baseline, args.candidate)
+        return
+
+    if args.output:
+        config = {name: value for name, value in vars(args).items() if name not in ("benchmark", "output")}
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "benchmark": args.benchmark,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "config": config,
+                "results": results,
+            }, output_file, indent=2)
+
+    if args.benchmark in ("startup", "near-duplicates") and not results["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
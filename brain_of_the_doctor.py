@@ -13,37 +13,430 @@ import base64
 
 #image_path="acne.jpg"
 
+def read_image_bytes(image):
+    """
+    Return the raw bytes of an image given as a path, bytes-like object or
+    binary file object (e.g. a Streamlit UploadedFile), without temp files.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, "getvalue"):
+        # BytesIO/UploadedFile: shares the underlying buffer instead of copying it
+        return image.getvalue()
+    if hasattr(image, "read"):
+        if hasattr(image, "seek"):
+            image.seek(0)
+        return image.read()
+    with open(image, "rb") as image_file:
+        return image_file.read()
+
 def encode_image(image_path):   
-    image_file=open(image_path, "rb")
-    return base64.b64encode(image_file.read()).decode('utf-8')
+    """Base64-encode an image given as a path, bytes or file object"""
+    return base64.b64encode(read_image_bytes(image_path)).decode('utf-8')
+
+#Step2b: Shrink large uploads before encoding them
+import io
+from PIL import Image, ImageOps
+# Imported under another name: stream_image_analysis has a per-call `metrics` dict argument
+from metrics import metrics as process_metrics
+from image_index import dhash
+
+# Groq accepts base64 images up to 4 MB per request, i.e. about 3 MB of raw bytes
+IMAGE_MAX_SIDE=1536
+IMAGE_BYTE_BUDGET=3 * 1024 * 1024
+# Llama 4 models on Groq accept at most 5 images in one request
+MAX_IMAGES_PER_REQUEST=5
+IMAGE_QUALITY_LADDER=(90, 82, 75, 68, 60, 50, 40)
+IMAGE_MIME_TYPES={"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+def _encode_with_ladder(image, output_format, byte_budget):
+    """Re-encode through the quality ladder; return the first (bytes, quality) that fits, else the smallest"""
+    data, quality=None, None
+    for quality in IMAGE_QUALITY_LADDER:
+        buffer=io.BytesIO()
+        image.save(buffer, format=output_format, quality=quality, optimize=output_format == "JPEG")
+        data=buffer.getvalue()
+        if len(data) <= byte_budget:
+            break
+    return data, quality
+
+@process_metrics.timer("stage_seconds", stage="image_encode")
+def prepare_image(image, max_side=IMAGE_MAX_SIDE, byte_budget=IMAGE_BYTE_BUDGET, output_format="JPEG"):
+    """
+    Prepare an image for the vision model: apply EXIF orientation, downscale
+    so the longest side is at most max_side, and re-encode (JPEG or WEBP)
+    down the quality ladder until it fits byte_budget. Images that are
+    already upright, small enough and in a supported format are sent as-is.
+
+    Args:
+        image: Path, bytes or binary file object (e.g. a Streamlit UploadedFile)
+
+    Returns:
+        dict: encoded (base64 str), mime_type, dhash (perceptual hash, see
+            image_index) and metrics (sizes before/after)
+    """
+    original=read_image_bytes(image)
+
+    image=Image.open(io.BytesIO(original))
+    original_format=image.format
+    original_size=image.size
+    orientation=image.getexif().get(0x0112, 1)
+
+    needs_resize=max(original_size) > max_side
+    if (not needs_resize and orientation == 1 and len(original) <= byte_budget
+            and original_format in ("JPEG", "PNG", "WEBP")):
+        data, quality, mime_type=original, None, IMAGE_MIME_TYPES[original_format]
+        final_size=original_size
+        perceptual_hash=dhash(original)
+    else:
+        image=ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # JPEG has no alpha channel; flatten transparent areas onto white
+            background=Image.new("RGB", image.size, (255, 255, 255))
+            rgba=image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image=background
+        if needs_resize:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        data, quality=_encode_with_ladder(image, output_format, byte_budget)
+        # Still over budget at the lowest quality: keep halving the resolution
+        while len(data) > byte_budget and min(image.size) > 64:
+            image=image.resize((image.width // 2, image.height // 2), Image.LANCZOS)
+            data, quality=_encode_with_ladder(image, output_format, byte_budget)
+        mime_type=IMAGE_MIME_TYPES[output_format]
+        final_size=image.size
+        perceptual_hash=dhash(image)
+
+    encoded=base64.b64encode(data).decode('utf-8')
+    return {
+        "encoded": encoded,
+        "mime_type": mime_type,
+        "dhash": perceptual_hash,
+        "metrics": {
+            "original_format": original_format,
+            "original_bytes": len(original),
+            "original_dimensions": list(original_size),
+            "prepared_bytes": len(data),
+            "prepared_dimensions": list(final_size),
+            "encoded_bytes": len(encoded),
+            "quality": quality,
+            "reduction": round(1 - len(data) / len(original), 3) if original else 0.0,
+        },
+    }
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+import json
+import time
+import logging
+from contextlib import ExitStack
+from api_clients import get_groq_client
+from response_cache import DiskCache, make_key
+from request_scheduler import scheduler
+from resilience import call_with_retry, is_retryable, RetryPolicy, CircuitOpenError, DeadlineExceeded, SlotWaitExceeded
+from image_index import PerceptualIndex
+from model_router import vision_router, FAILOVER_TIMEOUT
+
+# Seconds a vision request may take, retries and failovers included
+VISION_DEADLINE=90
+# Before failing over to another model, retry once instead of the usual three attempts
+FAILOVER_RETRY_POLICY=RetryPolicy(max_attempts=2)
+
+# Shared by every session and kept across restarts; keyed by image, query and model
+vision_cache=DiskCache("vision_analyses", max_entries=2000, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600)
+
+# A re-saved, resized or re-compressed photo with the same query reuses the earlier answer when
+# their perceptual hashes differ in at most this many of 64 bits; "off" only reuses exact matches
+_near_duplicate_setting=os.environ.get("AI_DOCTOR_NEAR_DUPLICATE_DISTANCE", "4").strip().lower()
+NEAR_DUPLICATE_DISTANCE=None if _near_duplicate_setting == "off" else int(_near_duplicate_setting)
+near_duplicates=PerceptualIndex("vision_near_duplicates", max_distance=NEAR_DUPLICATE_DISTANCE or 0)
 
 query="Is there something wrong with my face?"
 model="meta-llama/llama-4-scout-17b-16e-instruct"
 
-def analyze_image_with_query(query, model, encoded_image):
-    client=Groq()  
-    messages=[
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text", 
-                    "text": query
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{encoded_image}",
-                    },
-                },
-            ],
-        }]
-    chat_completion=client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
-
-    return chat_completion.choices[0].message.content
+def _image_parts(encoded_image, mime_type):
+    """
+    Normalize one image or a list of images to [(base64 str, mime type)].
+    Each image may be a base64 string, raw bytes / a file object, or a
+    prepare_image() result; mime_type may be one type or one per image.
+    """
+    images=list(encoded_image) if isinstance(encoded_image, (list, tuple)) else [encoded_image]
+    if not images:
+        raise ValueError("No image to analyze")
+    if len(images) > MAX_IMAGES_PER_REQUEST:
+        raise ValueError(f"At most {MAX_IMAGES_PER_REQUEST} images can be analyzed in one request, got {len(images)}")
+    mime_types=list(mime_type) if isinstance(mime_type, (list, tuple)) else [mime_type] * len(images)
+
+    parts=[]
+    for image, image_mime_type in zip(images, mime_types):
+        if isinstance(image, dict):
+            parts.append((image["encoded"], image["mime_type"]))
+        elif isinstance(image, str):
+            parts.append((image, image_mime_type))
+        else:
+            # Raw bytes or a file object can be passed instead of a base64 string
+            parts.append((encode_image(image), image_mime_type))
+    return parts
+
+def _build_messages(query, images):
+    """One user message with the query followed by every image, so the model sees them together"""
+    content=[{"type": "text", "text": query}]
+    for encoded_image, mime_type in images:
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{encoded_image}",
+            },
+        })
+    return [{"role": "user", "content": content}]
+
+def _image_hash(encoded_image, images):
+    """Perceptual hash of a single-image request (None for several images or when disabled)"""
+    if NEAR_DUPLICATE_DISTANCE is None or len(images) != 1:
+        return None
+    if isinstance(encoded_image, dict) and "dhash" in encoded_image:
+        return encoded_image["dhash"]
+    try:
+        return dhash(base64.b64decode(images[0][0]))
+    except Exception:
+        return None
+
+def _cached_analysis(cache_key, model, query, image_hash):
+    """Exact cache hit, else the answer for a near-identical image with the same query and model"""
+    cached_response=vision_cache.get(cache_key)
+    if cached_response is not None or image_hash is None:
+        return cached_response
+    for _, similar_key in near_duplicates.search(image_hash, make_key("vision", model, query))[:3]:
+        # Probes are counted as vision_near_duplicates below, not as vision cache misses
+        cached_response=vision_cache.get(similar_key, count=False)
+        if cached_response is None:
+            # The entry expired or was evicted; stop pointing at it
+            near_duplicates.remove(similar_key)
+            continue
+        process_metrics.inc("cache_requests_total", cache="vision_near_duplicates", result="hit")
+        # Remember the new bytes too, so the next identical upload is an exact hit
+        vision_cache.set(cache_key, cached_response)
+        return cached_response
+    process_metrics.inc("cache_requests_total", cache="vision_near_duplicates", result="miss")
+    return None
+
+def _store_analysis(cache_key, model, query, image_hash, response, served_model):
+    vision_cache.set(cache_key, json.dumps({"response": response, "model": served_model}))
+    if image_hash is not None:
+        near_duplicates.add(image_hash, make_key("vision", model, query), cache_key)
+
+def _unpack_cached(cached_value, model):
+    """(response, served model) of a cache entry; entries from before routing hold just the response"""
+    if cached_value.startswith('{"response"'):
+        entry=json.loads(cached_value)
+        return entry["response"], entry["model"]
+    return cached_value, model
+
+def _completion_options(max_tokens):
+    """Extra chat.completions.create arguments; the output cap is only sent when one is set"""
+    return {"max_tokens": max_tokens} if max_tokens else {}
+
+def _record_usage(usage):
+    if usage is not None:
+        process_metrics.inc("provider_tokens_total", usage.prompt_tokens or 0, provider="groq", kind="prompt")
+        process_metrics.inc("provider_tokens_total", usage.completion_tokens or 0, provider="groq", kind="completion")
+
+def _chunk_usage(chunk):
+    """Token usage of a stream, which Groq sends on the last chunk under x_groq (OpenAI-style servers use usage)"""
+    usage=getattr(chunk, "usage", None)
+    if usage is None:
+        usage=getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return usage
+
+def _should_fail_over(error):
+    """Errors another model may not have: outages, timeouts, an open breaker, or a model that was retired (404)"""
+    return (is_retryable(error) or isinstance(error, (CircuitOpenError, DeadlineExceeded))
+            or getattr(error, "status_code", None) == 404)
+
+def _call_routed(model, call):
+    """
+    Try the models vision_router ranks for this request until one answers.
+    Every model but the last gets FAILOVER_TIMEOUT and FAILOVER_RETRY_POLICY,
+    so a slow or failing model hands over to the next instead of using up
+    VISION_DEADLINE. Failures are reported to the router; the caller reports
+    the success once it knows the latency. Each model has its own circuit
+    breaker ("groq:<model>"), so a failing model cannot block the failover.
+    Running out of time in the local Groq queue is not the model's fault: it
+    is neither reported nor failed over, the request just fails.
+
+    Args:
+        model (str): Preferred model, or AUTO_MODEL for the fastest within the SLO
+        call (callable): call(model, deadline, policy, sent) makes the request and
+            sets sent["at"] to perf_counter() when an attempt got its slot and was sent
+
+    Returns:
+        tuple: (result, served model, failovers, perf_counter() when that model's last attempt was sent)
+    """
+    candidates=vision_router.ranked(preferred=model)
+    expires=time.perf_counter() + VISION_DEADLINE
+    for index, candidate in enumerate(candidates):
+        last=index == len(candidates) - 1
+        remaining=expires - time.perf_counter()
+        started=time.perf_counter()
+        sent={}
+        try:
+            if last:
+                result=call(candidate, remaining, None, sent)
+            else:
+                result=call(candidate, min(FAILOVER_TIMEOUT, remaining), FAILOVER_RETRY_POLICY, sent)
+        except SlotWaitExceeded:
+            raise
+        except Exception as e:
+            if not _should_fail_over(e):
+                # The model answered (e.g. the request was invalid), so it says nothing about its health
+                raise
+            vision_router.record(candidate, time.perf_counter() - sent.get("at", started), ok=False)
+            if last or expires - time.perf_counter() <= 0:
+                raise
+            logging.warning(f"Vision model {candidate} failed ({e}); failing over to {candidates[index + 1]}")
+            vision_router.record_failover(candidate, candidates[index + 1])
+            continue
+        return result, candidate, index, sent.get("at", started)
+
+@process_metrics.timer("stage_seconds", stage="vision")
+def analyze_image_with_query(query, model, encoded_image, use_cache=True, mime_type="image/jpeg", max_tokens=None,
+                             metrics=None):
+    """
+    Ask the vision model about one image, or about several photos of the same
+    problem at once (a list of up to MAX_IMAGES_PER_REQUEST images, sent in a
+    single request instead of one call per photo). max_tokens caps the length
+    of the answer, which bounds the generation time.
+
+    model is the preferred model or AUTO_MODEL; vision_router picks the model
+    that serves the request and fails over to the next one on errors.
+
+    Args:
+        metrics (dict): Optional dict filled with model (the model that
+            served the answer), failovers, total_time (seconds) and cached
+    """
+    images=_image_parts(encoded_image, mime_type)
+    metrics=metrics if metrics is not None else {}
+    start=time.perf_counter()
+
+    # Keyed by the requested model ("auto" included); the entry records which model answered.
+    # base64 is a 1:1 encoding, so hashing it is the same as hashing the image bytes
+    cache_key=make_key("vision", model, query, *(encoded for encoded, _ in images), *_completion_options(max_tokens).values())
+    image_hash=_image_hash(encoded_image, images) if use_cache else None
+    if use_cache:
+        cached_response=_cached_analysis(cache_key, model, query, image_hash)
+        if cached_response is not None:
+            response, served_model=_unpack_cached(cached_response, model)
+            metrics.update(model=served_model, failovers=0, total_time=time.perf_counter() - start, cached=True)
+            return response
+
+    client=get_groq_client()  
+    messages=_build_messages(query, images)
+    upload_bytes=sum(len(encoded) for encoded, _ in images) + len(query.encode("utf-8"))
+
+    def request(candidate, deadline, policy, sent):
+        def attempt(timeout):
+            sent["at"]=time.perf_counter()
+            process_metrics.inc("bytes_uploaded_total", upload_bytes, provider="groq")
+            return client.chat.completions.create(
+                messages=messages,
+                model=candidate,
+                timeout=timeout,
+                **_completion_options(max_tokens)
+            )
+        return call_with_retry("groq", attempt, deadline, policy, slot=lambda: scheduler.slot("groq"),
+                               breaker=f"groq:{candidate}")
+
+    chat_completion, served_model, failovers, started=_call_routed(model, request)
+    vision_router.record(served_model, time.perf_counter() - started, ok=True)
+    metrics.update(model=served_model, failovers=failovers, total_time=time.perf_counter() - start, cached=False)
+    _record_usage(getattr(chat_completion, "usage", None))
+    process_metrics.inc("vision_images_total", len(images))
+
+    response=chat_completion.choices[0].message.content
+    if use_cache and response:
+        _store_analysis(cache_key, model, query, image_hash, response, served_model)
+    return response
+
+#Step4: Stream the answer as it is generated
+def stream_image_analysis(query, model, encoded_image, use_cache=True, mime_type="image/jpeg", metrics=None,
+                          max_tokens=None):
+    """
+    Same request as analyze_image_with_query, but yields text deltas as the
+    model produces them so the UI can render the answer progressively.
+    A cache hit yields the whole cached answer as a single delta.
+    Like analyze_image_with_query it accepts a list of images and routes
+    between models; once text has been yielded a failure is final.
+
+    Args:
+        metrics (dict): Optional dict filled with model, failovers,
+            time_to_first_token, total_time (seconds) and cached once the
+            stream is consumed
+        max_tokens (int): Optional cap on the length of the answer
+    """
+    images=_image_parts(encoded_image, mime_type)
+    metrics=metrics if metrics is not None else {}
+    start=time.perf_counter()
+
+    cache_key=make_key("vision", model, query, *(encoded for encoded, _ in images), *_completion_options(max_tokens).values())
+    image_hash=_image_hash(encoded_image, images) if use_cache else None
+    if use_cache:
+        cached_response=_cached_analysis(cache_key, model, query, image_hash)
+        if cached_response is not None:
+            response, served_model=_unpack_cached(cached_response, model)
+            metrics.update(model=served_model, failovers=0, time_to_first_token=time.perf_counter() - start,
+                           total_time=time.perf_counter() - start, cached=True)
+            process_metrics.observe("stage_seconds", metrics["total_time"], stage="vision")
+            yield response
+            return
+
+    client=get_groq_client()
+    parts=[]
+    upload_bytes=sum(len(encoded) for encoded, _ in images) + len(query.encode("utf-8"))
+    process_metrics.inc("vision_images_total", len(images))
+
+    # Each attempt to open the stream takes its own slot, released before backoff sleeps and failovers;
+    # the slot of the attempt that succeeds is kept until the stream is fully read (or the generator is closed).
+    # Only opening the stream is retried or failed over; once text has been yielded a failure is final.
+    held_slot=ExitStack()
+
+    def open_stream(candidate, deadline, policy, sent):
+        def attempt(timeout):
+            sent["at"]=time.perf_counter()
+            process_metrics.inc("bytes_uploaded_total", upload_bytes, provider="groq")
+            return client.chat.completions.create(
+                messages=_build_messages(query, images),
+                model=candidate,
+                stream=True,
+                timeout=timeout,
+                **_completion_options(max_tokens)
+            )
+        return call_with_retry("groq", attempt, deadline, policy, slot=lambda: scheduler.slot("groq"), hold=held_slot,
+                               breaker=f"groq:{candidate}")
+
+    with held_slot:
+        stream, served_model, failovers, started=_call_routed(model, open_stream)
+        metrics.update(model=served_model, failovers=failovers)
+        usage=None
+        try:
+            for chunk in stream:
+                usage=_chunk_usage(chunk) or usage
+                delta=chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    metrics["time_to_first_token"]=time.perf_counter() - start
+                parts.append(delta)
+                yield delta
+        except Exception:
+            vision_router.record(served_model, time.perf_counter() - started, ok=False)
+            raise
+    vision_router.record(served_model, time.perf_counter() - started, ok=True)
+    _record_usage(usage)
+
+    response="".join(parts)
+    metrics.update(total_time=time.perf_counter() - start, cached=False)
+    process_metrics.observe("stage_seconds", metrics["total_time"], stage="vision")
+    if "time_to_first_token" in metrics:
+        process_metrics.observe("stage_seconds", metrics["time_to_first_token"], stage="vision_first_token")
+    if use_cache and response:
+        _store_analysis(cache_key, model, query, image_hash, response, served_model)
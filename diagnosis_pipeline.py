@@ -0,0 +1,323 @@
+# diagnosis_pipeline.py - The transcribe -> analyze -> speak pipeline, independent of the UI
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from brain_of_the_doctor import (prepare_image, analyze_image_with_query, stream_image_analysis,
+                                 IMAGE_BYTE_BUDGET, MAX_IMAGES_PER_REQUEST)
+from voice_of_the_patient import transcribe_long_audio
+from voice_of_the_doctor import synthesize_speech, SentenceSpeechPipeline
+from pipeline_executor import StagedPipeline
+from metrics import metrics
+from model_router import AUTO_MODEL
+
+# Let model_router pick among its VISION_MODELS by recent latency and errors
+VISION_MODEL = AUTO_MODEL
+STT_MODEL = "whisper-large-v3"
+
+system_prompt = """You have to act as a professional doctor, i know you are not but this is for learning purpose. 
+            What's in this image?. Do you find anything wrong with it medically? 
+            If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in 
+            your response. Also always answer as if you are answering to a real person.
+            Donot say 'In the image I see' but say 'With what I see, I think you have ....'
+            Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, 
+            {length} No preamble, start your answer right away please"""
+
+# Analysis Detail Level (Settings page): the length asked for in the prompt, a hard cap on the
+# answer's tokens (the prompt keeps answers well under it, so the cap only stops runaway answers)
+# and the latency the vision call should stay within (seconds), checked in answer_seconds metrics
+DETAIL_LEVELS = {
+    "concise": {
+        "instruction": "Your response should be one short paragraph. Keep your answer concise (max 2 sentences).",
+        "max_tokens": 120,
+        "latency_target": 2.0,
+    },
+    "standard": {
+        "instruction": "Your response should be in one paragraph of four to six sentences.",
+        "max_tokens": 320,
+        "latency_target": 4.0,
+    },
+    "detailed": {
+        "instruction": ("Your response can be two or three short paragraphs: what you see, what it most likely is "
+                        "and what else it could be, and what to do about it."),
+        "max_tokens": 700,
+        "latency_target": 8.0,
+    },
+}
+DEFAULT_DETAIL_LEVEL = "concise"
+
+
+def transcribe_stage(audio_file, use_cache=True, audio_metrics=None):
+    """
+    Pipeline stage: trim and compress the uploaded audio, then transcribe it
+    with Whisper (long recordings are split and transcribed in parallel)
+    """
+    try:
+        return transcribe_long_audio(
+            GROQ_API_KEY=os.environ.get("GROQ_API_KEY"), 
+            audio_filepath=audio_file,
+            stt_model=STT_MODEL,
+            use_cache=use_cache,
+            metrics=audio_metrics
+        )
+    except Exception as e:
+        return f"Error transcribing audio: {str(e)}"
+
+
+def encode_stage(image_file):
+    """
+    Pipeline stage: shrink the uploaded image to the upload budget and
+    base64-encode it. Given a list of photos, they are prepared in parallel
+    and share the budget, since the provider limit applies per request.
+    """
+    if not isinstance(image_file, (list, tuple)):
+        return prepare_image(image_file)
+    byte_budget = IMAGE_BYTE_BUDGET // max(1, len(image_file))
+    with ThreadPoolExecutor(max_workers=min(4, len(image_file)), thread_name_prefix="encode") as executor:
+        return list(executor.map(lambda image: prepare_image(image, byte_budget=byte_budget), image_file))
+
+
+def combined_image_metrics(prepared):
+    """Image metrics of one prepared image, or the totals over several"""
+    if isinstance(prepared, dict):
+        return prepared["metrics"]
+    original = sum(image["metrics"]["original_bytes"] for image in prepared)
+    prepared_bytes = sum(image["metrics"]["prepared_bytes"] for image in prepared)
+    return {
+        "images": len(prepared),
+        "original_bytes": original,
+        "prepared_bytes": prepared_bytes,
+        "encoded_bytes": sum(image["metrics"]["encoded_bytes"] for image in prepared),
+        "reduction": round(1 - prepared_bytes / original, 3) if original else 0.0,
+        "per_image": [image["metrics"] for image in prepared],
+    }
+
+
+def detail_level_key(detail_level):
+    """
+    Normalize a detail level to a DETAIL_LEVELS key. Accepts the key itself or
+    the Settings label ("Concise (2 sentences)"); None means DEFAULT_DETAIL_LEVEL.
+    """
+    if not detail_level:
+        return DEFAULT_DETAIL_LEVEL
+    key = detail_level.split()[0].lower()
+    if key not in DETAIL_LEVELS:
+        raise ValueError(f"Unknown detail level '{detail_level}', expected one of {', '.join(DETAIL_LEVELS)}")
+    return key
+
+
+def build_vision_query(speech_to_text_output, image_count=1, detail_level=None):
+    """Combine the system prompt for the detail level with the transcript (or a generic request without one)"""
+    query = system_prompt.format(length=DETAIL_LEVELS[detail_level_key(detail_level)]["instruction"])
+    if image_count > 1:
+        query += (f"\nYou are given {image_count} photos of the same problem, e.g. from different angles "
+                  f"or at different times. Consider them together and give one answer.\n")
+    if speech_to_text_output and not speech_to_text_output.startswith("Error"):
+        return query + speech_to_text_output
+    return query + ("Please analyze these medical images." if image_count > 1 else "Please analyze this medical image.")
+
+
+def _image_count(prepared_image):
+    return len(prepared_image) if isinstance(prepared_image, list) else 1
+
+
+def analyze_stage(pipeline, use_cache=True, detail_level=None, vision_model=VISION_MODEL, vision_metrics=None):
+    """Pipeline stage: join on the transcript and the encoded image, then call the vision model"""
+    speech_to_text_output = pipeline.result("transcribe") if pipeline.has_stage("transcribe") else ""
+    
+    try:
+        prepared_image = pipeline.result("encode_image")
+        
+        return analyze_image_with_query(
+            query=build_vision_query(speech_to_text_output, _image_count(prepared_image), detail_level), 
+            encoded_image=prepared_image, 
+            model=vision_model,
+            use_cache=use_cache,
+            max_tokens=DETAIL_LEVELS[detail_level_key(detail_level)]["max_tokens"],
+            metrics=vision_metrics
+        )
+    except Exception as e:
+        return f"Error analyzing image: {str(e)}"
+
+
+def stream_analyze_stage(pipeline, use_cache=True, speech_pipeline=None, on_partial=None, stream_metrics=None,
+                         detail_level=None, vision_model=VISION_MODEL):
+    """
+    Streaming variant of analyze_stage, run in the calling thread: the
+    answer so far is passed to on_partial as tokens arrive and, if given,
+    finished sentences go to the speech pipeline while the rest is generated.
+    """
+    speech_to_text_output = pipeline.result("transcribe") if pipeline.has_stage("transcribe") else ""
+    
+    try:
+        prepared_image = pipeline.result("encode_image")
+        
+        deltas = stream_image_analysis(
+            query=build_vision_query(speech_to_text_output, _image_count(prepared_image), detail_level),
+            encoded_image=prepared_image,
+            model=vision_model,
+            use_cache=use_cache,
+            metrics=stream_metrics,
+            max_tokens=DETAIL_LEVELS[detail_level_key(detail_level)]["max_tokens"]
+        )
+        if speech_pipeline is not None:
+            deltas = speech_pipeline.feed(deltas)
+        
+        doctor_response = ""
+        for delta in deltas:
+            doctor_response += delta
+            if on_partial is not None:
+                on_partial(doctor_response)
+        return doctor_response
+    except Exception as e:
+        return f"Error analyzing image: {str(e)}"
+
+
+def default_tts_provider():
+    """ElevenLabs when a key is configured, otherwise Google TTS"""
+    elevenlabs_key = os.environ.get('ELEVENLABS_API_KEY') or os.environ.get('ELEVEN_API_KEY')
+    return "elevenlabs" if (elevenlabs_key and elevenlabs_key.strip()) else "gtts"
+
+
+def is_speakable(doctor_response):
+    """False for the placeholder/error strings the stages return instead of an answer"""
+    return bool(doctor_response) and not doctor_response.startswith("Error") and not doctor_response.startswith("No image")
+
+
+def record_answer_latency(detail_level, seconds, response):
+    """
+    Record how long the vision answer took against its detail level's latency
+    target, in answer_seconds{detail_level} and answer_latency_target_total.
+    seconds is the vision call's own total_time, so image encoding and the
+    speech consumer do not count; callers skip cache hits, which say nothing
+    about generation time.
+
+    Returns:
+        dict: detail_level, max_tokens, latency_target, seconds, within_target, characters
+    """
+    level = DETAIL_LEVELS[detail_level]
+    within_target = seconds <= level["latency_target"]
+    metrics.observe("answer_seconds", seconds, detail_level=detail_level)
+    metrics.inc("answer_latency_target_total", detail_level=detail_level, result="met" if within_target else "missed")
+    return {
+        "detail_level": detail_level,
+        "max_tokens": level["max_tokens"],
+        "latency_target": level["latency_target"],
+        "seconds": round(seconds, 4),
+        "within_target": within_target,
+        "characters": len(response),
+    }
+
+
+def run_pipeline(audio_file, image_file, use_cache=True, preferred_tts=None, output_filepath=None, speak=True,
+                 stream=False, progress=None, detail_level=None, vision_model=None):
+    """
+    Run transcribe -> analyze -> speak without any UI, with transcription
+    and image encoding overlapped as in the Streamlit app.
+    
+    Args:
+        audio_file: Audio as a path, bytes or file object (or None)
+        image_file: Image as a path, bytes or file object, a list of up to
+            MAX_IMAGES_PER_REQUEST of them (analyzed together in one request), or None
+        use_cache (bool): Use the response caches
+        preferred_tts (str): 'elevenlabs', 'gtts' or 'hedged' (default: by available key)
+        output_filepath (str): Optional per-request path the voice response is also written to
+        speak (bool): Skip text-to-speech when False
+        stream (bool): Stream the vision answer and synthesize speech
+            sentence by sentence while it is still being generated
+        progress (callable): Called as progress(stage, status, detail) when a
+            stage is "started", "done" or "failed" (detail: its timing), and
+            with status "partial" and the answer so far while streaming
+        detail_level (str): Key of DETAIL_LEVELS or the Settings label
+            (default: DEFAULT_DETAIL_LEVEL); sets the answer length, its token cap
+            and the latency target it is measured against
+        vision_model (str): Preferred vision model, or AUTO_MODEL (default)
+            for the fastest one within the SLO (see model_router)
+    
+    Returns:
+        dict: transcript, response, vision_model (the model that answered),
+            audio (MP3 bytes), audio_path (when output_filepath was given),
+            tts_message, timings, audio_metrics, image_metrics and answer_metrics
+    """
+    detail_level = detail_level_key(detail_level)
+    result = {
+        "transcript": "",
+        "response": "",
+        "vision_model": None,
+        "audio": None,
+        "audio_path": None,
+        "tts_message": None,
+        "audio_metrics": None,
+        "image_metrics": None,
+        "answer_metrics": None,
+    }
+    audio_metrics = {}
+    vision_metrics = {}
+    vision_model = vision_model or VISION_MODEL
+    preferred_tts = preferred_tts or default_tts_provider()
+    speech_pipeline = None
+    
+    def on_partial(text):
+        progress("analyze", "partial", text)
+    
+    with StagedPipeline(listener=progress) as pipeline:
+        if audio_file is not None:
+            pipeline.submit("transcribe", transcribe_stage, audio_file, use_cache, audio_metrics)
+        if image_file is not None:
+            pipeline.submit("encode_image", encode_stage, image_file)
+            if not stream:
+                analyze_after = ("transcribe", "encode_image") if audio_file is not None else ("encode_image",)
+                pipeline.submit("analyze", analyze_stage, pipeline, use_cache, detail_level, vision_model,
+                                vision_metrics, after=analyze_after)
+        
+        if audio_file is not None:
+            result["transcript"] = pipeline.result("transcribe")
+            result["audio_metrics"] = audio_metrics or None
+        
+        if image_file is not None:
+            if stream:
+                speech_pipeline = SentenceSpeechPipeline(preferred_tts=preferred_tts, use_cache=use_cache) if speak else None
+                with pipeline.stage("analyze"):
+                    result["response"] = stream_analyze_stage(pipeline, use_cache, speech_pipeline,
+                                                              on_partial if progress else None, vision_metrics,
+                                                              detail_level, vision_model)
+            else:
+                result["response"] = pipeline.result("analyze")
+            result["vision_model"] = vision_metrics.get("model")
+            try:
+                result["image_metrics"] = combined_image_metrics(pipeline.result("encode_image"))
+            except Exception:
+                pass
+        else:
+            result["response"] = "No image provided for me to analyze"
+        
+        if speak and is_speakable(result["response"]):
+            with pipeline.stage("tts"):
+                if speech_pipeline is not None:
+                    # Most sentences were already synthesized while the answer streamed in
+                    success, audio, message = speech_pipeline.finish()
+                    if success and output_filepath:
+                        with open(output_filepath, "wb") as audio_file_output:
+                            audio_file_output.write(audio)
+                else:
+                    success, audio, message = synthesize_speech(
+                        input_text=result["response"],
+                        preferred_tts=preferred_tts,
+                        use_cache=use_cache,
+                        output_filepath=output_filepath
+                    )
+            result["audio"] = audio if success else None
+            result["audio_path"] = output_filepath if success else None
+            result["tts_message"] = message
+        elif speech_pipeline is not None:
+            speech_pipeline.close()
+    
+    result["timings"] = pipeline.report()
+    if is_speakable(result["response"]) and "total_time" in vision_metrics and not vision_metrics.get("cached"):
+        result["answer_metrics"] = record_answer_latency(detail_level, vision_metrics["total_time"],
+                                                         result["response"])
+    if "time_to_first_token" in vision_metrics:
+        result["timings"]["time_to_first_token"] = round(vision_metrics["time_to_first_token"], 4)
+    if speech_pipeline is not None and speech_pipeline.metrics["first_audio_at"] is not None:
+        result["timings"]["first_audio_ready"] = speech_pipeline.metrics["first_audio_at"]
+    return result
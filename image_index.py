@@ -0,0 +1,184 @@
+# image_index.py - Perceptual hashes and a Hamming-distance index for near-duplicate images
+
+import io
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+from response_cache import CACHE_DIR
+
+HASH_BITS = 64
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size grey pixels and
+    set one bit per pixel that is brighter than its right neighbour. Re-saving,
+    re-compressing or resizing a photo changes few (usually no) bits.
+
+    Args:
+        image: PIL image or encoded image bytes
+
+    Returns:
+        int: hash_size * hash_size bit hash
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(io.BytesIO(image))
+        # JPEG can decode straight at a fraction of the size, which is all a 9x8 thumbnail needs
+        image.draft("L", (hash_size * 8, hash_size * 8))
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(first, second):
+    return (first ^ second).bit_count()
+
+
+class MultiIndexHash:
+    """
+    Exact Hamming-distance search by multi-index hashing. Every hash is split
+    into max_distance + 1 chunks; by the pigeonhole principle a hash within
+    max_distance of the query matches it exactly in at least one chunk, so a
+    lookup is max_distance + 1 dict lookups plus a popcount per candidate
+    instead of a scan. Entries are grouped by namespace (e.g. model + query)
+    and only match within it. Oldest entries are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_distance=4, bits=HASH_BITS, max_entries=100_000):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        chunks = max_distance + 1
+        self._chunks = []
+        shift = 0
+        for index in range(chunks):
+            width = bits // chunks + (1 if index < bits % chunks else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._chunks]  # (namespace, chunk value) -> set of values
+        self._entries = OrderedDict()  # value -> (hash, namespace), oldest first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, image_hash, namespace, value):
+        """Index `value` (e.g. a cache key) under a hash; an existing value is moved to the new hash"""
+        if value in self._entries:
+            self.remove(value)
+        self._entries[value] = (image_hash, namespace)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((namespace, (image_hash >> shift) & mask), set()).add(value)
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, value):
+        if value not in self._entries:
+            return
+        image_hash, namespace = self._entries.pop(value)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            key = (namespace, (image_hash >> shift) & mask)
+            bucket = table[key]
+            bucket.discard(value)
+            if not bucket:
+                del table[key]
+
+    def search(self, image_hash, namespace, max_distance=None):
+        """
+        Returns:
+            list: (distance, value) within max_distance (at most the index's), nearest first
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        matches = {}
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for value in table.get((namespace, (image_hash >> shift) & mask), ()):
+                if value not in matches:
+                    matches[value] = (self._entries[value][0] ^ image_hash).bit_count()
+        return sorted((distance, value) for value, distance in matches.items() if distance <= max_distance)
+
+
+class PerceptualIndex:
+    """
+    MultiIndexHash persisted in a SQLite file next to the response caches,
+    so near-duplicate lookups survive restarts. The file is loaded on first
+    use; entries other processes add later are picked up on their restart.
+    """
+
+    def __init__(self, name, max_distance=4, max_entries=100_000, cache_dir=None):
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._index = None
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    value TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _loaded(self):
+        # Called with the lock held
+        if self._index is None:
+            index = MultiIndexHash(self.max_distance, max_entries=self.max_entries)
+            with self._connect() as conn:
+                rows = conn.execute("SELECT value, hash, namespace FROM entries ORDER BY created_at").fetchall()
+            for value, image_hash, namespace in rows:
+                index.add(int(image_hash, 16), namespace, value)
+            self._index = index
+        return self._index
+
+    def add(self, image_hash, namespace, value):
+        with self._lock:
+            self._loaded().add(image_hash, namespace, value)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (value, hash, namespace, created_at) VALUES (?, ?, ?, ?)",
+                         (value, format(image_hash, "x"), namespace, time.time()))
+            conn.execute("DELETE FROM entries WHERE value IN (SELECT value FROM entries ORDER BY created_at DESC "
+                         "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def remove(self, value):
+        """Drop `value`, e.g. a cache key whose entry has been evicted"""
+        with self._lock:
+            self._loaded().remove(value)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE value = ?", (value,))
+
+    def search(self, image_hash, namespace, max_distance=None):
+        """(distance, value) pairs within max_distance, nearest first"""
+        with self._lock:
+            return self._loaded().search(image_hash, namespace, max_distance)
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._index) if self._index is not None else None
+        return {"entries": entries, "max_distance": self.max_distance}
@@ -0,0 +1,206 @@
+# job_queue.py - Background jobs for the Analyze button, polled by the Streamlit page
+
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from request_scheduler import request_context, PRIORITY_INTERACTIVE
+from metrics import metrics
+
+# Finished jobs are kept this long (seconds) so a session can navigate away and come back
+JOB_TTL_SECONDS = float(os.environ.get("AI_DOCTOR_JOB_TTL") or 3600)
+MAX_STORED_JOBS = 200
+# Pipelines running at once; further jobs wait in the queue
+JOB_WORKERS = int(os.environ.get("AI_DOCTOR_JOB_WORKERS") or 4)
+
+
+def job_fingerprint(audio, image, settings):
+    """Hash of the inputs and the settings that change the result, used to reuse a job instead of re-running it"""
+    digest = hashlib.sha256()
+    images = image if isinstance(image, (list, tuple)) else [image]
+    for name, data in [("audio", audio[1] if audio else None)] + [("image", data) for data in images]:
+        digest.update(name.encode())
+        digest.update(hashlib.sha256(data).digest() if data else b"-")
+    digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+
+class Job:
+    """
+    One Analyze run. Updated by the worker thread; readers take snapshot()
+    so they never see a half-written state.
+    """
+
+    def __init__(self, session_id, fingerprint):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.fingerprint = fingerprint
+        self.status = "queued"  # queued -> running -> done / failed
+        self.stages = {}  # stage -> {"status": started/done/failed, "duration": seconds}
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def update_stage(self, stage, status, detail):
+        with self._lock:
+            if status == "partial":
+                self.partial = detail
+                return
+            self.stages[stage] = {"status": status, "duration": detail["duration"] if detail else None}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "stages": {stage: dict(state) for stage, state in self.stages.items()},
+                "partial": self.partial,
+                "result": self.result,
+                "error": self.error,
+                "elapsed": round((self.finished or time.time()) - self.created, 2),
+            }
+
+
+class JobStore:
+    """Jobs by id and by (session, fingerprint); finished jobs expire after JOB_TTL_SECONDS"""
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, max_jobs=MAX_STORED_JOBS):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, session_id, fingerprint):
+        """The newest job of this session for the same inputs that is still pending or produced an answer"""
+        with self._lock:
+            matches = [
+                job for job in self._jobs.values()
+                if job.session_id == session_id and job.fingerprint == fingerprint and self._reusable(job)
+            ]
+        return max(matches, key=lambda job: job.created) if matches else None
+
+    @staticmethod
+    def _reusable(job):
+        if job.status in ("queued", "running"):
+            return True
+        if job.status != "done":
+            return False
+        # A finished pipeline can still carry an "Error ..." response (e.g. a timed out vision call);
+        # diagnosis_pipeline is already loaded once a job has run
+        from diagnosis_pipeline import is_speakable
+        return is_speakable((job.result or {}).get("response"))
+
+    def _evict(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+        # Over the limit: drop the oldest finished jobs; running ones are never dropped
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished)
+        for job in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job.id]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+
+
+class JobQueue:
+    """
+    Runs the diagnosis pipeline on a worker pool so the Streamlit script
+    thread only submits a job and polls its progress. Submitting the same
+    inputs and settings again from the same session returns the existing job,
+    so reruns and navigating away and back do not repeat the API calls. Jobs
+    that failed or answered with an error are never reused, so clicking
+    Analyze again retries them.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, store=None):
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, session_id, audio=None, image=None, use_cache=True, preferred_tts=None, stream=True,
+               detail_level=None, vision_model=None):
+        """
+        Queue an Analyze run.
+
+        Args:
+            session_id (str): Session the job belongs to (also its scheduler fairness key)
+            audio (tuple): (filename, bytes) of the recording, or None
+            image (bytes): Raw image bytes, a list of them (photos analyzed together), or None
+            use_cache (bool): Use the response caches
+            preferred_tts (str): TTS provider passed to run_pipeline
+            stream (bool): Stream the answer so snapshot()["partial"] fills in as it is generated
+            detail_level (str): Analysis Detail Level passed to run_pipeline
+            vision_model (str): Preferred vision model passed to run_pipeline
+
+        Returns:
+            str: Job id to poll with get()
+        """
+        fingerprint = job_fingerprint(audio, image, {"use_cache": use_cache, "preferred_tts": preferred_tts,
+                                                     "detail_level": detail_level, "vision_model": vision_model})
+        existing = self.store.find(session_id, fingerprint)
+        if existing is not None:
+            metrics.inc("jobs_total", result="reused")
+            return existing.id
+
+        job = Job(session_id, fingerprint)
+        self.store.add(job)
+        metrics.inc("jobs_total", result="submitted")
+        self._executor.submit(self._run, job, audio, image, use_cache, preferred_tts, stream, detail_level,
+                              vision_model)
+        return job.id
+
+    def _run(self, job, audio, image, use_cache, preferred_tts, stream, detail_level, vision_model):
+        # Imported here so the app can start without loading the provider SDKs
+        from diagnosis_pipeline import run_pipeline
+
+        with job._lock:
+            job.status = "running"
+        metrics.observe("stage_seconds", time.time() - job.created, stage="job_queue_wait")
+        try:
+            with request_context(session_id=job.session_id, priority=PRIORITY_INTERACTIVE):
+                result = run_pipeline(audio, image, use_cache=use_cache, preferred_tts=preferred_tts,
+                                      stream=stream, progress=job.update_stage, detail_level=detail_level,
+                                      vision_model=vision_model)
+            with job._lock:
+                job.result = result
+                job.status = "done"
+        except Exception as e:
+            logging.exception(f"Job {job.id} failed")
+            with job._lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            with job._lock:
+                job.finished = time.time()
+            metrics.inc("jobs_total", result=job.status)
+
+    def get(self, job_id):
+        """Snapshot of a job, or None if it is unknown or expired"""
+        job = self.store.get(job_id)
+        return job.snapshot() if job else None
+
+    def stats(self):
+        return self.store.stats()
+
+
+jobs = JobQueue()
+metrics.describe("jobs_total", "Analyze jobs by outcome (submitted, reused, done, failed)")
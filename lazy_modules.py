@@ -0,0 +1,48 @@
+# lazy_modules.py - Provider modules that are imported on first use instead of at start-up
+
+import time
+import importlib
+import threading
+
+from metrics import metrics
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it the first time one of its
+    attributes is used, so pages that never call a provider (home, about)
+    do not pay for gtts, elevenlabs, pydub, speech_recognition or Pillow.
+    The import time is recorded as import_seconds{module=...}.
+    """
+
+    _import_lock = threading.Lock()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        if self._module is None:
+            with LazyModule._import_lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    metrics.observe("import_seconds", time.perf_counter() - start, module=self._name)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+brain = LazyModule("brain_of_the_doctor")
+patient_voice = LazyModule("voice_of_the_patient")
+doctor_voice = LazyModule("voice_of_the_doctor")
+diagnosis = LazyModule("diagnosis_pipeline")
@@ -0,0 +1,218 @@
+# metrics.py - Process-wide latency histograms and counters with a Prometheus text export
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NAMESPACE = "ai_doctor"
+# Upper bounds (seconds) of the exported histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def percentile(values, fraction):
+    """Linear-interpolated percentile of a list of numbers (fraction in 0..1)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Histogram:
+    """
+    Cumulative bucket counts for export plus the most recent samples, from
+    which p50/p95/p99 are computed for display.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=2000):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+
+    def summary(self):
+        recent = list(self.recent)
+        return {
+            "count": self.count,
+            "p50": round(percentile(recent, 0.50), 4) if recent else None,
+            "p95": round(percentile(recent, 0.95), 4) if recent else None,
+            "p99": round(percentile(recent, 0.99), 4) if recent else None,
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters keyed by name and labels, shared by every thread
+    and session in the process.
+
+        metrics.observe("stage_seconds", 0.42, stage="transcription")
+        metrics.inc("bytes_uploaded_total", 52000, provider="groq")
+        with metrics.timer("stage_seconds", stage="image_encode"):
+            ...
+    """
+
+    def __init__(self, namespace=NAMESPACE):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {label_key: Histogram}
+        self._counters = {}  # name -> {label_key: float}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block (also usable as a function decorator)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        Returns:
+            dict: {"latency": {series: {count, p50, p95, p99}}, "counters": {series: value}}
+        """
+        with self._lock:
+            latency = {
+                f"{name}{_format_labels(key)}": histogram.summary()
+                for name, series in sorted(self._histograms.items())
+                for key, histogram in sorted(series.items())
+            }
+            counters = {
+                f"{name}{_format_labels(key)}": value
+                for name, series in sorted(self._counters.items())
+                for key, value in sorted(series.items())
+            }
+        return {"latency": latency, "counters": counters}
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                full_name = f"{self.namespace}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                full_name = f"{self.namespace}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the export atomically, e.g. for the node_exporter textfile collector"""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.replace(temporary_path, path)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
+metrics.describe("stage_seconds", "Latency of each pipeline stage in seconds")
+metrics.describe("provider_request_seconds", "Latency of individual provider API attempts in seconds")
+metrics.describe("provider_requests_total", "Provider API attempts")
+metrics.describe("provider_errors_total", "Failed provider API attempts")
+metrics.describe("bytes_uploaded_total", "Request payload bytes sent to each provider")
+metrics.describe("cache_requests_total", "Response cache lookups by result")
+metrics.describe("provider_tokens_total", "Prompt and completion tokens reported by the providers")
+metrics.describe("vision_images_total", "Images sent to the vision model")
+metrics.describe("answer_seconds", "Time to the full vision answer per Analysis Detail Level in seconds")
+metrics.describe("answer_latency_target_total", "Vision answers that met or missed their detail level's latency target")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """
+    Serve GET /metrics on a daemon thread. The port defaults to
+    AI_DOCTOR_METRICS_PORT; without it (and without a port) nothing starts.
+
+    Returns:
+        ThreadingHTTPServer or None
+    """
+    port = port if port is not None else os.environ.get("AI_DOCTOR_METRICS_PORT")
+    if port is None or port == "":
+        return None
+    try:
+        server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    except OSError as e:
+        logging.warning(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving Prometheus metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
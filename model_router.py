@@ -0,0 +1,168 @@
+# model_router.py - Picks the vision model for each request from recent latency and errors
+
+import os
+import time
+import random
+import threading
+from collections import deque
+
+from metrics import metrics, percentile
+
+# Passed as the model to let the router choose
+AUTO_MODEL = "auto"
+# Vision models on Groq to route between, preferred first; AI_DOCTOR_VISION_MODELS overrides (comma-separated)
+VISION_MODELS = tuple(
+    model.strip() for model in (os.environ.get("AI_DOCTOR_VISION_MODELS") or
+                                "meta-llama/llama-4-scout-17b-16e-instruct,"
+                                "meta-llama/llama-4-maverick-17b-128e-instruct").split(",")
+    if model.strip()
+)
+# p95 latency (seconds) of a vision call a model has to stay within to be preferred
+VISION_LATENCY_SLO = float(os.environ.get("AI_DOCTOR_VISION_SLO") or 4.0)
+# A model that has not answered within this many seconds is abandoned for the next one
+FAILOVER_TIMEOUT = float(os.environ.get("AI_DOCTOR_VISION_FAILOVER_TIMEOUT") or 15.0)
+
+# Only calls from the last WINDOW_SECONDS (at most WINDOW_SIZE of them) count
+WINDOW_SIZE = 50
+WINDOW_SECONDS = 300
+# With fewer recent calls than this a model's latency is unknown
+MIN_SAMPLES = 5
+MAX_ERROR_RATE = 0.25
+# This many failures in a row take a model out of rotation before its error rate catches up
+MAX_CONSECUTIVE_FAILURES = 3
+# Share of requests sent to a model with unknown latency first, so recovered or new models are re-measured
+EXPLORE_RATE = 0.05
+
+
+class ModelWindow:
+    """Rolling window of (time, seconds, ok) outcomes of one model"""
+
+    def __init__(self, size=WINDOW_SIZE, seconds=WINDOW_SECONDS):
+        self.seconds = seconds
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds, ok):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def recent(self):
+        cutoff = time.monotonic() - self.seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def summary(self):
+        samples = self.recent()
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        consecutive_failures = 0
+        for _, _, ok in reversed(samples):
+            if ok:
+                break
+            consecutive_failures += 1
+        return {
+            "samples": len(samples),
+            "error_rate": round(sum(1 for _, _, ok in samples if not ok) / len(samples), 3) if samples else 0.0,
+            "p50": round(percentile(latencies, 0.50), 4) if latencies else None,
+            "p95": round(percentile(latencies, 0.95), 4) if latencies else None,
+            "consecutive_failures": consecutive_failures,
+        }
+
+
+class ModelRouter:
+    """
+    Orders the vision models for a request. Models whose recent p95 latency
+    is within the SLO and whose error rate is acceptable come first, fastest
+    first; models without enough recent calls to judge follow in configured
+    order; models that are over the SLO or failing come last, so a request
+    still has somewhere to go when every model is struggling. Callers try
+    the models in this order and report every outcome with record().
+
+    A preferred model (e.g. picked in Settings) goes first unless it is
+    known to be over the SLO or failing, in which case the others are tried
+    before it.
+    """
+
+    def __init__(self, models=VISION_MODELS, slo=VISION_LATENCY_SLO, explore_rate=EXPLORE_RATE, seed=None):
+        self.models = tuple(models)
+        self.slo = slo
+        self.explore_rate = explore_rate
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _window(self, model):
+        # Called with the lock held
+        if model not in self._windows:
+            self._windows[model] = ModelWindow()
+        return self._windows[model]
+
+    def _state(self, summary):
+        if summary["consecutive_failures"] >= MAX_CONSECUTIVE_FAILURES:
+            return "failing"
+        if summary["samples"] < MIN_SAMPLES:
+            return "unknown"
+        if summary["error_rate"] > MAX_ERROR_RATE:
+            return "failing"
+        if summary["p95"] is None or summary["p95"] > self.slo:
+            return "slow"
+        return "healthy"
+
+    def ranked(self, preferred=None):
+        """
+        Models to try for one request, best first.
+
+        Args:
+            preferred (str): Model to put first while it is healthy or unknown
+                (None or AUTO_MODEL: the fastest healthy model goes first)
+        """
+        preferred = None if preferred in (None, AUTO_MODEL) else preferred
+        models = list(self.models)
+        if preferred is not None and preferred not in models:
+            models.insert(0, preferred)
+        with self._lock:
+            summaries = {model: self._window(model).summary() for model in models}
+            explore = self._random.random() < self.explore_rate
+        states = {model: self._state(summary) for model, summary in summaries.items()}
+
+        healthy = sorted((model for model in models if states[model] == "healthy"), key=lambda m: summaries[m]["p95"])
+        unknown = [model for model in models if states[model] == "unknown"]
+        struggling = sorted((model for model in models if states[model] in ("slow", "failing")),
+                            key=lambda m: (states[m] == "failing", summaries[m]["error_rate"],
+                                           summaries[m]["p95"] or float("inf")))
+        if explore and unknown:
+            # Occasionally measure a model that has no recent data instead of waiting for a failover
+            healthy.insert(0, unknown.pop(self._random.randrange(len(unknown))))
+        order = healthy + unknown + struggling
+        if preferred is not None and states[preferred] in ("healthy", "unknown"):
+            order.remove(preferred)
+            order.insert(0, preferred)
+        return order
+
+    def record(self, model, seconds, ok):
+        """Report one vision call (seconds until the full answer, whether it succeeded)"""
+        with self._lock:
+            self._window(model).record(seconds, ok)
+        metrics.inc("vision_model_requests_total", model=model, result="ok" if ok else "error")
+        if ok:
+            metrics.observe("vision_model_seconds", seconds, model=model)
+
+    def record_failover(self, from_model, to_model):
+        metrics.inc("vision_failovers_total", from_model=from_model, to_model=to_model)
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+    def stats(self):
+        with self._lock:
+            models = list(dict.fromkeys(self.models + tuple(self._windows)))
+            summaries = {model: self._window(model).summary() for model in models}
+        return {
+            "slo": self.slo,
+            "models": {model: {**summary, "state": self._state(summary)} for model, summary in summaries.items()},
+        }
+
+
+vision_router = ModelRouter()
+metrics.describe("vision_model_requests_total", "Vision calls per model by outcome")
+metrics.describe("vision_model_seconds", "Latency of successful vision calls per model in seconds")
+metrics.describe("vision_failovers_total", "Vision requests moved to another model after the first one failed")
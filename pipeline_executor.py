@@ -0,0 +1,120 @@
+# pipeline_executor.py - Staged executor for the transcribe / encode / analyze pipeline
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StagedPipeline:
+    """
+    Runs named pipeline stages on a thread pool so that independent stages
+    (e.g. Whisper transcription and image encoding) overlap, while dependent
+    stages wait for the stages they need.
+
+    Every stage is timed from the moment its dependencies are satisfied until
+    it finishes, so report() can compare the wall-clock time of the run with
+    the time a strictly sequential run would have taken.
+
+    If a listener is given it is called as listener(name, status, timing)
+    when a stage starts ("started", timing None) and ends ("done" or
+    "failed"), from whichever thread runs the stage.
+    """
+
+    def __init__(self, max_workers=4, listener=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self._futures = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._finished = None
+        self._listener = listener
+
+    def submit(self, name, fn, *args, after=(), **kwargs):
+        """
+        Schedule a stage.
+
+        Args:
+            name (str): Unique stage name, used for result() and timings
+            fn (callable): Function to run; called as fn(*args, **kwargs)
+            after (iterable): Names of stages that must finish first
+
+        Returns:
+            Future: Future for the stage result
+        """
+        if name in self._futures:
+            raise ValueError(f"Stage '{name}' already submitted")
+        dependencies = [self._futures[dep] for dep in after]
+
+        def run_stage():
+            for dependency in dependencies:
+                dependency.exception()  # wait, but let the stage decide how to handle failures
+            with self.stage(name):
+                return fn(*args, **kwargs)
+
+        # Run in a copy of the caller's context so request tags (session, priority) follow the stage
+        future = self._executor.submit(contextvars.copy_context().run, run_stage)
+        self._futures[name] = future
+        return future
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work that runs in the calling thread as a stage"""
+        start = time.perf_counter()
+        if self._listener:
+            self._listener(name, "started", None)
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            end = time.perf_counter()
+            timing = {
+                "start": round(start - self._started, 4),
+                "duration": round(end - start, 4),
+                "thread": threading.current_thread().name,
+            }
+            with self._lock:
+                self._timings[name] = timing
+            if self._listener:
+                self._listener(name, status, timing)
+
+    def result(self, name, timeout=None):
+        """Block until a stage is done and return its result (re-raises its exception)"""
+        return self._futures[name].result(timeout=timeout)
+
+    def has_stage(self, name):
+        return name in self._futures
+
+    def close(self):
+        """Wait for outstanding stages and release the worker threads"""
+        self._executor.shutdown(wait=True)
+        if self._finished is None:
+            self._finished = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def report(self):
+        """
+        Summarize stage timings for the run.
+
+        Returns:
+            dict: per-stage timings plus wall-clock, sequential and saved seconds
+        """
+        finished = self._finished if self._finished is not None else time.perf_counter()
+        with self._lock:
+            stages = dict(self._timings)
+        wall_clock = finished - self._started
+        sequential = sum(timing["duration"] for timing in stages.values())
+        return {
+            "stages": stages,
+            "wall_clock": round(wall_clock, 4),
+            "sequential": round(sequential, 4),
+            "saved": round(max(0.0, sequential - wall_clock), 4),
+        }
@@ -0,0 +1,451 @@
+# pipeline_service.py - Async HTTP API for the diagnosis pipeline and its single stages
+#
+# Usage:
+#   python pipeline_service.py --port 8080 --max-concurrent 8
+#
+#   curl -F image=@rash.jpg -F audio=@question.wav http://127.0.0.1:8080/v1/diagnose
+#   curl -F audio=@question.wav http://127.0.0.1:8080/v1/transcribe
+#   curl -F image=@rash.jpg -F query="Is this infected?" -F detail_level=standard http://127.0.0.1:8080/v1/analyze
+#   curl -d '{"text": "Keep the rash dry."}' http://127.0.0.1:8080/v1/speak -o answer.mp3
+#
+# A Starlette app served by uvicorn. Uploads are parsed by python-multipart
+# (large files spill to temporary files) before a request takes a processing
+# slot, so a slow client never holds one. Provider calls run on a worker pool
+# sized to --max-concurrent, so the event loop never blocks. Requests beyond
+# --max-concurrent wait for a slot; beyond --max-queued more they are turned
+# away with 503.
+
+import os
+import json
+import time
+import base64
+import asyncio
+import logging
+import argparse
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request, ClientDisconnect
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from lazy_modules import brain, patient_voice, doctor_voice, diagnosis
+from request_scheduler import request_context, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from resilience import CircuitOpenError, DeadlineExceeded
+from metrics import metrics
+from model_router import vision_router, AUTO_MODEL
+
+MAX_CONCURRENT = int(os.environ.get("AI_DOCTOR_SERVICE_MAX_CONCURRENT") or 8)
+MAX_QUEUED = int(os.environ.get("AI_DOCTOR_SERVICE_MAX_QUEUED") or 32)
+# Whisper accepts up to 25 MB; images are shrunk before upload anyway
+MAX_UPLOAD_BYTES = 40 * 1024 * 1024
+# Seconds a client has to send its whole upload before it gets 408
+UPLOAD_TIMEOUT = float(os.environ.get("AI_DOCTOR_SERVICE_UPLOAD_TIMEOUT") or 60)
+MAX_FORM_PARTS = 32
+TTS_PROVIDERS = ("elevenlabs", "gtts", "hedged")
+
+metrics.describe("service_requests_total", "HTTP service requests by endpoint and status")
+metrics.describe("service_request_seconds", "HTTP service request latency in seconds")
+
+
+def _flag(value, default=True):
+    if value is None:
+        return default
+    return str(value).strip().lower() not in ("0", "false", "no", "off")
+
+
+def _error(status, message, headers=None):
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+class PipelineService:
+    """
+    HTTP server exposing
+
+        POST /v1/diagnose    multipart image(s) and/or audio -> transcript, analysis, base64 MP3
+        POST /v1/transcribe  multipart audio -> transcript
+        POST /v1/analyze     multipart image(s) (+ query) -> analysis
+        POST /v1/speak       JSON or form {"text"} -> audio/mpeg
+        GET  /healthz, GET /metrics
+
+    Repeating the image field sends up to MAX_IMAGES_PER_REQUEST photos
+    to the vision model together. Options (tts, use_cache, speak,
+    detail_level, vision_model) can be form fields or query parameters.
+    Requests are tagged with X-Session-Id (default: the client address) for
+    fair queuing in the provider scheduler; "X-Priority: batch" queues them
+    behind interactive work.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, max_concurrent=MAX_CONCURRENT, max_queued=MAX_QUEUED,
+                 max_upload_bytes=MAX_UPLOAD_BYTES, upload_timeout=UPLOAD_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_upload_bytes = max_upload_bytes
+        self.upload_timeout = upload_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="service")
+        self._slots = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._server = None
+        self._serving = None
+        self.app = Starlette(
+            routes=[
+                Route("/v1/diagnose", self._endpoint(self._diagnose), methods=["POST"]),
+                Route("/v1/transcribe", self._endpoint(self._transcribe), methods=["POST"]),
+                Route("/v1/analyze", self._endpoint(self._analyze), methods=["POST"]),
+                Route("/v1/speak", self._endpoint(self._speak), methods=["POST"]),
+                Route("/healthz", self._endpoint(self._health), methods=["GET"]),
+                Route("/metrics", self._endpoint(self._metrics), methods=["GET"]),
+            ],
+            exception_handlers={404: self._no_route, 405: self._no_route},
+        )
+
+    async def start(self):
+        # Import the provider modules on the worker pool now, so no request imports them on the event loop
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._load_modules)
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, lifespan="off", access_log=False,
+                                log_config=None)
+        self._server = uvicorn.Server(config)
+        self._serving = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._serving.done():
+                self._serving.result()
+                raise RuntimeError(f"Pipeline service could not listen on {self.host}:{self.port}")
+            await asyncio.sleep(0.01)
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        logging.info(f"Pipeline service listening on http://{self.host}:{self.port}")
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._serving
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            await self._serving
+        self._executor.shutdown(wait=False)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @staticmethod
+    def _load_modules():
+        for module in (brain, patient_voice, doctor_voice, diagnosis):
+            module.load()
+
+    def _endpoint(self, handler):
+        """Wrap a handler with error responses and the service_requests_total / service_request_seconds metrics"""
+        async def endpoint(request):
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+            except HTTPException as e:
+                response = _error(e.status_code, e.detail, e.headers)
+            except CircuitOpenError as e:
+                response = _error(503, str(e), {"Retry-After": "30"})
+            except DeadlineExceeded as e:
+                response = _error(504, str(e))
+            except Exception as e:
+                logging.exception(f"{request.method} {request.url.path} failed")
+                response = _error(500, str(e))
+            self._record(request.url.path, response.status_code, started)
+            return response
+
+        return endpoint
+
+    async def _no_route(self, request, exc):
+        self._record("unknown", exc.status_code, time.perf_counter())
+        return _error(exc.status_code, f"No route for {request.method} {request.url.path}")
+
+    @staticmethod
+    def _record(endpoint, status, started):
+        metrics.inc("service_requests_total", endpoint=endpoint, status=str(status))
+        metrics.observe("service_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+    @asynccontextmanager
+    async def _admitted(self):
+        """Hold one of max_concurrent processing slots; 503 once max_queued requests are already waiting"""
+        if self._waiting >= self.max_queued:
+            raise HTTPException(503, "Service is at capacity, retry shortly", {"Retry-After": "1"})
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _run_blocking(self, session_id, headers, fn, *args, **kwargs):
+        """Run a provider call on the worker pool under this request's scheduler tags"""
+        priority = PRIORITY_BATCH if headers.get("x-priority", "").lower() == "batch" else PRIORITY_INTERACTIVE
+
+        def call():
+            with request_context(session_id=session_id, priority=priority):
+                return fn(*args, **kwargs)
+
+        return asyncio.get_running_loop().run_in_executor(self._executor, contextvars.copy_context().run, call)
+
+    async def _process(self, request, fn, *args, **kwargs):
+        """Run fn on the worker pool once the request holds a processing slot"""
+        peer = request.client.host if request.client else "unknown"
+        session_id = request.headers.get("x-session-id") or f"http-{peer}"
+        async with self._admitted():
+            return await self._run_blocking(session_id, request.headers, fn, *args, **kwargs)
+
+    def _limited(self, request):
+        """
+        The request with its body capped at max_upload_bytes: a Content-Length
+        that is not a non-negative integer gets 400, a declared or streamed
+        (chunked) body over the cap gets 413.
+        """
+        too_large = f"Request body is larger than {self.max_upload_bytes // (1024 * 1024)} MB"
+        length = request.headers.get("content-length")
+        if length is not None:
+            if not (length.isascii() and length.isdigit()):
+                raise HTTPException(400, "Content-Length must be a non-negative integer")
+            if int(length) > self.max_upload_bytes:
+                raise HTTPException(413, too_large)
+
+        received = 0
+
+        async def receive():
+            nonlocal received
+            message = await request.receive()
+            received += len(message.get("body", b""))
+            if received > self.max_upload_bytes:
+                raise HTTPException(413, too_large)
+            return message
+
+        return Request(request.scope, receive)
+
+    async def _read_upload(self, read):
+        """Await read() within upload_timeout, so a stalled client gets 408"""
+        try:
+            return await asyncio.wait_for(read(), self.upload_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(408, f"Upload did not arrive within {self.upload_timeout:.0f}s")
+        except ClientDisconnect:
+            raise HTTPException(400, "Client disconnected during the upload")
+
+    async def _read_form(self, request):
+        """
+        Parse a multipart/form-data upload before the request takes a slot.
+
+        Returns:
+            dict: field name -> list of {"filename": str or None, "data": bytes} (a field may repeat)
+        """
+        if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+            raise HTTPException(415, "Expected a multipart/form-data upload")
+        limited = self._limited(request)
+
+        async def read():
+            form = await limited.form(max_files=MAX_FORM_PARTS, max_fields=MAX_FORM_PARTS)
+            parts = {}
+            try:
+                for name, value in form.multi_items():
+                    if isinstance(value, str):
+                        part = {"filename": None, "data": value.encode("utf-8")}
+                    else:
+                        part = {"filename": value.filename, "data": await value.read()}
+                    parts.setdefault(name, []).append(part)
+            finally:
+                await form.close()
+            return parts
+
+        return await self._read_upload(read)
+
+    @staticmethod
+    def _field(form, query, name, default=None):
+        if name in form:
+            return form[name][0]["data"].decode("utf-8")
+        return query.get(name, default)
+
+    @staticmethod
+    def _file(form, name):
+        parts = [part for part in form.get(name, []) if part["data"]]
+        return parts[0] if parts else None
+
+    @staticmethod
+    def _images(form):
+        """Uploaded image bytes: one image as bytes, several as a list"""
+        images = [part["data"] for part in form.get("image", []) if part["data"]]
+        if len(images) > brain.MAX_IMAGES_PER_REQUEST:
+            raise HTTPException(400, f"At most {brain.MAX_IMAGES_PER_REQUEST} images can be analyzed together")
+        return images[0] if len(images) == 1 else images or None
+
+    @staticmethod
+    def _detail_level(value):
+        try:
+            return diagnosis.detail_level_key(value)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+
+    @staticmethod
+    def _vision_model(value):
+        if value is None:
+            return AUTO_MODEL
+        if value != AUTO_MODEL and value not in vision_router.models:
+            raise HTTPException(400, f"vision_model must be one of {', '.join((AUTO_MODEL,) + vision_router.models)}")
+        return value
+
+    @staticmethod
+    def _tts_option(value):
+        if value is not None and value not in TTS_PROVIDERS:
+            raise HTTPException(400, f"tts must be one of {', '.join(TTS_PROVIDERS)}")
+        return value
+
+    async def _diagnose(self, request):
+        form = await self._read_form(request)
+        query = request.query_params
+        audio = self._file(form, "audio")
+        images = self._images(form)
+        if audio is None and images is None:
+            raise HTTPException(400, "Upload an 'image' and/or an 'audio' file")
+
+        result = await self._process(
+            request, diagnosis.run_pipeline,
+            (audio["filename"] or "audio.wav", audio["data"]) if audio else None,
+            images,
+            use_cache=_flag(self._field(form, query, "use_cache")),
+            preferred_tts=self._tts_option(self._field(form, query, "tts")),
+            speak=_flag(self._field(form, query, "speak")),
+            detail_level=self._detail_level(self._field(form, query, "detail_level")),
+            vision_model=self._vision_model(self._field(form, query, "vision_model")),
+        )
+        audio_bytes = result.pop("audio", None)
+        result.pop("audio_path", None)
+        result["audio_base64"] = base64.b64encode(audio_bytes).decode("ascii") if audio_bytes else None
+        result["audio_format"] = "mp3" if audio_bytes else None
+        return JSONResponse(result)
+
+    async def _transcribe(self, request):
+        form = await self._read_form(request)
+        audio = self._file(form, "audio")
+        if audio is None:
+            raise HTTPException(400, "Upload an 'audio' file")
+        audio_metrics = {}
+        transcript = await self._process(
+            request, patient_voice.transcribe_long_audio,
+            stt_model=diagnosis.STT_MODEL,
+            audio_filepath=(audio["filename"] or "audio.wav", audio["data"]),
+            GROQ_API_KEY=os.environ.get("GROQ_API_KEY"),
+            use_cache=_flag(self._field(form, request.query_params, "use_cache")),
+            metrics=audio_metrics,
+        )
+        return JSONResponse({"transcript": transcript, "audio_metrics": audio_metrics or None})
+
+    async def _analyze(self, request):
+        form = await self._read_form(request)
+        query = request.query_params
+        images = self._images(form)
+        if images is None:
+            raise HTTPException(400, "Upload an 'image' file")
+        use_cache = _flag(self._field(form, query, "use_cache"))
+        question = self._field(form, query, "query", "")
+        detail_level = self._detail_level(self._field(form, query, "detail_level"))
+        vision_model = self._vision_model(self._field(form, query, "vision_model"))
+
+        def analyze():
+            prepared = diagnosis.encode_stage(images)
+            vision_metrics = {}
+            response = brain.analyze_image_with_query(
+                query=diagnosis.build_vision_query(question, len(prepared) if isinstance(prepared, list) else 1,
+                                                   detail_level),
+                model=vision_model,
+                encoded_image=prepared,
+                use_cache=use_cache,
+                max_tokens=diagnosis.DETAIL_LEVELS[detail_level]["max_tokens"],
+                metrics=vision_metrics,
+            )
+            answer_metrics = None
+            if diagnosis.is_speakable(response) and not vision_metrics.get("cached"):
+                answer_metrics = diagnosis.record_answer_latency(detail_level, vision_metrics["total_time"], response)
+            return {
+                "response": response,
+                "vision_model": vision_metrics.get("model"),
+                "image_metrics": diagnosis.combined_image_metrics(prepared),
+                "answer_metrics": answer_metrics,
+            }
+
+        return JSONResponse(await self._process(request, analyze))
+
+    async def _speak(self, request):
+        query = request.query_params
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await self._read_form(request)
+            options = {name: parts[0]["data"].decode("utf-8") for name, parts in form.items()}
+        else:
+            body = await self._read_upload(self._limited(request).body)
+            try:
+                options = json.loads(body or b"{}")
+            except ValueError:
+                options = None
+            if not isinstance(options, dict):
+                raise HTTPException(400, "Expected a JSON body like {\"text\": \"...\"}")
+        text = str(options.get("text") or "").strip()
+        if not text:
+            raise HTTPException(400, "No text to speak")
+
+        success, audio, message = await self._process(
+            request, doctor_voice.synthesize_speech,
+            text,
+            preferred_tts=self._tts_option(options.get("tts") or query.get("tts")) or diagnosis.default_tts_provider(),
+            use_cache=_flag(options.get("use_cache", query.get("use_cache"))),
+        )
+        if not success:
+            raise HTTPException(502, message)
+        return Response(audio, media_type="audio/mpeg", headers={"X-TTS-Message": message})
+
+    async def _health(self, request):
+        return JSONResponse({
+            "status": "ok",
+            "in_flight": self._in_flight,
+            "queued": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "vision_models": vision_router.stats()["models"],
+        })
+
+    async def _metrics(self, request):
+        return Response(metrics.to_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the AI Doctor pipeline over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT,
+                        help="Requests processed at the same time")
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED,
+                        help="Requests waiting for a slot before new ones get 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    service = PipelineService(args.host, args.port, args.max_concurrent, args.max_queued)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
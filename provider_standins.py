@@ -0,0 +1,291 @@
+# provider_standins.py - Local HTTP stand-ins for the Groq, ElevenLabs and gTTS APIs
+
+import json
+import time
+import base64
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A few bytes that start like an MP3 frame; enough for code that only stores/forwards audio
+FAKE_MP3 = b"\xff\xfb\x90\x64" + b"\x00" * 1020
+
+# Endpoint names used for per-endpoint latency profiles and stats
+ENDPOINTS = ("chat", "transcription", "elevenlabs", "gtts")
+# Rough prompt cost of one image for a Llama 4 vision model; text is counted at 4 characters per token
+IMAGE_TOKENS = 1000
+
+
+def _content_parts(request):
+    for message in request.get("messages", []):
+        content = message.get("content")
+        yield from content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+
+
+def _image_count(request):
+    return sum(1 for part in _content_parts(request) if part.get("type") == "image_url")
+
+
+def _completion(request, response_text):
+    """The canned answer cut to the request's max_tokens (at a word boundary), and its finish_reason"""
+    max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+    if not max_tokens or len(response_text) // 4 <= max_tokens:
+        return response_text, "stop"
+    return response_text[:max_tokens * 4].rsplit(" ", 1)[0], "length"
+
+
+def _chat_usage(request, response_text):
+    """Token usage as a provider would report it, estimated from the request's text and image parts"""
+    text_chars = sum(len(part.get("text") or "") for part in _content_parts(request) if part.get("type") != "image_url")
+    prompt_tokens = text_chars // 4 + _image_count(request) * IMAGE_TOKENS
+    completion_tokens = max(1, len(response_text) // 4)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+    def setup(self):
+        super().setup()
+        self.server.standin._count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_chat_stream(self, text, finish_reason="stop", seconds_per_token=0.0, usage=None):
+        """Server-sent events in the OpenAI/Groq chunk format, one word per event, usage on the last one"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            if seconds_per_token:
+                time.sleep(seconds_per_token * max(1, len(word) // 4))
+            event = {
+                "id": "chatcmpl-standin",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "standin",
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if index == 0 else " " + word},
+                    "finish_reason": finish_reason if index == len(words) - 1 else None,
+                }],
+            }
+            if index == len(words) - 1 and usage is not None:
+                event["x_groq"] = {"id": "req-standin", "usage": usage}
+            write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        write_chunk(b"data: [DONE]\n\n")
+        write_chunk(b"")
+
+    def do_HEAD(self):
+        self.server.standin._count("requests")
+        self._send(200, b"")
+
+    def do_GET(self):
+        self.server.standin._count("requests")
+        if self.path.startswith("/v1/voices"):
+            self._send(200, {"voices": [{"voice_id": "aria", "name": "Aria", "category": "premade"}]})
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _send_gtts(self, audio):
+        """The batchexecute reply gTTS parses: the audio is base64 inside a jQ1olc RPC line"""
+        encoded = base64.b64encode(audio).decode("ascii")
+        body = ")]}'\n\n" + json.dumps([["wrb.fr", "jQ1olc", json.dumps([encoded]), None, None, None, "generic"]],
+                                        separators=(",", ":")) + "\n"
+        self._send(200, body.encode("utf-8"), content_type="application/json; charset=utf-8")
+
+    def _endpoint(self):
+        if self.path.startswith("/openai/v1/chat/completions"):
+            return "chat"
+        if self.path.startswith("/openai/v1/audio/transcriptions"):
+            return "transcription"
+        if self.path.startswith("/v1/text-to-speech/"):
+            return "elevenlabs"
+        if self.path.startswith("/_/TranslateWebserverUi/data/batchexecute"):
+            return "gtts"
+        return None
+
+    def do_POST(self):
+        standin = self.server.standin
+        standin._count("requests")
+        body = self._read_body()
+        standin._count("bytes_received", len(body))
+
+        endpoint = self._endpoint()
+        request = json.loads(body or b"{}") if endpoint == "chat" else {}
+        model = request.get("model")
+        if endpoint is not None:
+            standin._count_endpoint(endpoint, model)
+            if not standin._simulate(endpoint, len(body), _image_count(request), model):
+                standin._count("failures")
+                self._send(503, {"error": {"message": f"Simulated {endpoint} failure", "type": "service_unavailable"}})
+                return
+
+        if endpoint == "chat":
+            response_text, finish_reason = _completion(request, standin.chat_response)
+            seconds_per_token = standin.profile("chat", model)["seconds_per_token"]
+        if endpoint == "chat" and request.get("stream"):
+            self._send_chat_stream(response_text, finish_reason, seconds_per_token,
+                                   _chat_usage(request, response_text))
+        elif self.path.startswith("/openai/v1/chat/completions"):
+            if seconds_per_token:
+                time.sleep(seconds_per_token * max(1, len(response_text) // 4))
+            self._send(200, {
+                "id": "chatcmpl-standin",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request.get("model", "standin"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": response_text},
+                }],
+                "usage": _chat_usage(request, response_text),
+            })
+        elif self.path.startswith("/openai/v1/audio/transcriptions"):
+            self._send(200, {"text": standin.transcript})
+        elif self.path.startswith("/v1/text-to-speech/"):
+            self._send(200, FAKE_MP3, content_type="audio/mpeg")
+        elif endpoint == "gtts":
+            self._send_gtts(FAKE_MP3)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+class StandInServer:
+    """
+    Local HTTP server that answers like Groq (chat, streaming chat and audio
+    transcription), ElevenLabs (voices + text-to-speech) and the Google
+    Translate endpoint gTTS uses. Use as a context manager and point
+    GROQ_BASE_URL / ELEVENLABS_BASE_URL / GTTS_BASE_URL at `url`.
+
+    `stats` counts TCP connections and requests, so client pooling can be
+    checked: N sequential calls through a pooled client open one connection.
+
+    Latency, jitter and failure rate are applied to the provider endpoints
+    (chat, transcription, elevenlabs, gtts). `profiles` overrides them per
+    endpoint, e.g. {"transcription": {"latency": 0.8, "seconds_per_mb": 0.3}},
+    and per chat model under "chat:<model>", e.g. {"chat:slow-model": {"latency": 5}}.
+    Chat completions report token usage estimated from the request
+    (IMAGE_TOKENS per image; streams send it on the last chunk as
+    x_groq.usage), and `seconds_per_image` adds prefill time per
+    image in the request. Answers are cut to the request's max_tokens and
+    `seconds_per_token` adds generation time per answer token, so shorter
+    answers finish sooner as they would with a real model.
+    A failed request gets a 503, which the clients treat as retryable.
+
+    Args:
+        latency (float): Base delay in seconds before each response
+        jitter (float): Extra uniformly random delay of up to this many seconds
+        failure_rate (float): Fraction of requests answered with a 503
+        seconds_per_mb (float): Extra delay per MB of request body (upload time)
+        seconds_per_image (float): Extra delay per image in a chat request
+        seconds_per_token (float): Extra delay per generated chat token
+        seed (int): Seed for the jitter/failure draws, for repeatable runs
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, transcript="I have a red itchy rash on my cheek.",
+                 chat_response="With what I see, I think you have mild contact dermatitis.",
+                 latency=0.0, jitter=0.0, failure_rate=0.0, seconds_per_mb=0.0, seconds_per_image=0.0,
+                 seconds_per_token=0.0, profiles=None, seed=None):
+        self.transcript = transcript
+        self.chat_response = chat_response
+        self.default_profile = {"latency": latency, "jitter": jitter, "failure_rate": failure_rate,
+                                "seconds_per_mb": seconds_per_mb, "seconds_per_image": seconds_per_image,
+                                "seconds_per_token": seconds_per_token}
+        self.profiles = profiles or {}
+        self.stats = {"connections": 0, "requests": 0, "bytes_received": 0, "failures": 0,
+                      "endpoints": {endpoint: 0 for endpoint in ENDPOINTS}, "models": {}}
+        self._random = random.Random(seed)
+        self._stats_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _StandInHandler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _count_endpoint(self, endpoint, model=None):
+        with self._stats_lock:
+            self.stats["endpoints"][endpoint] += 1
+            if endpoint == "chat" and model:
+                self.stats["models"][model] = self.stats["models"].get(model, 0) + 1
+
+    def profile(self, endpoint, model=None):
+        return {**self.default_profile, **self.profiles.get(endpoint, {}), **self.profiles.get(f"{endpoint}:{model}", {})}
+
+    def _simulate(self, endpoint, body_bytes, images=0, model=None):
+        """Sleep for the endpoint's (or chat model's) simulated latency; return False if this request should fail"""
+        profile = self.profile(endpoint, model)
+        with self._stats_lock:
+            jitter = self._random.uniform(0, profile["jitter"]) if profile["jitter"] else 0.0
+            failed = self._random.random() < profile["failure_rate"]
+        delay = (profile["latency"] + jitter + profile["seconds_per_mb"] * body_bytes / (1024 * 1024)
+                 + profile["seconds_per_image"] * images)
+        if delay > 0:
+            time.sleep(delay)
+        return not failed
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    import os
+    import api_clients
+
+    with StandInServer() as standin:
+        os.environ["GROQ_API_KEY"] = os.environ.get("GROQ_API_KEY") or "standin-key"
+        os.environ["GROQ_BASE_URL"] = standin.url
+        api_clients.reset_clients()
+
+        print(f"Stand-in running at {standin.url}")
+        print(f"Warm-up: {api_clients.warm_up(background=False)}")
+        client = api_clients.get_groq_client()
+        for _ in range(5):
+            client.chat.completions.create(messages=[{"role": "user", "content": "hi"}], model="standin")
+        print(f"Same client reused: {client is api_clients.get_groq_client()}")
+        print(f"Stats after warm-up + 5 chat calls: {standin.stats}")
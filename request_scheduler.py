@@ -0,0 +1,208 @@
+# request_scheduler.py - Process-wide rate limiting and fair queuing for provider API calls
+
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+_request_context = contextvars.ContextVar("request_context", default=("default", PRIORITY_INTERACTIVE))
+
+
+@contextmanager
+def request_context(session_id="default", priority=PRIORITY_INTERACTIVE):
+    """
+    Tag the provider calls made inside the block with a session and priority.
+    Worker threads started through StagedPipeline (or run in a copied
+    contextvars context) inherit the tag.
+    """
+    token = _request_context.set((session_id, priority))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+def current_request_context():
+    return _request_context.get()
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Take a token; return 0 on success or the seconds until one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ProviderLimiter:
+    """
+    Token bucket + concurrency limit for one provider, with a fair queue.
+
+    Waiters are served by priority first; within a priority, sessions take
+    turns (round robin), so one session firing many requests cannot starve
+    the others. Within a session requests are served in arrival order.
+    """
+
+    def __init__(self, name, rate_per_minute, burst, max_concurrent):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self._condition = threading.Condition()
+        self._queues = {}  # priority -> OrderedDict(session_id -> deque of waiter tokens)
+        self._queued = 0
+        self._waits = deque(maxlen=1000)
+        self._granted = 0
+        self._total_wait = 0.0
+
+    def _head(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                session_id = next(iter(sessions))
+                return priority, session_id, sessions[session_id][0]
+        return None
+
+    def acquire(self, session_id, priority):
+        waiter = object()
+        enqueued = time.monotonic()
+        with self._condition:
+            sessions = self._queues.setdefault(priority, OrderedDict())
+            sessions.setdefault(session_id, deque()).append(waiter)
+            self._queued += 1
+            try:
+                while True:
+                    head = self._head()
+                    if head[2] is waiter and self.active < self.max_concurrent:
+                        delay = self.bucket.try_take()
+                        if delay == 0:
+                            break
+                        self._condition.wait(timeout=delay)
+                    else:
+                        self._condition.wait(timeout=1.0)
+            except BaseException:
+                self._dequeue(priority, session_id, waiter)
+                self._condition.notify_all()
+                raise
+
+            self._dequeue(priority, session_id, waiter)
+            # Round robin: the session that was just served goes to the back of its priority level
+            if session_id in sessions:
+                sessions.move_to_end(session_id)
+            self.active += 1
+            waited = time.monotonic() - enqueued
+            self._waits.append(waited)
+            self._granted += 1
+            self._total_wait += waited
+            self._condition.notify_all()
+        return waited
+
+    def _dequeue(self, priority, session_id, waiter):
+        sessions = self._queues[priority]
+        queue = sessions[session_id]
+        queue.remove(waiter)
+        if not queue:
+            del sessions[session_id]
+        self._queued -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def set_max_concurrent(self, max_concurrent):
+        with self._condition:
+            self.max_concurrent = max(1, int(max_concurrent))
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            waits = sorted(self._waits)
+            return {
+                "active": self.active,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": self._queued,
+                "requests": self._granted,
+                "avg_wait": round(self._total_wait / self._granted, 4) if self._granted else 0.0,
+                "p95_wait": round(waits[int(0.95 * (len(waits) - 1))], 4) if waits else 0.0,
+                "max_wait": round(waits[-1], 4) if waits else 0.0,
+            }
+
+
+def _env_number(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class RequestScheduler:
+    """One ProviderLimiter per provider, shared by every session in the process"""
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, provider, rate_per_minute, burst, max_concurrent):
+        with self._lock:
+            self._limiters[provider] = ProviderLimiter(provider, rate_per_minute, burst, max_concurrent)
+
+    def limiter(self, provider):
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = ProviderLimiter(provider, 600, 10, 4)
+            return self._limiters[provider]
+
+    @contextmanager
+    def slot(self, provider, session_id=None, priority=None):
+        """
+        Block until `provider` has a free concurrency slot and a rate token
+        for this caller, then hold the slot for the duration of the block.
+        Session and priority default to the current request_context().
+        """
+        context_session, context_priority = current_request_context()
+        limiter = self.limiter(provider)
+        limiter.acquire(session_id or context_session, context_priority if priority is None else priority)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def set_max_concurrent(self, max_concurrent, providers=None):
+        """Apply a concurrency limit (e.g. the Settings slider) to the given or all providers"""
+        for provider in providers or list(self._limiters):
+            self.limiter(provider).set_max_concurrent(max_concurrent)
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {provider: limiter.stats() for provider, limiter in limiters.items()}
+
+
+scheduler = RequestScheduler()
+# Defaults sit under the free-tier limits; override with e.g. GROQ_RATE_PER_MIN=300
+scheduler.configure("groq", _env_number("GROQ_RATE_PER_MIN", 30), _env_number("GROQ_BURST", 10),
+                    int(_env_number("GROQ_MAX_CONCURRENT", 2)))
+scheduler.configure("elevenlabs", _env_number("ELEVENLABS_RATE_PER_MIN", 60), _env_number("ELEVENLABS_BURST", 5),
+                    int(_env_number("ELEVENLABS_MAX_CONCURRENT", 2)))
+scheduler.configure("gtts", _env_number("GTTS_RATE_PER_MIN", 60), _env_number("GTTS_BURST", 10),
+                    int(_env_number("GTTS_MAX_CONCURRENT", 2)))
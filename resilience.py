@@ -0,0 +1,279 @@
+# resilience.py - Retries with jittered backoff, per-call deadlines and per-provider circuit breakers
+
+import time
+import random
+import logging
+import threading
+from contextlib import ExitStack
+from metrics import metrics
+
+# HTTP statuses worth another attempt: timeouts, rate limits and server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Matched against the exception's class hierarchy so no SDK has to be imported here
+RETRYABLE_ERROR_NAMES = {
+    "ConnectionError", "TimeoutError", "TransportError", "TimeoutException",  # builtins, httpx, requests
+    "APIConnectionError", "APITimeoutError",  # groq
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call (including its retries) runs out of time"""
+
+
+class SlotWaitExceeded(DeadlineExceeded):
+    """Raised when the deadline passes while a call still waits for its scheduler slot (nothing was sent)"""
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        # requests/httpx errors and gTTSError keep the response on .response / .rsp
+        response = getattr(error, "response", None) or getattr(error, "rsp", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """True for network errors, timeouts, 429 and 5xx responses; False for e.g. bad requests or auth errors"""
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    # SDKs that re-raise network failures as their own error type (e.g. gTTSError) keep the original as context
+    cause = error.__cause__ or error.__context__
+    return cause is not None and cause is not error and is_retryable(cause)
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of one provider.
+
+    closed: calls go through. After `failure_threshold` consecutive retryable
+    failures the breaker opens and calls fail immediately with
+    CircuitOpenError. After `reset_timeout` seconds it is half-open: one
+    probe call is let through, and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._counts = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _current_state(self):
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = "half_open"
+            self._probe_in_flight = False
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def available(self):
+        """Whether a call could go through now; unlike allow_request() this does not claim the probe"""
+        with self._lock:
+            state = self._current_state()
+            return state == "closed" or (state == "half_open" and not self._probe_in_flight)
+
+    def allow_request(self):
+        """Claim permission for one call; in the half-open state only one probe is allowed at a time"""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._counts["rejected"] += 1
+            return False
+
+    def release_probe(self):
+        """Give back a claimed probe without an outcome (the call was never made)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                logging.info(f"Circuit breaker for {self.name} closed")
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+            self._counts["successes"] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._counts["failures"] += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    logging.warning(f"Circuit breaker for {self.name} opened after {self._failures} failures")
+                    self._counts["opened"] += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = self.reset_timeout - (time.monotonic() - self._opened_at) if state == "open" else 0.0
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in": round(max(0.0, retry_in), 1),
+                **self._counts,
+            }
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time
+    between 0 and min(max_delay, base_delay * 2**n), so clients that failed
+    together do not retry together.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, retry_number):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry_number))
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per provider, shared by every session in the process"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, provider, failure_threshold=5, reset_timeout=30.0):
+        with self._lock:
+            self._breakers[provider] = CircuitBreaker(provider, failure_threshold, reset_timeout)
+
+    def get(self, provider):
+        with self._lock:
+            if provider not in self._breakers:
+                self._breakers[provider] = CircuitBreaker(provider)
+            return self._breakers[provider]
+
+    def reset(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        for breaker in breakers:
+            breaker.reset()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {provider: breaker.stats() for provider, breaker in breakers.items()}
+
+
+breakers = CircuitBreakers()
+breakers.configure("groq", failure_threshold=5, reset_timeout=30.0)
+breakers.configure("elevenlabs", failure_threshold=3, reset_timeout=60.0)
+breakers.configure("gtts", failure_threshold=5, reset_timeout=30.0)
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def call_with_retry(provider, attempt, deadline, policy=None, slot=None, hold=None, breaker=None):
+    """
+    Call attempt(timeout) until it succeeds, retrying retryable errors with
+    jittered backoff, within `deadline` seconds in total and only while the
+    provider's circuit breaker allows it.
+
+    With `slot`, each attempt first waits for its scheduler slot and gets the
+    time left once it holds it, so waiting in the queue cannot stretch the
+    call past its deadline and does not count as provider_request_seconds.
+    The slot is released before a backoff sleep and after the attempt, or
+    moved into `hold` when the result still uses the provider (a stream).
+    If the deadline passes while still waiting for the slot, SlotWaitExceeded
+    is raised; the provider was never called, so that says nothing about it.
+
+    Args:
+        provider (str): Breaker name ('groq', 'elevenlabs', 'gtts')
+        attempt (callable): Makes one request; receives the seconds left before the deadline
+        deadline (float): Time budget for all attempts and backoff sleeps
+        policy (RetryPolicy): Defaults to 3 attempts, 0.5s base delay
+        slot (callable): Returns the context manager admitting one request, e.g. lambda: scheduler.slot("groq")
+        hold (ExitStack): Keeps the successful attempt's slot until the caller closes it
+        breaker (str): Circuit breaker to use when it is narrower than the provider,
+            e.g. "groq:<model>" so one failing model does not block the others
+
+    Returns:
+        Whatever attempt() returns
+
+    Raises:
+        CircuitOpenError: The breaker is open (no request was made)
+        DeadlineExceeded: The deadline passed before a successful attempt
+        SlotWaitExceeded: The deadline passed while waiting for the slot
+        Exception: The last error when it is not retryable or attempts ran out
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    breaker = breakers.get(breaker or provider)
+    expires = time.monotonic() + deadline
+    last_error = None
+
+    for attempt_number in range(policy.max_attempts):
+        if not breaker.allow_request():
+            metrics.inc("provider_errors_total", provider=provider, kind="circuit_open")
+            raise CircuitOpenError(f"{breaker.name} is unavailable (circuit open)") from last_error
+        with ExitStack() as admitted:
+            if slot is not None:
+                admitted.enter_context(slot())
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                # Queued for the whole budget: nothing was sent, so the breaker learns nothing
+                breaker.release_probe()
+                message = f"{provider} call exceeded its {deadline:.0f}s deadline waiting for a slot"
+                raise SlotWaitExceeded(message) from last_error
+            metrics.inc("provider_requests_total", provider=provider)
+            try:
+                with metrics.timer("provider_request_seconds", provider=provider):
+                    result = attempt(remaining)
+            except Exception as e:
+                error = e
+            else:
+                breaker.record_success()
+                if hold is not None:
+                    hold.enter_context(admitted.pop_all())
+                return result
+
+        metrics.inc("provider_errors_total", provider=provider, kind="retryable" if is_retryable(error) else "fatal")
+        if not is_retryable(error):
+            # The provider answered (e.g. 400/401), so it is up; don't count this against it
+            breaker.record_success()
+            raise error
+        breaker.record_failure()
+        last_error = error
+        delay = policy.backoff(attempt_number)
+        if attempt_number + 1 == policy.max_attempts:
+            break
+        if time.monotonic() + delay >= expires:
+            raise DeadlineExceeded(f"{provider} call exceeded its {deadline:.0f}s deadline: {error}") from error
+        logging.info(f"{provider} attempt {attempt_number + 1} failed ({error}); retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+    raise last_error
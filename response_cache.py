@@ -0,0 +1,159 @@
+# response_cache.py - Content-addressed, disk-backed LRU cache for API responses
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from metrics import metrics
+
+CACHE_DIR = os.environ.get("AI_DOCTOR_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "ai_doctor")
+
+
+def make_key(*parts):
+    """
+    Build a content-addressed cache key from bytes parts (anything else is str()-ed).
+
+    Each part is length-prefixed before hashing so ("ab", "c") and ("a", "bc")
+    never collide.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = str(part).encode("utf-8")
+        digest.update(str(len(part)).encode("ascii") + b":")
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    LRU cache stored in a SQLite file.
+
+    The file is shared by every Streamlit session and process on the machine
+    and survives restarts. Entries expire after `ttl` seconds and the least
+    recently used entries are evicted once `max_entries` or `max_bytes` is
+    exceeded. Values may be str or bytes and come back as the same type.
+    """
+
+    def __init__(self, name, max_entries=1000, max_bytes=100 * 1024 * 1024, ttl=7 * 24 * 3600, cache_dir=None):
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    is_text INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per operation keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, count=True):
+        """
+        Return the cached value for key, or None on a miss or an expired entry.
+        count=False leaves the hit/miss counters alone, for speculative probes
+        (e.g. near-duplicate candidates) that are counted by their caller.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, is_text, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[2] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+        if row is None:
+            if count:
+                metrics.inc("cache_requests_total", cache=self.name, result="miss")
+                with self._lock:
+                    self.misses += 1
+            return None
+        if count:
+            metrics.inc("cache_requests_total", cache=self.name, result="hit")
+            with self._lock:
+                self.hits += 1
+
+        value, is_text, _ = row
+        return value.decode("utf-8") if is_text else bytes(value)
+
+    def set(self, key, value):
+        """Store a str or bytes value under key, then evict down to the size limits"""
+        is_text = isinstance(value, str)
+        blob = value.encode("utf-8") if is_text else bytes(value)
+        if self.max_bytes and len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, is_text, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(blob), int(is_text), len(blob), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        if self.ttl:
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if (not self.max_entries or count <= self.max_entries) and (not self.max_bytes or total <= self.max_bytes):
+            return
+
+        # Walk from least to most recently used until both limits hold
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall():
+            if (not self.max_entries or count <= self.max_entries) and (not self.max_bytes or total <= self.max_bytes):
+                break
+            stale.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self):
+        """Hit/miss counters for this process plus the current size of the shared cache"""
+        with self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
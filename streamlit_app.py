@@ -1,8 +1,10 @@
 # VoiceBot UI with Streamlit
 import os
+import time
+import uuid
+import importlib.util
 import streamlit as st
 from io import BytesIO
-import tempfile
 
 # Configure secrets for deployment
 if hasattr(st, 'secrets'):
@@ -47,24 +49,39 @@ def setup_api_keys():
 # Call this function to setup API keys
 setup_api_keys()
 
-# Try to import streamlit-audiorec for better web recording
-try:
-    from st_audiorec import st_audiorec
-    AUDIOREC_AVAILABLE = True
-except ImportError:
-    AUDIOREC_AVAILABLE = False
+# streamlit-audiorec gives a better web recorder; it is only imported on the upload page
+AUDIOREC_AVAILABLE = importlib.util.find_spec("st_audiorec") is not None
 
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import record_audio, transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts, text_to_speech_with_elevenlabs, enhanced_text_to_speech
+# Provider modules (Pillow, pydub, speech_recognition, gtts, elevenlabs) are
+# imported on first use, so the home and about pages start without them
+from lazy_modules import brain, patient_voice, doctor_voice, diagnosis
+from api_clients import warm_up
+from request_scheduler import scheduler
+from job_queue import jobs
+from resilience import breakers
+from model_router import vision_router, AUTO_MODEL
+from metrics import metrics, start_metrics_server
 
-system_prompt = """You have to act as a professional doctor, i know you are not but this is for learning purpose. 
-            What's in this image?. Do you find anything wrong with it medically? 
-            If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in 
-            your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person.
-            Donot say 'In the image I see' but say 'With what I see, I think you have ....'
-            Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, 
-            Keep your answer concise (max 2 sentences). No preamble, start your answer right away please"""
+
+@st.cache_resource
+def warm_up_api_clients():
+    """Open provider connections once per process so the first Analyze click skips TLS setup"""
+    if os.environ.get("AI_DOCTOR_WARM_UP", "1") == "0":
+        return None
+    return warm_up(background=True)
+
+
+@st.cache_resource
+def metrics_endpoint():
+    """Serve /metrics in Prometheus text format once per process when AI_DOCTOR_METRICS_PORT is set"""
+    return start_metrics_server()
+
+
+def get_session_id():
+    """Stable per-browser-session ID, used for fair queuing in the request scheduler"""
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
 
 
 def apply_dark_theme():
@@ -229,88 +246,180 @@ def sidebar_navigation():
     return st.session_state.current_page
 
 
-def process_inputs(audio_file, image_file):
-    """Process audio and image inputs to generate doctor's response"""
-    
-    speech_to_text_output = ""
-    doctor_response = ""
-    voice_of_doctor = None
-    
-    # Handle audio input
+# How often the results area checks a running job for progress
+JOB_POLL_SECONDS = 0.5
+
+STAGE_LABELS = {
+    "transcribe": "Transcribing speech",
+    "encode_image": "Preparing image",
+    "analyze": "Analyzing image",
+    "tts": "Generating voice response",
+}
+STAGE_ICONS = {"started": "⏳", "done": "✅", "failed": "❌"}
+
+
+def submit_analysis(audio_file, image_files, audio_source=None):
+    """
+    Queue the pipeline for this session's inputs and remember the job.
+    
+    Uploads are read into bytes here because Streamlit file objects and
+    session state belong to the script thread. Submitting the same inputs
+    and settings again returns the job that already ran for them.
+    """
+    audio = None
     if audio_file is not None:
-        # Save uploaded audio to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
-            tmp_audio.write(audio_file.read())
-            audio_filepath = tmp_audio.name
-        
+        audio_file.seek(0)
+        audio = (getattr(audio_file, "name", None) or "recording.wav", audio_file.read())
+    images = [image_file.getvalue() for image_file in image_files]
+    # One photo keeps the single-image request (and its cache entries); several are analyzed together
+    image = images[0] if len(images) == 1 else images or None
+    
+    # Determine preferred TTS based on API key availability
+    preferred_tts = diagnosis.default_tts_provider()
+    if preferred_tts == "elevenlabs" and st.session_state.get('hedged_tts', False):
+        preferred_tts = "hedged"
+    
+    st.session_state.current_job_id = jobs.submit(
+        get_session_id(),
+        audio=audio,
+        image=image,
+        use_cache=st.session_state.get('enable_cache', True),
+        preferred_tts=preferred_tts,
+        detail_level=st.session_state.get('detail_level'),
+        vision_model=st.session_state.get('vision_model', AUTO_MODEL)
+    )
+    st.session_state.current_job_source = audio_source
+
+
+def render_job_progress(job):
+    """Stage checklist plus the answer streamed so far"""
+    st.caption(f"Processing your inputs... ({job['elapsed']:.0f}s)")
+    for stage, label in STAGE_LABELS.items():
+        state = job["stages"].get(stage)
+        if state is None:
+            continue
+        duration = f" ({state['duration']:.1f}s)" if state["duration"] is not None else ""
+        st.markdown(f"{STAGE_ICONS[state['status']]} {label}{duration}")
+    if job["partial"]:
+        st.markdown(f"**👨‍⚕️ Doctor's Analysis:**\n\n{job['partial']}▌")
+
+
+def render_job_result(job):
+    """Transcript, answer, voice response and timings of a finished job"""
+    render_started = time.perf_counter()
+    result = job["result"]
+    
+    if job["status"] == "failed":
+        st.error(f"❌ Analysis failed: {job['error']}")
+        return
+    
+    if st.session_state.get('current_job_source'):
+        st.info(f"Processed {st.session_state.current_job_source} audio")
+    
+    # Speech to text output
+    if result.get("transcript"):
+        st.markdown("**🎯 Transcribed Speech:**")
+        st.text_area("", value=result["transcript"], height=100, disabled=True)
+    
+    # Doctor's response
+    if result.get("response"):
+        st.markdown("**👨‍⚕️ Doctor's Analysis:**")
+        st.text_area("", value=result["response"], height=150, disabled=True)
+        if result.get("vision_model"):
+            st.caption(f"Answered by {result['vision_model']}")
+    
+    # Voice response
+    if result.get("audio"):
+        st.success(f"✅ {result['tts_message']}")
+        st.markdown("**🔊 Voice Response:**")
         try:
-            speech_to_text_output = transcribe_with_groq(
-                GROQ_API_KEY=os.environ.get("GROQ_API_KEY"), 
-                audio_filepath=audio_filepath,
-                stt_model="whisper-large-v3"
-            )
+            st.audio(result["audio"], format="audio/mp3")
         except Exception as e:
-            speech_to_text_output = f"Error transcribing audio: {str(e)}"
-        finally:
-            # Clean up temporary file
-            os.unlink(audio_filepath)
-    
-    # Handle image input
-    if image_file is not None:
-        # Save uploaded image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_image:
-            tmp_image.write(image_file.read())
-            image_filepath = tmp_image.name
-        
-        try:
-            if speech_to_text_output and not speech_to_text_output.startswith("Error"):
-                query = system_prompt + speech_to_text_output
-            else:
-                query = system_prompt + "Please analyze this medical image."
-                
-            doctor_response = analyze_image_with_query(
-                query=query, 
-                encoded_image=encode_image(image_filepath), 
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
+            st.error(f"Error playing audio: {str(e)}")
+    elif result.get("tts_message"):
+        st.error(f"❌ TTS failed: {result['tts_message']}")
+    
+    metrics.observe("stage_seconds", time.perf_counter() - render_started, stage="rendering")
+    
+    # Per-stage timing of the pipeline run
+    pipeline_timings = result["timings"]
+    with st.expander("⏱️ Pipeline Timing"):
+        st.caption(
+            f"Wall clock {pipeline_timings['wall_clock']:.2f}s vs "
+            f"{pipeline_timings['sequential']:.2f}s sequential "
+            f"(saved {pipeline_timings['saved']:.2f}s)"
+        )
+        if 'time_to_first_token' in pipeline_timings:
+            st.caption(f"Time to first token: {pipeline_timings['time_to_first_token'] * 1000:.0f} ms")
+        if 'first_audio_ready' in pipeline_timings:
+            st.caption(f"First voice segment ready {pipeline_timings['first_audio_ready']:.2f}s after the vision call started")
+        st.json(pipeline_timings['stages'])
+        answer_metrics = result.get('answer_metrics')
+        if answer_metrics:
+            target = "within" if answer_metrics['within_target'] else "over"
+            st.caption(
+                f"{answer_metrics['detail_level'].capitalize()} answer: {answer_metrics['seconds']:.2f}s, "
+                f"{target} its {answer_metrics['latency_target']:.0f}s target "
+                f"({answer_metrics['characters']} characters, capped at {answer_metrics['max_tokens']} tokens)"
             )
-        except Exception as e:
-            doctor_response = f"Error analyzing image: {str(e)}"
-        finally:
-            # Clean up temporary file
-            os.unlink(image_filepath)
-    else:
-        doctor_response = "No image provided for me to analyze"
-    
-    # Generate voice response - IMPROVED WITH ENHANCED TTS
-    if doctor_response and not doctor_response.startswith("Error") and not doctor_response.startswith("No image"):
-        # Use the enhanced TTS function with multiple fallbacks
-        try:
-            st.info("🎤 Generating voice response...")
-            
-            # Determine preferred TTS based on API key availability
-            elevenlabs_key = os.environ.get('ELEVENLABS_API_KEY') or os.environ.get('ELEVEN_API_KEY')
-            preferred_tts = "elevenlabs" if (elevenlabs_key and elevenlabs_key.strip()) else "gtts"
-            
-            success, audio_file, message = enhanced_text_to_speech(
-                input_text=doctor_response,
-                output_filepath="final.mp3",
-                preferred_tts=preferred_tts
+        image_metrics = result.get('image_metrics')
+        if image_metrics:
+            image_count = f" ({image_metrics['images']} images in one request)" if 'images' in image_metrics else ""
+            st.caption(
+                f"Image upload{image_count}: {image_metrics['original_bytes'] / 1024:.0f} KB → "
+                f"{image_metrics['prepared_bytes'] / 1024:.0f} KB "
+                f"({image_metrics['reduction']:.0%} smaller)"
             )
-            
-            if success:
-                st.success(f"✅ {message}")
-                voice_of_doctor = audio_file
-            else:
-                st.error(f"❌ TTS failed: {message}")
-                voice_of_doctor = None
-                
-        except Exception as e:
-            st.error(f"❌ TTS error: {str(e)}")
-            voice_of_doctor = None
-    else:
-        voice_of_doctor = None
+        audio_metrics = result.get('audio_metrics')
+        if audio_metrics and audio_metrics.get('prepared'):
+            st.caption(
+                f"Audio upload: {audio_metrics['original_bytes'] / 1024:.0f} KB → "
+                f"{audio_metrics['prepared_bytes'] / 1024:.0f} KB, "
+                f"{audio_metrics['original_seconds']:.1f}s → {audio_metrics['prepared_seconds']:.1f}s "
+                f"({audio_metrics['seconds_removed']:.1f}s of silence removed)"
+            )
+            if audio_metrics.get('windows', 1) > 1:
+                st.caption(
+                    f"Long recording: {audio_metrics['windows']} windows transcribed "
+                    f"{audio_metrics.get('workers', 1)} at a time in {audio_metrics['wall_clock']:.2f}s"
+                )
+
+
+def show_current_job():
+    """
+    Render this session's latest job. While it runs, only the results area
+    re-runs (every JOB_POLL_SECONDS) to pick up progress; the job itself
+    keeps going on the worker pool if the user navigates away.
+    """
+    job_id = st.session_state.get('current_job_id')
+    if not job_id:
+        return
+    job = jobs.get(job_id)
+    if job is None:
+        # Expired from the job store
+        del st.session_state['current_job_id']
+        return
+    
+    st.subheader("📋 Results")
+    running = job["status"] in ("queued", "running")
+    
+    def results_area():
+        current = jobs.get(job_id)
+        if current["status"] in ("queued", "running"):
+            render_job_progress(current)
+        elif running:
+            # Finished since the page was drawn: re-run the page to stop polling
+            st.rerun()
+        else:
+            render_job_result(current)
     
-    return speech_to_text_output, doctor_response, voice_of_doctor
+    if hasattr(st, "fragment"):
+        st.fragment(results_area, run_every=JOB_POLL_SECONDS if running else None)()
+    else:
+        results_area()
+        if running:
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
 
 
 def record_audio_wrapper():
@@ -320,21 +429,21 @@ def record_audio_wrapper():
         
         # Method 1: Try with output_filename parameter
         try:
-            recorded_file = record_audio(output_filename="recorded_audio.wav")
+            recorded_file = patient_voice.record_audio(output_filename="recorded_audio.wav")
             return recorded_file
         except TypeError:
             pass
         
         # Method 2: Try with just filename as positional argument  
         try:
-            recorded_file = record_audio("recorded_audio.wav")
+            recorded_file = patient_voice.record_audio("recorded_audio.wav")
             return recorded_file
         except TypeError:
             pass
         
         # Method 3: Try with no parameters (function might have defaults)
         try:
-            recorded_file = record_audio()
+            recorded_file = patient_voice.record_audio()
             # Check if default file exists
             default_files = ["recorded_audio.wav", "audio.wav", "recording.wav", "output.wav"]
             for filename in default_files:
@@ -539,6 +648,7 @@ def upload_process_page():
         
         if AUDIOREC_AVAILABLE:
             # Use streamlit-audiorec for web-based recording
+            from st_audiorec import st_audiorec
             wav_audio_data = st_audiorec()
             
             if wav_audio_data is not None:
@@ -659,15 +769,24 @@ def upload_process_page():
     
     with col2:
         st.subheader("📷 Image Input")
-        image_file = st.file_uploader(
-            "Upload medical image",
+        image_files = st.file_uploader(
+            "Upload medical images",
             type=['png', 'jpg', 'jpeg'],
-            help="Upload a medical image for analysis"
+            accept_multiple_files=True,
+            help="Upload one or more photos of the same problem; they are analyzed together"
         )
         
-        # Display uploaded image with updated parameter
-        if image_file is not None:
-            st.image(image_file, caption="Uploaded Medical Image", use_container_width=True)
+        # Several photos go to the vision model in one request, up to its image limit
+        # (checked only for several, so a single photo does not load the pipeline modules here)
+        if len(image_files) > 1 and len(image_files) > diagnosis.MAX_IMAGES_PER_REQUEST:
+            st.warning(f"Only the first {diagnosis.MAX_IMAGES_PER_REQUEST} images will be analyzed.")
+            image_files = image_files[:diagnosis.MAX_IMAGES_PER_REQUEST]
+        
+        # Display uploaded images with updated parameter
+        if len(image_files) == 1:
+            st.image(image_files[0], caption="Uploaded Medical Image", use_container_width=True)
+        elif image_files:
+            st.image(image_files, caption=[f"Image {index}" for index in range(1, len(image_files) + 1)], width=160)
     
     # Process button
     if st.button("🔍 Analyze", type="primary", use_container_width=True):
@@ -699,48 +818,12 @@ def upload_process_page():
                 st.error(f"Error reading recorded audio: {str(e)}")
                 return
         
-        if audio_to_process is not None or image_file is not None:
-            with st.spinner("Processing your inputs..."):
-                # Reset file pointers
-                if audio_to_process is not None:
-                    audio_to_process.seek(0)
-                if image_file is not None:
-                    image_file.seek(0)
-                
-                speech_to_text_output, doctor_response, voice_of_doctor = process_inputs(
-                    audio_to_process, image_file
-                )
-                
-                # Show which audio source was used
-                if audio_to_process is not None:
-                    st.info(f"Processed {audio_source} audio")
-            
-            # Display results
-            st.subheader("📋 Results")
-            
-            # Speech to text output
-            if speech_to_text_output:
-                st.markdown("**🎯 Transcribed Speech:**")
-                st.text_area("", value=speech_to_text_output, height=100, disabled=True)
-            
-            # Doctor's response
-            if doctor_response:
-                st.markdown("**👨‍⚕️ Doctor's Analysis:**")
-                st.text_area("", value=doctor_response, height=150, disabled=True)
-            
-            # Voice response
-            if voice_of_doctor:
-                st.markdown("**🔊 Voice Response:**")
-                try:
-                    with open("final.mp3", "rb") as audio_file_output:
-                        audio_bytes = audio_file_output.read()
-                        st.audio(audio_bytes, format="audio/mp3")
-                except FileNotFoundError:
-                    st.warning("Voice file not found. Check text-to-speech generation.")
-                except Exception as e:
-                    st.error(f"Error playing audio: {str(e)}")
+        if audio_to_process is not None or image_files:
+            submit_analysis(audio_to_process, image_files, audio_source if audio_to_process is not None else None)
         else:
             st.warning("Please upload at least an audio file or an image to proceed.")
+    
+    show_current_job()
 
 
 def about_page():
@@ -975,6 +1058,14 @@ def settings_page():
             help="Adjust the speed of generated speech"
         )
         st.session_state.speech_speed = speech_speed
+        
+        # Hedged TTS
+        hedged_tts = st.checkbox(
+            "Hedged TTS (Faster)",
+            value=st.session_state.get('hedged_tts', False),
+            help="If ElevenLabs is slower than usual, also start Google TTS and play whichever finishes first"
+        )
+        st.session_state.hedged_tts = hedged_tts
     
     with col2:
         st.markdown("### Recording Preferences")
@@ -1006,8 +1097,10 @@ def settings_page():
         
         vision_model = st.selectbox(
             "Vision Model",
-            ["meta-llama/llama-4-scout-17b-16e-instruct", "gpt-4-vision", "claude-3-vision"],
-            help="Select the AI model for image analysis"
+            [AUTO_MODEL, *vision_router.models],
+            format_func=lambda model: "Automatic (fastest within the latency SLO)" if model == AUTO_MODEL else model,
+            help="Select the AI model for image analysis. A selected model is used while it is healthy; "
+                 "if it is slow or failing, requests go to the other models"
         )
         st.session_state.vision_model = vision_model
         
@@ -1015,7 +1108,8 @@ def settings_page():
         detail_level = st.selectbox(
             "Analysis Detail Level",
             ["Concise (2 sentences)", "Standard (1 paragraph)", "Detailed (Multiple paragraphs)"],
-            help="Choose how detailed you want the medical analysis to be"
+            help="Choose how detailed you want the medical analysis to be. Shorter answers are generated "
+                 "and spoken sooner"
         )
         st.session_state.detail_level = detail_level
     
@@ -1072,15 +1166,21 @@ def settings_page():
         )
         st.session_state.enable_cache = enable_cache
         
-        # Concurrent processing
-        max_concurrent = st.slider(
+        # Concurrent processing: the limits are process-wide, so they are only changed when the slider is moved;
+        # rendering the page leaves the current (e.g. GROQ_MAX_CONCURRENT) limits alone
+        def apply_max_concurrent():
+            scheduler.set_max_concurrent(st.session_state.max_concurrent)
+        
+        current_max_concurrent = scheduler.limiter("groq").max_concurrent
+        st.slider(
             "Max Concurrent Requests",
             min_value=1,
-            max_value=5,
-            value=2,
-            help="Maximum number of concurrent API requests"
+            max_value=max(5, current_max_concurrent),
+            value=current_max_concurrent,
+            key="max_concurrent",
+            on_change=apply_max_concurrent,
+            help="Maximum number of concurrent API requests per provider (shared by all sessions)"
         )
-        st.session_state.max_concurrent = max_concurrent
     
     # Current Status
     st.markdown("## 📊 Current Status")
@@ -1105,6 +1205,30 @@ def settings_page():
         else:
             st.warning("📱 Web Recording: Install streamlit-audiorec")
     
+    # Circuit breakers: an open breaker means calls to that provider are skipped until it recovers
+    # (the Groq breaker covers transcription; each vision model has its own, shown with the routing below)
+    breaker_labels = {"groq": "🎯 Groq", "elevenlabs": "🎤 ElevenLabs", "gtts": "🔊 Google TTS"}
+    breaker_stats = breakers.stats()
+    breaker_cols = st.columns(len(breaker_labels))
+    for col, (provider, label) in zip(breaker_cols, breaker_labels.items()):
+        stats = breaker_stats.get(provider, {"state": "closed", "consecutive_failures": 0, "retry_in": 0.0})
+        with col:
+            if stats["state"] == "open":
+                st.error(f"{label}: Circuit open (retry in {stats['retry_in']:.0f}s)")
+            elif stats["state"] == "half_open":
+                st.warning(f"{label}: Circuit half-open (probing)")
+            else:
+                st.success(f"{label}: Circuit closed")
+            st.caption(f"Consecutive failures: {stats['consecutive_failures']}")
+    
+    # Vision routing: the fastest model within the SLO gets the traffic; slow or failing ones are tried last
+    routing = vision_router.stats()
+    for model, stats in routing["models"].items():
+        latency = f"p95 {stats['p95']:.2f}s" if stats["p95"] is not None else "no recent calls"
+        circuit = breaker_stats.get(f"groq:{model}", {"state": "closed"})["state"].replace("_", "-")
+        st.caption(f"🧠 {model}: {stats['state']} ({latency}, {stats['error_rate']:.0%} errors, "
+                   f"SLO {routing['slo']:.1f}s, circuit {circuit})")
+    
     # Save Settings
     if st.button("💾 Save Settings", type="primary", use_container_width=True):
         st.success("✅ Settings saved successfully!")
@@ -1115,7 +1239,7 @@ def settings_page():
         # Clear session state settings
         settings_keys = [
             'elevenlabs_voice', 'tts_provider', 'speech_speed', 'audio_quality',
-            'auto_play', 'vision_model', 'detail_level', 'stt_model', 
+            'auto_play', 'hedged_tts', 'vision_model', 'detail_level', 'stt_model', 
             'auto_language', 'theme', 'show_debug', 'enable_cache', 'max_concurrent'
         ]
         for key in settings_keys:
@@ -1137,6 +1261,10 @@ def main():
     # Apply dark theme
     apply_dark_theme()
     
+    # Pre-connect to the API providers (once per process, in the background)
+    warm_up_api_clients()
+    metrics_endpoint()
+    
     # Sidebar navigation
     current_page = sidebar_navigation()
     
@@ -1161,8 +1289,33 @@ def main():
                 "ElevenLabs Connected": bool(os.environ.get('ELEVENLABS_API_KEY')),
                 "Groq Connected": bool(os.environ.get('GROQ_API_KEY')),
                 "Audio Recorder Available": AUDIOREC_AVAILABLE,
+                # Only report on provider modules that are already loaded; don't import them for the sidebar
+                "Vision Cache": brain.vision_cache.stats() if brain.loaded else "not loaded",
+                "Near-Duplicate Index": brain.near_duplicates.stats() if brain.loaded else "not loaded",
+                "Transcript Cache": patient_voice.transcript_cache.stats() if patient_voice.loaded else "not loaded",
+                "TTS Cache": doctor_voice.tts_cache.stats() if doctor_voice.loaded else "not loaded",
+                "Request Scheduler": scheduler.stats(),
+                "Jobs": jobs.stats(),
+                "Circuit Breakers": breakers.stats(),
+                "Vision Routing": vision_router.stats(),
+                "TTS Hedging": doctor_voice.hedge_stats.stats() if doctor_voice.loaded else "not loaded",
                 "Session State Keys": list(st.session_state.keys())
             })
+            
+            # Process-wide latency percentiles and counters (all sessions since start-up)
+            metrics_summary = metrics.summary()
+            st.markdown("**Latency (p50 / p95 / p99, seconds)**")
+            for series, stats in metrics_summary["latency"].items():
+                if stats["count"]:
+                    st.caption(f"{series}: {stats['p50']:.3f} / {stats['p95']:.3f} / {stats['p99']:.3f} (n={stats['count']})")
+            st.markdown("**Counters**")
+            st.json(metrics_summary["counters"])
+            st.download_button(
+                "Download metrics (Prometheus)",
+                data=metrics.to_prometheus(),
+                file_name="ai_doctor_metrics.prom",
+                mime="text/plain"
+            )
     
     # Disclaimer (always visible)
     with st.sidebar:
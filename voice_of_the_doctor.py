@@ -1,18 +1,79 @@
 # voice_of_the_doctor.py - Fixed version based on your original code
 
+import io
 import os
 from gtts import gTTS
-import elevenlabs
-from elevenlabs.client import ElevenLabs
 import subprocess
 import platform
+from response_cache import DiskCache, make_key
+from api_clients import get_elevenlabs_client, get_elevenlabs_api_key, gtts_base_url
+from request_scheduler import scheduler
+from resilience import breakers, call_with_retry
+from metrics import metrics
 
 # Fixed API key variable name to match Streamlit app
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY") or os.environ.get("ELEVEN_API_KEY")
 
+ELEVENLABS_VOICE = "Aria"
+# text_to_speech.convert takes a voice id; this is the premade "Aria" voice
+ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID") or "9BWtsMINqrJLrRacOk9x"
+ELEVENLABS_MODEL = "eleven_turbo_v2"
+ELEVENLABS_OUTPUT_FORMAT = "mp3_22050_32"
+GTTS_LANGUAGE = "en"
+
+# Seconds a synthesis may take, retries included
+ELEVENLABS_DEADLINE = 20
+GTTS_DEADLINE = 20
+
+# Synthesized MP3s, capped by total bytes with LRU eviction
+tts_cache = DiskCache("tts_audio", max_entries=5000, max_bytes=200 * 1024 * 1024, ttl=30 * 24 * 3600)
+
+def tts_cache_key(input_text, provider):
+    """Cache key for synthesized audio: normalized text + provider, voice, model and format"""
+    normalized_text = " ".join(input_text.split())
+    if provider == "elevenlabs":
+        return make_key("tts", normalized_text, provider, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL,
+                        ELEVENLABS_OUTPUT_FORMAT)
+    return make_key("tts", normalized_text, provider, GTTS_LANGUAGE, "gtts", "mp3")
+
+def _synthesize_with_cache(provider, synthesize, input_text, use_cache=True):
+    """
+    Run a TTS provider through the audio cache, entirely in memory.
+    
+    Returns:
+        tuple: (audio: bytes, cached: bool)
+    """
+    cache_key = tts_cache_key(input_text, provider)
+    if use_cache:
+        cached_audio = tts_cache.get(cache_key)
+        if cached_audio is not None:
+            return cached_audio, True
+    
+    audio = synthesize(input_text)
+    if use_cache and audio:
+        tts_cache.set(cache_key, audio)
+    return audio, False
+
+class _RoutedgTTS(gTTS):
+    """gTTS that sends its requests to GTTS_BASE_URL (e.g. a local stand-in) instead of translate.google.com"""
+    
+    def _prepare_requests(self):
+        prepared_requests = super()._prepare_requests()
+        for prepared_request in prepared_requests:
+            prepared_request.prepare_url(f"{gtts_base_url().rstrip('/')}/_/TranslateWebserverUi/data/batchexecute", None)
+        return prepared_requests
+
+def _new_gtts(input_text):
+    gtts_class = _RoutedgTTS if gtts_base_url() else gTTS
+    return gtts_class(
+        text=input_text,
+        lang=GTTS_LANGUAGE,
+        slow=False
+    )
+
 def text_to_speech_with_gtts_old(input_text, output_filepath):
     """Original gTTS function without auto-play"""
-    language = "en"
+    language = GTTS_LANGUAGE
     audioobj = gTTS(
         text=input_text,
         lang=language,
@@ -22,152 +83,485 @@ def text_to_speech_with_gtts_old(input_text, output_filepath):
 
 def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
     """Original ElevenLabs function without auto-play"""
-    if not ELEVENLABS_API_KEY:
+    if not get_elevenlabs_api_key():
         raise Exception("ElevenLabs API key not found")
     
-    client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    audio = client.generate(
+    client = get_elevenlabs_client()
+    audio = client.text_to_speech.convert(
+        ELEVENLABS_VOICE_ID,
         text=input_text,
-        voice="Aria",
-        output_format="mp3_22050_32",
-        model="eleven_turbo_v2"
+        output_format=ELEVENLABS_OUTPUT_FORMAT,
+        model_id=ELEVENLABS_MODEL
     )
-    elevenlabs.save(audio, output_filepath)
+    with open(output_filepath, "wb") as audio_file:
+        for chunk in audio:
+            audio_file.write(chunk)
+
+def _play_audio_file(output_filepath):
+    """Play an audio file with the platform's command-line player"""
+    try:
+        os_name = platform.system()
+        if os_name == "Darwin":  # macOS
+            subprocess.run(['afplay', output_filepath])
+        elif os_name == "Windows":  # Windows
+            subprocess.run(['powershell', '-c', f'(New-Object Media.SoundPlayer "{output_filepath}").PlaySync();'])
+        elif os_name == "Linux":  # Linux
+            subprocess.run(['aplay', output_filepath])
+        else:
+            print("Unsupported operating system for auto-play")
+    except Exception as e:
+        print(f"Auto-play failed: {e}")
 
-def text_to_speech_with_gtts(input_text, output_filepath, auto_play=False):
+def _deliver_audio(audio, output_filepath, auto_play):
+    """Return the audio as bytes, or write it to output_filepath (optionally playing it) and return the path"""
+    if not audio:
+        raise Exception("Audio was not created or is empty")
+    if output_filepath is None:
+        return audio
+    with open(output_filepath, "wb") as audio_file:
+        audio_file.write(audio)
+    # Auto-play only if requested (disabled by default for Streamlit)
+    if auto_play:
+        _play_audio_file(output_filepath)
+    return output_filepath
+
+def text_to_speech_with_gtts(input_text, output_filepath=None, auto_play=False):
     """
     gTTS function with optional auto-play and proper return value
     
     Args:
         input_text (str): Text to convert to speech
-        output_filepath (str): Path to save the audio file
-        auto_play (bool): Whether to auto-play the audio (default: False for Streamlit)
+        output_filepath (str): Path to save the audio file (None: return the MP3 bytes instead)
+        auto_play (bool): Whether to auto-play the audio (default: False for Streamlit; needs output_filepath)
     
     Returns:
-        str: Path to the generated audio file if successful, None otherwise
+        str or bytes: Path to the generated audio file, or the MP3 bytes when no path is given
     """
     try:
-        language = "en"
-        audioobj = gTTS(
-            text=input_text,
-            lang=language,
-            slow=False
-        )
-        audioobj.save(output_filepath)
-        
-        # Check if file was created successfully
-        if not os.path.exists(output_filepath) or os.path.getsize(output_filepath) == 0:
-            raise Exception("Audio file was not created or is empty")
-        
-        # Auto-play only if requested (disabled by default for Streamlit)
-        if auto_play:
-            try:
-                os_name = platform.system()
-                if os_name == "Darwin":  # macOS
-                    subprocess.run(['afplay', output_filepath])
-                elif os_name == "Windows":  # Windows
-                    subprocess.run(['powershell', '-c', f'(New-Object Media.SoundPlayer "{output_filepath}").PlaySync();'])
-                elif os_name == "Linux":  # Linux
-                    subprocess.run(['aplay', output_filepath])
-                else:
-                    print("Unsupported operating system for auto-play")
-            except Exception as e:
-                print(f"Auto-play failed: {e}")
-        
-        return output_filepath
+        audioobj = _new_gtts(input_text)
+        
+        def request(timeout):
+            # gTTS talks to Google only when writing the audio out
+            audioobj.timeout = timeout
+            metrics.inc("bytes_uploaded_total", len(input_text.encode("utf-8")), provider="gtts")
+            buffer = io.BytesIO()
+            audioobj.write_to_fp(buffer)
+            return buffer.getvalue()
+        
+        audio = call_with_retry("gtts", request, GTTS_DEADLINE, slot=lambda: scheduler.slot("gtts"))
+        return _deliver_audio(audio, output_filepath, auto_play)
         
     except Exception as e:
         raise Exception(f"Google TTS failed: {str(e)}")
 
-def text_to_speech_with_elevenlabs(input_text, output_filepath, auto_play=False):
+def text_to_speech_with_elevenlabs(input_text, output_filepath=None, auto_play=False):
     """
     ElevenLabs TTS function with optional auto-play and proper return value
     
     Args:
         input_text (str): Text to convert to speech
-        output_filepath (str): Path to save the audio file
-        auto_play (bool): Whether to auto-play the audio (default: False for Streamlit)
+        output_filepath (str): Path to save the audio file (None: return the MP3 bytes instead)
+        auto_play (bool): Whether to auto-play the audio (default: False for Streamlit; needs output_filepath)
     
     Returns:
-        str: Path to the generated audio file if successful, None otherwise
+        str or bytes: Path to the generated audio file, or the MP3 bytes when no path is given
     """
     try:
-        if not ELEVENLABS_API_KEY:
+        if not get_elevenlabs_api_key():
             raise Exception("ElevenLabs API key not found. Set ELEVENLABS_API_KEY or ELEVEN_API_KEY environment variable.")
         
-        client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
-        # Generate audio
-        audio = client.generate(
-            text=input_text,
-            voice="Aria",
-            output_format="mp3_22050_32",
-            model="eleven_turbo_v2"
-        )
-        
-        # Save audio
-        elevenlabs.save(audio, output_filepath)
-        
-        # Check if file was created successfully
-        if not os.path.exists(output_filepath) or os.path.getsize(output_filepath) == 0:
-            raise Exception("Audio file was not created or is empty")
-        
-        # Auto-play only if requested (disabled by default for Streamlit)
-        if auto_play:
-            try:
-                os_name = platform.system()
-                if os_name == "Darwin":  # macOS
-                    subprocess.run(['afplay', output_filepath])
-                elif os_name == "Windows":  # Windows
-                    subprocess.run(['powershell', '-c', f'(New-Object Media.SoundPlayer "{output_filepath}").PlaySync();'])
-                elif os_name == "Linux":  # Linux
-                    subprocess.run(['aplay', output_filepath])
-                else:
-                    print("Unsupported operating system for auto-play")
-            except Exception as e:
-                print(f"Auto-play failed: {e}")
-        
-        return output_filepath
+        # Shared, pooled client; rebuilt automatically when the key changes in Settings
+        client = get_elevenlabs_client()
+        
+        def request(timeout):
+            metrics.inc("bytes_uploaded_total", len(input_text.encode("utf-8")), provider="elevenlabs")
+            # Generate audio
+            audio = client.text_to_speech.convert(
+                ELEVENLABS_VOICE_ID,
+                text=input_text,
+                output_format=ELEVENLABS_OUTPUT_FORMAT,
+                model_id=ELEVENLABS_MODEL,
+                request_options={"timeout_in_seconds": max(1, int(timeout)), "max_retries": 0}
+            )
+            
+            # Read the audio (the response is streamed, so this is still part of the request)
+            return audio if isinstance(audio, bytes) else b"".join(audio)
+        
+        audio = call_with_retry("elevenlabs", request, ELEVENLABS_DEADLINE,
+                                slot=lambda: scheduler.slot("elevenlabs"))
+        return _deliver_audio(audio, output_filepath, auto_play)
         
     except Exception as e:
         raise Exception(f"ElevenLabs TTS failed: {str(e)}")
 
-# Enhanced TTS function with fallback
-def enhanced_text_to_speech(input_text, output_filepath="final.mp3", preferred_tts="elevenlabs"):
+def _write_artifact(audio, output_filepath):
+    if output_filepath:
+        with open(output_filepath, "wb") as audio_file:
+            audio_file.write(audio)
+
+@metrics.timer("stage_seconds", stage="tts")
+def synthesize_speech(input_text, preferred_tts="elevenlabs", use_cache=True, output_filepath=None):
     """
-    Enhanced TTS with fallback from ElevenLabs to Google TTS
+    Synthesize speech in memory, with fallback from ElevenLabs to Google TTS.
     
     Args:
         input_text (str): Text to convert to speech
-        output_filepath (str): Path to save the audio file
-        preferred_tts (str): Preferred TTS service ('elevenlabs' or 'gtts')
+        preferred_tts (str): Preferred TTS service ('elevenlabs', 'gtts', or 'hedged'
+            to race Google TTS against a slow ElevenLabs request)
+        use_cache (bool): Reuse previously synthesized audio for the same text and voice
+        output_filepath (str): Optional per-request path to also write the MP3 to
     
     Returns:
-        tuple: (success: bool, audio_file_path: str, message: str)
+        tuple: (success: bool, audio: bytes, message: str)
     """
     
     if not input_text or not input_text.strip():
         return False, None, "No text provided"
     
-    # Try preferred TTS first
-    if preferred_tts == "elevenlabs" and ELEVENLABS_API_KEY:
+    elevenlabs_available = bool(get_elevenlabs_api_key()) and breakers.get("elevenlabs").available()
+    if preferred_tts == "hedged" and elevenlabs_available:
+        success, audio, message = _hedged_speech(input_text, use_cache=use_cache)
+        if success:
+            _write_artifact(audio, output_filepath)
+        return success, audio, message
+    
+    # Try preferred TTS first, unless its circuit breaker says it is down
+    if preferred_tts == "elevenlabs" and elevenlabs_available:
         try:
-            result = text_to_speech_with_elevenlabs(input_text, output_filepath, auto_play=False)
-            if result:
-                return True, result, "ElevenLabs TTS successful"
+            audio, cached = _synthesize_with_cache("elevenlabs", text_to_speech_with_elevenlabs, input_text, use_cache)
+            _write_artifact(audio, output_filepath)
+            return True, audio, "ElevenLabs TTS successful" + (" (cached)" if cached else "")
         except Exception as e:
             print(f"ElevenLabs failed: {e}")
             # Continue to fallback
     
     # Fallback to Google TTS
     try:
-        result = text_to_speech_with_gtts(input_text, output_filepath, auto_play=False)
-        if result:
-            return True, result, "Google TTS successful"
+        audio, cached = _synthesize_with_cache("gtts", text_to_speech_with_gtts, input_text, use_cache)
+        _write_artifact(audio, output_filepath)
+        return True, audio, "Google TTS successful" + (" (cached)" if cached else "")
     except Exception as e:
         print(f"Google TTS failed: {e}")
         return False, None, f"All TTS methods failed. Last error: {str(e)}"
 
+# Enhanced TTS function with fallback
+def enhanced_text_to_speech(input_text, output_filepath="final.mp3", preferred_tts="elevenlabs", use_cache=True):
+    """
+    Enhanced TTS with fallback from ElevenLabs to Google TTS
+    
+    Args:
+        input_text (str): Text to convert to speech
+        output_filepath (str): Path to save the audio file (None: return the MP3 bytes instead)
+        preferred_tts (str): Preferred TTS service ('elevenlabs', 'gtts', or 'hedged'
+            to race Google TTS against a slow ElevenLabs request)
+        use_cache (bool): Reuse previously synthesized audio for the same text and voice
+    
+    Returns:
+        tuple: (success: bool, audio_file_path or audio bytes, message: str)
+    """
+    success, audio, message = synthesize_speech(input_text, preferred_tts, use_cache, output_filepath)
+    if success and output_filepath:
+        return success, output_filepath, message
+    return success, audio, message
+
+# Sentence-pipelined TTS: speak each sentence while the rest is still being generated
+import re
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+class SentenceSpeechPipeline:
+    """
+    Synthesizes a response sentence by sentence while it is being generated.
+    
+    Text deltas are passed through feed() (which yields them back unchanged,
+    so it can wrap the vision stream the UI renders). Every time a sentence
+    is complete it is sent to synthesize_speech on a small worker pool;
+    finish() waits for the remaining sentences and joins the MP3 segments in
+    order, in memory. MP3 is a sequence of self-contained frames, so plain concatenation
+    gives a playable file.
+    
+    All segments must come from one provider, or the voice changes mid-answer
+    and frames of different sample rates are joined (ElevenLabs 22.05 kHz,
+    Google 24 kHz). The first provider that succeeds is used for the
+    remaining sentences, and if ElevenLabs still fails part-way, finish()
+    re-synthesizes its segments with Google TTS.
+    
+    Args:
+        preferred_tts (str): Preferred TTS service ('elevenlabs' or 'gtts')
+        max_workers (int): Sentences synthesized in parallel
+        use_cache (bool): Use the synthesized-speech cache per sentence
+        min_chars (int): Sentences shorter than this are merged with the next
+    """
+    
+    def __init__(self, preferred_tts="elevenlabs", max_workers=2, use_cache=True, min_chars=25):
+        self.preferred_tts = preferred_tts
+        self.use_cache = use_cache
+        self.min_chars = min_chars
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-sentence")
+        self._futures = []
+        self._sentences = []
+        self._provider = None  # pinned after the first successful segment
+        self._buffer = ""
+        self._pending = ""
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.metrics = {"sentences": 0, "first_text_at": None, "first_audio_at": None, "finished_at": None}
+    
+    def feed(self, deltas):
+        """Pass text deltas through, queueing each completed sentence for synthesis"""
+        for delta in deltas:
+            self.add_text(delta)
+            yield delta
+    
+    def add_text(self, delta):
+        if self.metrics["first_text_at"] is None:
+            self.metrics["first_text_at"] = round(time.perf_counter() - self._started, 4)
+        self._buffer += delta
+        parts = SENTENCE_BOUNDARY.split(self._buffer)
+        self._buffer = parts.pop()
+        for sentence in parts:
+            self._queue_sentence(sentence)
+    
+    def _queue_sentence(self, sentence, final=False):
+        self._pending = f"{self._pending} {sentence}".strip()
+        if self._pending and (final or len(self._pending) >= self.min_chars):
+            index = len(self._futures)
+            self._sentences.append(self._pending)
+            self._futures.append(self._executor.submit(contextvars.copy_context().run, self._synthesize, index, self._pending))
+            self._pending = ""
+    
+    def _synthesize(self, index, sentence):
+        with self._lock:
+            preferred_tts = self._provider or self.preferred_tts
+        success, audio, message = synthesize_speech(sentence, preferred_tts, self.use_cache)
+        if not success:
+            raise Exception(message)
+        
+        with self._lock:
+            if self._provider is None:
+                # No hedging after this: a hedge won by Google would switch voices mid-answer
+                self._provider = "gtts" if message.startswith("Google") else "elevenlabs"
+            if index == 0:
+                self.metrics["first_audio_at"] = round(time.perf_counter() - self._started, 4)
+        return audio, message
+    
+    def finish(self, output_filepath=None):
+        """
+        Flush the last sentence, wait for all segments and join them in order.
+        
+        Args:
+            output_filepath (str): Optional path to also write the joined MP3 to
+        
+        Returns:
+            tuple: (success: bool, audio_file_path or audio bytes (without a path), message: str)
+        """
+        try:
+            self._queue_sentence(self._buffer, final=True)
+            self._buffer = ""
+            if not self._futures:
+                return False, None, "No text provided"
+            
+            segments, messages = [], []
+            for future in self._futures:
+                audio, message = future.result()
+                segments.append(audio)
+                messages.append(message)
+            
+            resynthesized = 0
+            if len({message.startswith("Google") for message in messages}) > 1:
+                # ElevenLabs failed for some sentences: redo the others with Google TTS too
+                for index, message in enumerate(messages):
+                    if not message.startswith("Google"):
+                        success, audio, message = synthesize_speech(self._sentences[index], "gtts", self.use_cache)
+                        if not success:
+                            raise Exception(message)
+                        segments[index], messages[index] = audio, message
+                        resynthesized += 1
+            
+            audio = b"".join(segments)
+            _write_artifact(audio, output_filepath)
+            
+            self.metrics["sentences"] = len(segments)
+            self.metrics["finished_at"] = round(time.perf_counter() - self._started, 4)
+            providers = sorted({message.split(" TTS")[0] for message in messages})
+            message = f"{' + '.join(providers)} TTS successful ({len(segments)} sentences)"
+            if resynthesized:
+                message += f", {resynthesized} re-synthesized for one voice"
+            return True, output_filepath or audio, message
+        except Exception as e:
+            return False, None, f"All TTS methods failed. Last error: {str(e)}"
+        finally:
+            self.close()
+    
+    def close(self):
+        """Stop the worker pool; queued sentences that have not started are dropped"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Hedged TTS: if ElevenLabs is slower than usual, race Google TTS against it
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Seconds to wait for ElevenLabs before starting Google TTS too; TTS_HEDGE_DELAY overrides
+HEDGE_DELAY_SECONDS = float(os.environ.get("TTS_HEDGE_DELAY") or 2.5)
+# Once this many uncached ElevenLabs latencies are recorded, their p95 is used as the delay
+HEDGE_MIN_SAMPLES = 20
+
+class HedgeStats:
+    """Process-wide record of hedged requests: who won, ElevenLabs latency and time saved"""
+    
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._primary_latencies = deque(maxlen=window)
+        self._saved = deque(maxlen=window)
+        self._counts = {"requests": 0, "hedged": 0, "elevenlabs_wins": 0, "gtts_wins": 0, "failures": 0}
+    
+    @staticmethod
+    def _percentile(values, fraction):
+        ordered = sorted(values)
+        return ordered[int(fraction * (len(ordered) - 1))] if ordered else None
+    
+    def record_primary_latency(self, seconds):
+        with self._lock:
+            self._primary_latencies.append(seconds)
+    
+    def record_outcome(self, winner, hedged):
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts["hedged"] += int(hedged)
+            self._counts[f"{winner}_wins" if winner else "failures"] += 1
+    
+    def record_saved(self, seconds):
+        with self._lock:
+            self._saved.append(seconds)
+    
+    def suggested_delay(self, default=None):
+        """p95 of observed ElevenLabs latency, or the configured delay until there is enough data"""
+        with self._lock:
+            if len(self._primary_latencies) >= HEDGE_MIN_SAMPLES:
+                return self._percentile(self._primary_latencies, 0.95)
+        return HEDGE_DELAY_SECONDS if default is None else default
+    
+    def stats(self):
+        with self._lock:
+            latencies, saved, counts = list(self._primary_latencies), list(self._saved), dict(self._counts)
+        
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+        
+        return {
+            **counts,
+            "hedge_rate": round(counts["hedged"] / counts["requests"], 3) if counts["requests"] else 0.0,
+            "elevenlabs_p50": rounded(self._percentile(latencies, 0.50)),
+            "elevenlabs_p95": rounded(self._percentile(latencies, 0.95)),
+            "saved_total": round(sum(saved), 4),
+            "saved_p50": rounded(self._percentile(saved, 0.50)),
+            "suggested_delay": rounded(self.suggested_delay()),
+        }
+
+hedge_stats = HedgeStats()
+
+def _timed_synthesis(provider, synthesize, input_text, use_cache, started):
+    audio, cached = _synthesize_with_cache(provider, synthesize, input_text, use_cache)
+    finished = time.perf_counter() - started
+    if provider == "elevenlabs" and not cached:
+        hedge_stats.record_primary_latency(finished)
+    return audio, cached, finished
+
+def hedged_text_to_speech(input_text, output_filepath="final.mp3", hedge_delay=None, use_cache=True):
+    """
+    Hedged synthesis (see _hedged_speech) with the same arguments and return
+    value as enhanced_text_to_speech.
+    
+    Returns:
+        tuple: (success: bool, audio_file_path or audio bytes (without a path), message: str)
+    """
+    if not input_text or not input_text.strip():
+        return False, None, "No text provided"
+    if not get_elevenlabs_api_key() or not breakers.get("elevenlabs").available():
+        # Nothing to race against
+        return enhanced_text_to_speech(input_text, output_filepath, "gtts", use_cache)
+    success, audio, message = _hedged_speech(input_text, hedge_delay, use_cache)
+    if success and output_filepath:
+        _write_artifact(audio, output_filepath)
+        return success, output_filepath, message
+    return success, audio, message
+
+def _hedged_speech(input_text, hedge_delay=None, use_cache=True):
+    """
+    Start ElevenLabs; if it has not answered after hedge_delay seconds (or
+    fails), start Google TTS as well and keep whichever finishes first. The
+    losing request cannot be interrupted mid-flight, so its result is just
+    discarded (it is cancelled if it has not started yet).
+    
+    The winner, whether the hedge fired, and the latency saved (how much
+    later ElevenLabs finished than a winning Google TTS) go to hedge_stats.
+    
+    Args:
+        hedge_delay (float): Seconds before hedging (default: p95 of observed
+            ElevenLabs latency, or HEDGE_DELAY_SECONDS until enough samples)
+    
+    Returns:
+        tuple: (success: bool, audio: bytes, message: str)
+    """
+    delay = hedge_stats.suggested_delay() if hedge_delay is None else hedge_delay
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-hedge")
+    providers, errors = {}, []
+    
+    def start(provider, synthesize):
+        future = executor.submit(contextvars.copy_context().run, _timed_synthesis,
+                                 provider, synthesize, input_text, use_cache, started)
+        providers[future] = provider
+        return future
+    
+    try:
+        pending = {start("elevenlabs", text_to_speech_with_elevenlabs)}
+        hedged, gtts_started, winner = False, False, None
+        while pending and winner is None:
+            timeout = None if gtts_started else max(0.0, delay - (time.perf_counter() - started))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # ElevenLabs is slower than the hedge delay: race Google TTS against it
+                pending.add(start("gtts", text_to_speech_with_gtts))
+                hedged, gtts_started = True, True
+                continue
+            for future in done:
+                try:
+                    audio, cached, finished = future.result()
+                    winner = providers[future]
+                    break
+                except Exception as e:
+                    errors.append(f"{providers[future]}: {e}")
+            if winner is None and not gtts_started:
+                # ElevenLabs failed before the hedge delay: plain fallback
+                pending.add(start("gtts", text_to_speech_with_gtts))
+                gtts_started = True
+        
+        hedge_stats.record_outcome(winner, hedged)
+        if winner is None:
+            return False, None, f"All TTS methods failed. Last error: {errors[-1] if errors else 'unknown'}"
+        
+        def record_saved(loser):
+            # How much longer ElevenLabs would have kept the user waiting
+            if not loser.cancelled() and loser.exception() is None:
+                hedge_stats.record_saved(loser.result()[2] - finished)
+        
+        for loser in pending:
+            if not loser.cancel() and winner == "gtts":
+                loser.add_done_callback(record_saved)
+        
+        label = "ElevenLabs" if winner == "elevenlabs" else "Google"
+        details = [f"hedged after {delay:.2f}s"] if hedged else []
+        if cached:
+            details.append("cached")
+        return True, audio, f"{label} TTS successful" + (f" ({', '.join(details)})" if details else "")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 # Test functions
 def test_gtts():
     """Test Google TTS"""
@@ -47,19 +47,383 @@ audio_filepath="patient_voice_test_for_patient.mp3"
 
 #Step2: Setup Speech to text–STT–model for transcription
 import os
-from groq import Groq
+import hashlib
+from api_clients import get_groq_client
+from response_cache import DiskCache, make_key
+from request_scheduler import scheduler
+from resilience import call_with_retry
+# Imported under another name: the transcribe functions take a per-call `metrics` dict argument
+from metrics import metrics as process_metrics
 
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 stt_model="whisper-large-v3"
+# Seconds one transcription request may take, retries included
+TRANSCRIBE_DEADLINE=60
 
-def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
-    client=Groq(api_key=GROQ_API_KEY)
-    
-    audio_file=open(audio_filepath, "rb")
-    transcription=client.audio.transcriptions.create(
-        model=stt_model,
-        file=audio_file,
-        language="en"
+# Transcripts are tiny, so bound the cache by entry count
+transcript_cache=DiskCache("transcripts", max_entries=5000, max_bytes=20 * 1024 * 1024, ttl=30 * 24 * 3600)
+
+def read_audio_input(audio, default_name="audio.wav"):
+    """
+    Return (filename, bytes) for audio given as a path, bytes-like object,
+    (filename, bytes) tuple or binary file object (e.g. a Streamlit
+    UploadedFile or BytesIO). The filename only tells Whisper which
+    container to expect.
+    """
+    if isinstance(audio, tuple):
+        return audio[0], bytes(audio[1])
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return default_name, bytes(audio)
+    if hasattr(audio, "read"):
+        name=os.path.basename(getattr(audio, "name", "") or default_name)
+        if hasattr(audio, "getvalue"):
+            # BytesIO/UploadedFile: shares the underlying buffer instead of copying it
+            return name, audio.getvalue()
+        if hasattr(audio, "seek"):
+            audio.seek(0)
+        return name, audio.read()
+    with open(audio, "rb") as audio_file:
+        return os.path.basename(audio), audio_file.read()
+
+def audio_fingerprint(audio_data):
+    """
+    Hash the decoded PCM of an audio file, so the same recording saved in a
+    different container (wav, mp3, ogg...) gets the same fingerprint.
+    Falls back to hashing the raw file bytes if the audio cannot be decoded.
+
+    Args:
+    audio_data (bytes): Encoded audio file contents.
+    """
+    digest=hashlib.sha256()
+    try:
+        audio_segment=AudioSegment.from_file(BytesIO(audio_data))
+        digest.update(f"pcm:{audio_segment.frame_rate}:{audio_segment.channels}:{audio_segment.sample_width}:".encode())
+        digest.update(audio_segment.raw_data)
+    except Exception as e:
+        logging.warning(f"Could not decode audio for fingerprinting, hashing file bytes instead: {e}")
+        digest.update(b"file:")
+        digest.update(audio_data)
+    return digest.hexdigest()
+
+#Step2b: Shrink the audio before uploading it to Whisper
+import numpy as np
+
+STT_SAMPLE_RATE=16000
+AUDIO_CONTAINER_EXTENSIONS={"wav": "wav", "mp3": "mp3", "ogg": "ogg", "flac": "flac", "mp4": "m4a", "webm": "webm"}
+
+def sniff_audio_container(audio_data):
+    """Identify the audio container from its magic bytes (None if unknown)"""
+    header=audio_data[:12]
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    return None
+
+def detect_speech_frames(samples, sample_rate, frame_ms=30, margin_db=12.0, floor_db=-55.0, padding_ms=150):
+    """
+    Energy-based voice activity detection.
+
+    Splits int16 samples into frames, measures each frame's RMS level in dB
+    and marks a frame as speech when it is margin_db above the estimated
+    noise floor (10th percentile level), never below floor_db. Speech is
+    widened by padding_ms on both sides so word onsets and tails survive.
+
+    Returns:
+    tuple: (speech mask per frame as a bool array, frame length in samples)
+    """
+    frame_length=max(1, int(sample_rate * frame_ms / 1000))
+    frame_count=len(samples) // frame_length
+    if frame_count == 0:
+        return np.zeros(0, dtype=bool), frame_length
+
+    frames=samples[:frame_count * frame_length].reshape(frame_count, frame_length).astype(np.float32) / 32768.0
+    levels_db=10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    threshold_db=max(np.percentile(levels_db, 10) + margin_db, floor_db)
+    speech=levels_db > threshold_db
+
+    padding=int(padding_ms / frame_ms)
+    if padding:
+        speech=np.convolve(speech.astype(np.int32), np.ones(2 * padding + 1, dtype=np.int32), mode="same") > 0
+    return speech, frame_length
+
+def _keep_mask(speech, max_silence_frames, keep_silence_frames):
+    """Drop leading/trailing silence and shorten internal silences longer than max_silence_frames"""
+    keep=speech.copy()
+    speech_frames=np.flatnonzero(speech)
+    first, last=speech_frames[0], speech_frames[-1]
+
+    # Run-length encode the silent stretches between first and last speech frame
+    silent=~speech[first:last + 1]
+    edges=np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    run_starts=np.flatnonzero(edges == 1) + first
+    run_ends=np.flatnonzero(edges == -1) + first
+    for start, end in zip(run_starts, run_ends):
+        if end - start > max_silence_frames:
+            half=keep_silence_frames // 2
+            keep[start:start + half]=True
+            keep[end - (keep_silence_frames - half):end]=True
+        else:
+            keep[start:end]=True
+    return keep
+
+def _encode_flac(samples, sample_rate):
+    buffer=BytesIO()
+    try:
+        import soundfile
+        soundfile.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    except ImportError:
+        AudioSegment(samples.tobytes(), sample_width=2, frame_rate=sample_rate, channels=1).export(buffer, format="flac")
+    return buffer.getvalue()
+
+@process_metrics.timer("stage_seconds", stage="audio_prep")
+def prepare_audio(audio, max_silence_ms=700, keep_silence_ms=300):
+    """
+    Prepare audio for Whisper: sniff the real container, downmix to 16 kHz
+    mono, trim leading/trailing silence, shorten long pauses and re-encode
+    as FLAC. If the audio cannot be decoded it is passed through unchanged.
+
+    Args:
+    audio: Path, bytes, (filename, bytes) or binary file object.
+    max_silence_ms (int): Internal pauses longer than this are shortened.
+    keep_silence_ms (int): How much of a shortened pause is kept.
+
+    Returns:
+    dict: name, data (bytes to upload), samples (prepared 16 kHz int16 PCM, or None),
+    fingerprint (hash of the prepared PCM) and metrics.
+    """
+    audio_name, audio_data=read_audio_input(audio)
+    container=sniff_audio_container(audio_data)
+    metrics={"container": container, "original_bytes": len(audio_data)}
+
+    try:
+        audio_segment=AudioSegment.from_file(BytesIO(audio_data), format=container)
+    except Exception as e:
+        logging.warning(f"Could not decode audio, uploading it unchanged: {e}")
+        if container:
+            audio_name=f"{os.path.splitext(audio_name)[0]}.{AUDIO_CONTAINER_EXTENSIONS[container]}"
+        metrics.update(prepared_bytes=len(audio_data), prepared=False)
+        return {"name": audio_name, "data": audio_data, "samples": None, "fingerprint": None, "metrics": metrics}
+
+    audio_segment=audio_segment.set_channels(1).set_frame_rate(STT_SAMPLE_RATE).set_sample_width(2)
+    samples=np.frombuffer(audio_segment.raw_data, dtype=np.int16)
+    original_seconds=len(samples) / STT_SAMPLE_RATE
+
+    frame_ms=30
+    speech, frame_length=detect_speech_frames(samples, STT_SAMPLE_RATE, frame_ms=frame_ms)
+    if speech.any():
+        keep=_keep_mask(speech, max_silence_ms // frame_ms, keep_silence_ms // frame_ms)
+        frame_count=len(speech)
+        samples=samples[:frame_count * frame_length].reshape(frame_count, frame_length)[keep].reshape(-1)
+
+    data=_encode_flac(samples, STT_SAMPLE_RATE)
+    prepared_seconds=len(samples) / STT_SAMPLE_RATE
+    metrics.update(
+        prepared=True,
+        prepared_bytes=len(data),
+        bytes_removed=len(audio_data) - len(data),
+        original_seconds=round(original_seconds, 2),
+        prepared_seconds=round(prepared_seconds, 2),
+        seconds_removed=round(original_seconds - prepared_seconds, 2),
     )
+    return {
+        "name": f"{os.path.splitext(audio_name)[0]}.flac",
+        "data": data,
+        "samples": samples,
+        "fingerprint": hashlib.sha256(samples.tobytes()).hexdigest(),
+        "metrics": metrics,
+    }
+
+def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, language="en", use_cache=True, preprocess=False, metrics=None):
+    """
+    Transcribe audio with Groq Whisper.
+
+    Args:
+    stt_model (str): Whisper model name.
+    audio_filepath: Path, bytes, (filename, bytes) or binary file object holding the audio.
+    GROQ_API_KEY (str): Groq API key (falls back to the environment).
+    language (str): Spoken language hint.
+    use_cache (bool): Reuse transcripts of previously seen audio.
+    preprocess (bool): Downmix, trim silence and re-encode with prepare_audio first.
+    metrics (dict): Optional dict that receives the prepare_audio metrics.
+    """
+    if preprocess:
+        prepared=prepare_audio(audio_filepath)
+        audio_name, audio_data, fingerprint=prepared["name"], prepared["data"], prepared["fingerprint"]
+        if metrics is not None:
+            metrics.update(prepared["metrics"])
+    else:
+        audio_name, audio_data=read_audio_input(audio_filepath)
+        fingerprint=None
+
+    return _transcribe_data(stt_model, audio_name, audio_data, GROQ_API_KEY, language, use_cache, fingerprint)
+
+@process_metrics.timer("stage_seconds", stage="transcription")
+def _transcribe_data(stt_model, audio_name, audio_data, GROQ_API_KEY, language="en", use_cache=True, fingerprint=None):
+    if use_cache:
+        cache_key=make_key("transcript", stt_model, language, fingerprint or audio_fingerprint(audio_data))
+        cached_transcript=transcript_cache.get(cache_key)
+        if cached_transcript is not None:
+            return cached_transcript
+
+    client=get_groq_client(api_key=GROQ_API_KEY)
+    
+    def request(timeout):
+        process_metrics.inc("bytes_uploaded_total", len(audio_data), provider="groq")
+        return client.audio.transcriptions.create(
+            model=stt_model,
+            file=(audio_name, audio_data),
+            language=language,
+            timeout=timeout
+        )
+
+    transcription=call_with_retry("groq", request, TRANSCRIBE_DEADLINE, slot=lambda: scheduler.slot("groq"))
 
+    if use_cache and transcription.text:
+        transcript_cache.set(cache_key, transcription.text)
     return transcription.text
+
+#Step3: Long recordings - transcribe overlapping windows in parallel
+import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+def split_into_windows(samples, sample_rate, window_seconds=120, overlap_seconds=2, search_seconds=10, frame_ms=30):
+    """
+    Split PCM samples into windows of at most window_seconds (+ overlap),
+    cutting at the quietest frame in the last search_seconds of each window
+    so cuts land in pauses rather than mid-word. Each window extends
+    overlap_seconds past its cut, so a word split by an imperfect cut is
+    heard whole by at least one window.
+
+    Returns:
+    list: (start, end) sample offsets
+    """
+    total=len(samples)
+    window=int(window_seconds * sample_rate)
+    if total <= window:
+        return [(0, total)]
+
+    frame_length=int(sample_rate * frame_ms / 1000)
+    frame_count=total // frame_length
+    frames=samples[:frame_count * frame_length].reshape(frame_count, frame_length).astype(np.float32)
+    levels=np.mean(frames ** 2, axis=1)
+
+    overlap=int(overlap_seconds * sample_rate)
+    search=int(min(search_seconds, window_seconds / 2) * sample_rate)
+    windows=[]
+    start=0
+    while start + window < total:
+        first_frame=(start + window - search) // frame_length
+        last_frame=(start + window) // frame_length
+        cut=(first_frame + int(np.argmin(levels[first_frame:last_frame]))) * frame_length
+        windows.append((start, min(total, cut + overlap)))
+        start=cut
+    windows.append((start, total))
+    return windows
+
+def _normalize_word(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+def stitch_transcripts(texts, max_overlap_words=25):
+    """
+    Join window transcripts, dropping the words at the start of each window
+    that repeat the end of the previous one (the longest matching run).
+    """
+    words=[]
+    for text in texts:
+        next_words=text.split()
+        limit=min(max_overlap_words, len(words), len(next_words))
+        tail=[_normalize_word(word) for word in words[-limit:]] if limit else []
+        head=[_normalize_word(word) for word in next_words[:limit]]
+        duplicated=0
+        for size in range(limit, 0, -1):
+            if tail[-size:] == head[:size]:
+                duplicated=size
+                break
+        words.extend(next_words[duplicated:])
+    return " ".join(words)
+
+def transcribe_long_audio(stt_model, audio_filepath, GROQ_API_KEY, language="en", use_cache=True,
+                          window_seconds=120, overlap_seconds=2, max_workers=None, metrics=None):
+    """
+    Transcribe a recording of any length. The audio is prepared (see
+    prepare_audio), split at pauses into overlapping windows, the windows are
+    transcribed concurrently on max_workers threads and the texts stitched
+    back together. Recordings shorter than one window take a single request.
+
+    Every window request takes a "groq" slot in the request scheduler, so at
+    most GROQ_MAX_CONCURRENT windows (default 2, shared with vision calls)
+    run at once, at GROQ_RATE_PER_MIN (default 30). More workers than that
+    only wait in the scheduler; raise those limits to transcribe faster.
+
+    Args:
+    stt_model (str): Whisper model name.
+    audio_filepath: Path, bytes, (filename, bytes) or binary file object holding the audio.
+    GROQ_API_KEY (str): Groq API key (falls back to the environment).
+    language (str): Spoken language hint.
+    use_cache (bool): Reuse transcripts (whole recording and per window).
+    window_seconds (float): Target window length.
+    overlap_seconds (float): Audio shared by consecutive windows.
+    max_workers (int): Windows transcribed at the same time (default: the scheduler's Groq concurrency).
+    metrics (dict): Optional dict that receives prepare_audio metrics plus window timings.
+    """
+    prepared=prepare_audio(audio_filepath)
+    metrics=metrics if metrics is not None else {}
+    metrics.update(prepared["metrics"])
+    samples=prepared["samples"]
+
+    if samples is None or len(samples) <= window_seconds * STT_SAMPLE_RATE:
+        metrics["windows"]=1
+        return _transcribe_data(stt_model, prepared["name"], prepared["data"], GROQ_API_KEY, language,
+                                use_cache, prepared["fingerprint"])
+
+    if use_cache:
+        cache_key=make_key("transcript", stt_model, language, prepared["fingerprint"])
+        cached_transcript=transcript_cache.get(cache_key)
+        if cached_transcript is not None:
+            metrics["windows"]=0
+            return cached_transcript
+
+    windows=split_into_windows(samples, STT_SAMPLE_RATE, window_seconds, overlap_seconds)
+    base_name=os.path.splitext(prepared["name"])[0]
+
+    def transcribe_window(index):
+        start, end=windows[index]
+        window_samples=samples[start:end]
+        started=time.perf_counter()
+        text=_transcribe_data(stt_model, f"{base_name}_{index}.flac", _encode_flac(window_samples, STT_SAMPLE_RATE),
+                              GROQ_API_KEY, language, use_cache,
+                              hashlib.sha256(window_samples.tobytes()).hexdigest())
+        return text, time.perf_counter() - started
+
+    if max_workers is None:
+        max_workers=scheduler.limiter("groq").max_concurrent
+    max_workers=max(1, min(max_workers, len(windows)))
+
+    started=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt-window") as executor:
+        # Each window runs in a copy of the caller's context so scheduler tags carry over
+        futures=[executor.submit(contextvars.copy_context().run, transcribe_window, index) for index in range(len(windows))]
+        results=[future.result() for future in futures]
+    transcript=stitch_transcripts([text for text, _ in results])
+
+    metrics.update(
+        windows=len(windows),
+        workers=max_workers,
+        window_seconds=[round((end - start) / STT_SAMPLE_RATE, 2) for start, end in windows],
+        window_latencies=[round(latency, 3) for _, latency in results],
+        wall_clock=round(time.perf_counter() - started, 3),
+    )
+    if use_cache and transcript:
+        transcript_cache.set(cache_key, transcript)
+    return transcript